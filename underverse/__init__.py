@@ -284,9 +284,20 @@ Module Documentation
 ====================
 
 """
-import sqlite3, uuid, time, jsonpickle
+import sqlite3, uuid, time, json, jsonpickle, re
+from contextlib import contextmanager
+from itertools import islice, groupby
 from underverse.predicates import Predicate as P#, Sorter
+from underverse.predicates import AND, OR, OrderBy
 from underverse.model import *
+from underverse.compiler import SQLCompiler
+from underverse.evaluator import RowCompiler
+from underverse.external import ExternalSort
+from underverse.catalog import Catalog
+from underverse.stats import Stats
+from underverse.codec import get_codec, register_codec
+from underverse.connection import Connection, Readers
+from underverse.ingest import Writer
 from underverse.ordereddict import OrderedDict
 from underverse.handlers import *
 
@@ -301,7 +312,7 @@ except ImportError:
   HAS_NUMPY = False
 
 
-__all__ = ['NecRow', 'Underverse', 'Verse', 'SubVerse', 'and_', 'or_', 'adapter', 'converter']
+__all__ = ['NecRow', 'Underverse', 'Verse', 'KeyValueStore', 'SubVerse', 'and_', 'or_', 'adapter', 'converter']
 
 ## TODO
 #
@@ -379,6 +390,9 @@ __all__ = ['NecRow', 'Underverse', 'Verse', 'SubVerse', 'and_', 'or_', 'adapter'
 and_ = ' and '
 or_ = ' or '
 
+# JSON types which SQlite returns as the same Python value the codecs would decode
+_PREFETCH = ('integer', 'real', 'text', 'null')
+
 class NecRow(dict):
   """
 
@@ -425,6 +439,10 @@ The persisted object can both get and set variables easily using the *dot* synta
         else:
           attrs.pop(0)
           for a in attrs:
+            # nested documents are decoded as dicts, the way SQlite's json_extract reads them
+            if isinstance(value, dict) and a in value:
+              value = value[a]
+              continue
             try:
               value = getattr(value, a)
             except Exception, e:
@@ -515,6 +533,94 @@ Here's another way to do it, but it's not the easiest. The first code example ma
     self.uuid = key
     self.value = value
 
+class LazyRow(NecRow):
+  """
+A document which hasn't been decoded yet.
+
+Lazy rows are used while a collection is being scanned (for example when ``find``
+has to check a ``udp`` in Python, or when a single column is read with ``verse.name``).
+They keep the encoded document and only decode it when it is needed. The attributes a
+query needs can be read by SQlite ahead of time, so documents which are rejected by the
+query, or which are only read for one attribute, are never decoded at all.
+
+Any access to an attribute which wasn't read ahead decodes the whole document. At that
+point the row turns into a normal ``NecRow``. Rows returned by ``find`` are always
+fully decoded.
+
+  """
+  def __init__(self, data, decode, values=None):
+    # the prefetched values are the only keys stored until the document is loaded
+    dict.__init__(self, values or ())
+    object.__setattr__(self, '_raw', data)
+    object.__setattr__(self, '_decode', decode)
+
+  def _materialize(self):
+    # decodes the document and turns the row into a NecRow. Kept private so that
+    # it doesn't hide a document attribute
+    return _decoded(self)
+
+  def __getitem__(self, key):
+    if dict.__contains__(self, key):
+      return dict.__getitem__(self, key)
+    return _decoded(self)[key]
+
+  def __contains__(self, key):
+    return dict.__contains__(self, key) or key in _decoded(self)
+
+  def get(self, key, default=None):
+    if dict.__contains__(self, key):
+      return dict.__getitem__(self, key)
+    return _decoded(self).get(key, default)
+
+def _attributes(attrs):
+  # the names of orderby / groupby attributes, given as a name, a Document or a list of them
+  if type(attrs) in (str, unicode, Document):
+    attrs = [attrs]
+  names = []
+  for attr in attrs:
+    if type(attr) == Document:
+      attr = attr._name
+    if not type(attr) in (str, unicode):
+      raise TypeError, "Order by arguments must be either str or Document types"
+    names.append(str(attr))
+  return names
+
+def _decoded(row):
+  # returns the row, decoding it first if it's a LazyRow
+  if type(row) is LazyRow:
+    dict.update(row, row._decode(row._raw))
+    object.__delattr__(row, '_raw')
+    object.__delattr__(row, '_decode')
+    object.__setattr__(row, '__class__', NecRow)
+    NecRow.__init__(row)
+  return row
+
+def _timestamp(value):
+  # the value stored in a created_at / updated_at column
+  return value if type(value) in (int, long, float) else None
+
+def _attribute(row, name):
+  # the value of an attribute, None if the document doesn't have it
+  if name in row:
+    return row[name]
+  try:
+    return getattr(row, name)
+  except Exception:
+    return None
+
+def __loads__(name):
+  # everything else needs the whole document
+  def method(self, *args, **kwargs):
+    return getattr(_decoded(self), name)(*args, **kwargs)
+  method.__name__ = name
+  return method
+
+for _name in ('__iter__', '__len__', '__repr__', '__str__', '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__cmp__',
+    '__setitem__', '__delitem__', '__setattr__', '__reduce__', '__reduce_ex__', 'has_key', 'keys', 'values', 'items',
+    'iterkeys', 'itervalues', 'iteritems', 'viewkeys', 'viewvalues', 'viewitems', 'copy', 'pop', 'popitem', 'setdefault',
+    'update', 'clear'):
+  setattr(LazyRow, _name, __loads__(_name))
+
 def adapter(data):
   return jsonpickle.encode(data)
 
@@ -549,15 +655,72 @@ Underverse instance. It will also operate on a list of dicts out of the box.
 
 Notice that the found document doesn't have a *UUID*, *created_at* or *updated_at* keys. This is because it was never loaded into SQlite.
 
+**Lazy SubVerses**
+
+A SubVerse can also be *lazy*. Instead of a list of documents, it holds a function
+which produces them. Filters, ``limit``, ``skip`` and ``paginate`` on a lazy SubVerse
+are chained together as generators, so the documents are streamed one at a time and
+no intermediate lists are built. The results are only stored in memory once ``len``
+is called or the SubVerse is indexed. Until then, every loop over the SubVerse
+re-runs the query.
+
+.. code-block:: python
+
+  # nothing is read from the database here
+  results = uv.people.stream(Document.age > 25, Document.gender == 'F').skip(10).limit(50)
+
+  # the documents are streamed from SQlite through the filters
+  for person in results:
+    print person
+
+  # the results are stored at this point
+  print len(results)
+
   """
-  def __init__(self, division):
+  def __init__(self, division, lazy=False):
     super(SubVerse, self).__init__()
-    self.division = division
+    if lazy:
+      if not callable(division):
+        raise TypeError, "Lazy SubVerses must be given a function which returns an iterator"
+      self._pipeline = division
+      self._division = None
+    else:
+      self._pipeline = None
+      self._division = division
+
+  def _get_division(self):
+    if self._pipeline is not None:
+      self._division = list(self._pipeline())
+      self._pipeline = None
+    return self._division
+
+  def _set_division(self, division):
+    self._pipeline = None
+    self._division = division
+
+  division = property(_get_division, _set_division)
+
+  @property
+  def _lazy(self):
+    # True if the results haven't been stored in memory yet. Kept private, the public
+    # attributes of a SubVerse read the documents' columns
+    return self._pipeline is not None
+
+  @staticmethod
+  def __filter__(array, filters):
+    '''
+    Chains the filters together over the given iterable. Conditions which follow each
+    other are compiled into one function (see ``underverse.evaluator``), so each row
+    is checked against all of them in a single pass.
+    '''
+    return RowCompiler().pipeline(array, filters)
 
   def find(self, *filters):
     """
 Filters a list of NecRows based on input conditions searches verse for true predicates
 
+If the SubVerse is lazy, so are the results.
+
 .. seealso::
 
   You can look at the find function for *Verse* to get an example on how to query.
@@ -567,24 +730,24 @@ Filters a list of NecRows based on input conditions searches verse for true pred
     if len(filters) == 0:
       return self
 
-    def filter_(array, attr, predicate):
-      true = []
-      for row in array:
-        if attr in row or hasattr(row, attr):
-          if predicate(row):
-            true.append(row)
-      return true
-
-    result = iter(self)
-    for _filter in filters:
-      if hasattr(_filter, '__predicate__'):
-        result = filter_(result, _filter._name, _filter._predicate)
-      elif callable(_filter):
-        result = _filter(result)
-      else:
-        raise TypeError, "Filter given isn't recognized"
+    if self._lazy:
+      for _filter in filters:
+        if not hasattr(_filter, '__predicate__') and not callable(_filter):
+          raise TypeError, "Filter given isn't recognized"
+      return SubVerse(lambda: SubVerse.__filter__(self, filters), lazy=True)
+
+    return SubVerse(list(SubVerse.__filter__(self, filters)))
+
+  def stream(self, *filters):
+    """
+    Same as ``find``, but the results are a lazy SubVerse.
 
-    return SubVerse([r for r in result])
+    .. seealso::
+
+      Look at the SubVerse class description for how lazy SubVerses work.
+    """
+    source = SubVerse(lambda: iter(self), lazy=True)
+    return source.find(*filters)
 
   def find_one(self, *filters):
     """
@@ -604,28 +767,29 @@ Filters a list of NecRows based on input conditions searches verse for true pred
       return one[0]
     return None
 
-  def paginate(self, count):
+  def paginate(self, count, orderby=None, memory=None):
     """
     Pages the collection.
 
     If a collection has 5000 documents, calling ``verse.paginate(500)`` will return 10 pages of 500 documents each.
+    The documents can be sorted first with ``orderby`` (an attribute or a list of them), see ``orderby``
+    for the ``memory`` argument.
 
     .. seealso::
 
       Look at the *paginate* function for Verse to see an example.
     """
-    page = []
-    for doc in self:
-
-      if len(page) % count == 0 and len(page) > 0:
-        yield page
-        page = []
-      page.append(doc)
-    if len(page) > 0:
+    if orderby is None:
+      docs = iter(self)
+    else:
+      docs = iter(self.orderby(*_attributes(orderby), memory=memory))
+    page = list(islice(docs, count))
+    while len(page) > 0:
       yield page
+      page = list(islice(docs, count))
 
   def __getattr__(self, attr):
-    for a in self.division:
+    for a in self:
       if attr in a or hasattr(a, attr):
         yield getattr(a, attr)
 
@@ -639,7 +803,7 @@ Converts the given attributes to a NumPy recarray. This can provide a speed boos
 
     """
     if HAS_NUMPY:
-      return QuasiDead.from_dicts(self.division, *cols)
+      return QuasiDead.from_dicts(self, *cols)
     else:
       raise Exception, "NumPy must be installed to use this function."
 
@@ -647,7 +811,9 @@ Converts the given attributes to a NumPy recarray. This can provide a speed boos
     return len(self.division)
 
   def __iter__(self):
-    return iter(self.division)
+    if self._pipeline is not None:
+      return iter(self._pipeline())
+    return iter(self._division)
 
   def __getitem__(self, _slice):
     return self.division[_slice]
@@ -677,16 +843,23 @@ Converts the given attributes to a NumPy recarray. This can provide a speed boos
       expanded_results.append(tmp)
     return expanded_results
 
-  def groupby(self, *attrs):
+  def groupby(self, *attrs, **kwargs):
     """
 Grouping data can be extremely powerful in data analysis. Therefore, data grouping and aggregation
 in Underverse does not hold back nor does it disappoint.
 
+With a ``memory`` budget, the groups are found by sorting the documents (see ``orderby``)
+and are returned one at a time, in order.
+
 .. seealso::
 
   Please look at the *groupby* functionality for a Verse for a more comprehensive usage explanation.
 
     """
+    memory, codec = SubVerse.__sortargs__(kwargs)
+    if memory is not None:
+      orderby = OrderBy(*_attributes(attrs))
+      return SubVerse.__sortedgroups__(SubVerse.__external__(self, orderby, memory, codec), orderby)
     groups = []
     for attr in attrs:
       if not attr in groups:
@@ -710,6 +883,108 @@ in Underverse does not hold back nor does it disappoint.
 
     return SubVerse.__expandmap__(data)
 
+  @staticmethod
+  def __aggregates__(by, aggregates):
+    '''
+    Checks the arguments of ``aggregate`` and returns the group by attributes and
+      a list of (function, attribute) tuples.
+    '''
+    if type(by) in (str, unicode, Document):
+      by = [by]
+    names = []
+    for attr in by:
+      if type(attr) == Document:
+        attr = attr._name
+      if not type(attr) in (str, unicode):
+        raise TypeError, "Aggregate by arguments must be either str or Document types"
+      if not attr in names:
+        names.append(attr)
+
+    aggregates = dict(aggregates)
+    columns = []
+    if aggregates.pop('count', False):
+      columns.append(('count', None))
+    for function in ('sum', 'avg', 'min', 'max'):
+      attrs = aggregates.pop(function, None)
+      if attrs is None:
+        continue
+      if type(attrs) in (str, unicode, Document):
+        attrs = [attrs]
+      for attr in attrs:
+        if type(attr) == Document:
+          attr = attr._name
+        if not type(attr) in (str, unicode):
+          raise TypeError, "Aggregate attributes must be either str or Document types"
+        columns.append((function, attr))
+    if len(aggregates) > 0:
+      raise TypeError, "Unknown aggregates: %s" % ', '.join(aggregates)
+    if len(columns) == 0:
+      raise TypeError, "aggregate requires at least one of count, sum, avg, min or max"
+    return names, columns
+
+  @staticmethod
+  def __aggregate__(rows, names, columns):
+    '''
+    Calculates the aggregates in Python, the same way SQlite would.
+    '''
+    groups = OrderedDict()
+    for row in rows:
+      key = tuple(_attribute(row, name) for name in names)
+      if not key in groups:
+        groups[key] = [[] for c in columns]
+      for values, (function, attr) in zip(groups[key], columns):
+        if function == 'count':
+          values.append(1)
+        else:
+          value = _attribute(row, attr)
+          if value is not None:
+            values.append(value)
+
+    results = OrderedDict()
+    for key, group in groups.items():
+      results[key] = []
+      for values, (function, attr) in zip(group, columns):
+        if function == 'count':
+          results[key].append(len(values))
+        elif len(values) == 0:
+          results[key].append(None)
+        elif function == 'sum':
+          results[key].append(sum(values))
+        elif function == 'avg':
+          results[key].append(float(sum(values)) / len(values))
+        else:
+          results[key].append(min(values) if function == 'min' else max(values))
+    return results
+
+  @staticmethod
+  def __expandaggregates__(results, columns):
+    '''
+    Expands the aggregates into rows, with a single value or a dict of them as the last item.
+    '''
+    for key, values in results.items():
+      if len(columns) == 1:
+        results[key] = values[0]
+      else:
+        results[key] = dict((function if attr is None else '%s(%s)' % (function, attr), value) for (function, attr), value in zip(columns, values))
+    return SubVerse.__expandmap__(results, wrap=False)
+
+  def aggregate(self, by=(), where=None, **aggregates):
+    """
+    Counts, sums, averages and finds the minimum and maximum of attributes for each group.
+
+    .. seealso::
+
+      Please look at the *aggregate* functionality for a Verse for a more comprehensive usage explanation.
+    """
+    names, columns = SubVerse.__aggregates__(by, aggregates)
+    if where is None:
+      rows = self
+    elif type(where) in (list, tuple):
+      rows = self.find(*where)
+    else:
+      rows = self.find(where)
+    return SubVerse.__expandaggregates__(SubVerse.__aggregate__(rows, names, columns), columns)
+
   def unique(self, *attrs):
     """
     Finds all the unique values for one or more columns
@@ -869,10 +1144,22 @@ will be a tuple, with the last value being the mapped data
     '''
     return self.reduce(self.map(mapper, expand=False), reducer, expand, sort)
 
-  def orderby(self, *attrs):
+  def orderby(self, *attrs, **kwargs):
     """
 Orders a SubVerse by the attributes given
+
+Documents which don't fit in memory can be sorted by giving a ``memory`` budget in bytes.
+The sorted runs are written to temporary files with a ``codec`` (``jsonpickle`` by default,
+see ``underverse.external``) and a lazy SubVerse is returned, which merges them back as
+it's read.
+
+.. code-block:: python
+
+  for doc in uv.logs.stream(D.level == 'ERROR').orderby('-time', memory=32 * 1024 * 1024):
+    print doc.time
+
     """
+    memory, codec = SubVerse.__sortargs__(kwargs)
     groups = []
     for attr in attrs:
       if not attr in groups:
@@ -882,9 +1169,44 @@ Orders a SubVerse by the attributes given
           groups.append(attr)
         else:
           raise TypeError, "Order by arguments must be either str or Document types"
+    if memory is not None:
+      orderby = OrderBy(*groups)
+      return SubVerse(lambda: SubVerse.__external__(self, orderby, memory, codec), lazy=True)
     if len(groups) == 0:
       return sorted(self)
     return P.orderby(*groups)(self)
+
+  @staticmethod
+  def __sortargs__(kwargs):
+    '''
+    Returns the memory budget and codec of an external sort from the keyword arguments.
+    '''
+    memory = kwargs.pop('memory', None)
+    codec = get_codec(kwargs.pop('codec', None))
+    if len(kwargs) > 0:
+      raise TypeError, "Unknown arguments: %s" % ', '.join(kwargs)
+    return memory, codec
+
+  @staticmethod
+  def __external__(docs, orderby, memory, codec):
+    '''
+    Sorts the documents with an ExternalSort, yields them in order. The codec gives the
+    documents back with their own type (NecRow, dict or object), like the in-memory sort.
+    '''
+    values = orderby.values()
+    encode = codec.encode
+    decode = codec.decode
+    rows = ((values(doc), encode(doc)) for doc in docs)
+    for data in ExternalSort(orderby, memory).sort(rows):
+      yield decode(data)
+
+  @staticmethod
+  def __sortedgroups__(docs, orderby):
+    '''
+    Groups sorted documents, yields a row for every group like groupby.
+    '''
+    for key, group in groupby(docs, orderby.values()):
+      yield list(key) + [SubVerse(list(group))]
     # return sorted(self, key=lambda x: tuple([getattr(x, arg) for arg in groups]))
 
   def limit(self, count):
@@ -903,7 +1225,7 @@ Orders a SubVerse by the attributes given
     """
 This performs join operations on the current SubVerse.
     """
-    return Join(self.division, right, alias)
+    return Join(self, right, alias)
 
 class Verse(object):
   """
@@ -927,18 +1249,221 @@ The code above creates a new collection if it doen't currently exist
 or connects to an existing collection.
 
   """
-  def __init__(self, connection, name):
+  # temporary table for remove_many
+  KEYS = '__underverse_keys__'
+
+  # document attributes which are also stored in their own indexed column
+  TIMESTAMPS = ('created_at', 'updated_at')
+
+  # the attribute statistics are saved once this many rows have been written (see _save)
+  STATS_EVERY = 1000
+
+  def __init__(self, connection, name, codec=None):
     super(Verse, self).__init__()
     self._connection = connection
     self._name = name
-    self._len = -1
-    self._dirty = True
 
     # self.connection.create_function("has", 2, has)
     # self.connection.create_function("get", 2, get)
     # self.connection.create_function("eq", 3, eq)
     self._cursor = self._connection.cursor()
-    self._cursor.execute("create table if not exists %s (uuid unique, data necro);" % name)
+    self._cursor.execute("create table if not exists %s (id integer primary key, uuid unique, data necro, created_at real, updated_at real);" % name)
+    self._layout()
+
+    # the handle keeps the collection's metadata, Underverse reuses it for every uv.<name>
+    self._version = 0
+    self._stats = None
+    self._synced = None
+    self._scalars = {}
+    self._unsaved = 0
+    metadata = Catalog(self._connection).items(name)
+    self._indexes = metadata.get('indexes', {})
+    self._text = metadata.get('text')
+    self._codec = self._load_codec(codec, metadata.get('codec'))
+
+  def _load_codec(self, codec, stored=None):
+    # the codec is stored in the catalog, collections without one use jsonpickle
+    catalog = Catalog(self._connection)
+    if codec is None:
+      return get_codec(stored)
+    codec = get_codec(codec)
+    if codec.name != (stored or get_codec().name):
+      if len(self) > 0:
+        raise ValueError, "Collection '%s' already stores documents with the '%s' codec" % (self._name, stored or get_codec().name)
+      catalog.set(self._name, 'codec', codec.name)
+    return codec
+
+  def _layout(self):
+    # collections created by older versions only have the uuid and data columns (see migrate)
+    columns = [row[1] for row in self._connection.execute('pragma table_info(%s)' % self._name)]
+    self._timestamps = all(c in columns for c in Verse.TIMESTAMPS)
+    if self._timestamps:
+      self._system = dict((c, c) for c in Verse.TIMESTAMPS)
+      self._insert = "insert into %s (uuid, data, created_at, updated_at) values (?, ?, ?, ?)" % self._name
+      self._update = "update %s set data=?, created_at=?, updated_at=? where uuid=?;" % self._name
+      if not self._name in getattr(self._connection, '_loading', ()):
+        for column in Verse.TIMESTAMPS:
+          self._cursor.execute('create index if not exists "%s__%s" on %s (%s);' % (self._name, column, self._name, column))
+    else:
+      self._system = {}
+      self._insert = "insert into %s (uuid, data) values (?, ?)" % self._name
+      self._update = "update %s set data=? where uuid=?;" % self._name
+
+  def _row(self, uuid, data, necro):
+    # the parameters of the insert statement
+    if self._timestamps:
+      return uuid, data, _timestamp(necro.get('created_at')), _timestamp(necro.get('updated_at'))
+    return uuid, data
+
+  def _change(self, data, necro):
+    # the parameters of the update statement. created_at is written too, the document's
+    # value may have been changed
+    if self._timestamps:
+      return data, _timestamp(necro.get('created_at')), _timestamp(necro.get('updated_at')), necro.uuid
+    return data, necro.uuid
+
+  def _compiler(self):
+    return SQLCompiler(columns=self._system, json=self._codec.json, scalar=self._scalar)
+
+  def migrate(self):
+    """
+Moves a collection created by an older version of Underverse to the current storage layout.
+The table is rebuilt with an ``id`` key and ``created_at`` / ``updated_at`` columns, which are
+filled in from the documents and indexed. The collection's indexes are created again.
+
+Returns False if the collection already uses the current layout.
+
+.. code-block:: python
+
+  uv = Underverse('old.db')
+  uv.events.migrate()
+
+  # now served by the index on the created_at column
+  recent = uv.events.find(D.created_at > time.time() - 3600)
+
+.. seealso::
+
+  ``Underverse.migrate`` migrates every collection in the database.
+
+    """
+    if self._timestamps:
+      return False
+    name = self._name
+    old = '%s__underverse_migrate' % name
+    connection = self._connection
+    with connection.batch():
+      before = connection.total_changes
+      connection.execute('alter table %s rename to "%s";' % (name, old))
+      connection.execute("create table %s (id integer primary key, uuid unique, data necro, created_at real, updated_at real);" % name)
+      if self._codec.json:
+        columns = ["case when json_type(data, '$.%s') in ('integer', 'real') then json_extract(data, '$.%s') end" % (c, c) for c in Verse.TIMESTAMPS]
+        connection.execute('insert into %s (id, uuid, data, created_at, updated_at) select rowid, uuid, data, %s from "%s";' % (name, ', '.join(columns), old))
+      else:
+        connection.execute('insert into %s (id, uuid, data) select rowid, uuid, data from "%s";' % (name, old))
+        decode = self._codec.decode
+        rows = connection.execute('select id, data from %s;' % name).fetchall()
+        connection.executemany('update %s set created_at=?, updated_at=? where id=?;' % name,
+          ((_timestamp(doc.get('created_at')), _timestamp(doc.get('updated_at')), rowid) for rowid, doc in ((r[0], decode(r[1])) for r in rows)))
+      # the old indexes are dropped with the table
+      connection.execute('drop table "%s";' % old)
+      connection._account(before)
+      self._layout()
+      for index, fields in self.indexes().items():
+        self.create_index(*fields, name=index)
+      if self._text is not None:
+        self._text_triggers()
+    return True
+
+  @property
+  def codec(self):
+    """
+The codec used to store the documents of this collection (see ``underverse.codec``).
+    """
+    return self._codec
+
+  @property
+  def version(self):
+    """
+Counts the changes made through this handle. It goes up on every ``add``, ``update``,
+``remove`` and ``purge``, so it can be used to tell whether results computed from the
+collection are out of date.
+    """
+    return self._version
+
+  def _statistics(self):
+    # the collection's Stats, reloaded when another connection commits and counted
+    # again when rows were written without going through a Verse
+    connection = self._connection
+    if connection._foreign():
+      # other threads read the statistics last committed, through their own connection
+      reader = connection.reader()
+      return self._stored(reader) or self._counted(reader, Stats())
+
+    stamp = connection._stamp(), connection.execute('pragma data_version').fetchone()[0]
+    if self._stats is not None and stamp == self._synced:
+      return self._stats
+
+    stats = self._stats
+    if stats is None or stamp[1] != self._synced[1]:
+      stats = self._stored(connection)
+    if stats is None or (self._synced is not None and stamp[0] != self._synced[0]):
+      stats = self._counted(connection, stats or Stats())
+      connection._dirty.add(self)
+    self._stats = stats
+    self._synced = stamp
+    return stats
+
+  def _stored(self, connection):
+    # the statistics saved in the catalog, None if there aren't any
+    stored = Catalog(connection).items(self._name)
+    if not 'stats' in stored and not 'count' in stored:
+      return None
+    stats = Stats.load(stored['stats']) if 'stats' in stored else Stats()
+    if 'count' in stored:
+      # saved on every commit, the attribute statistics may be older
+      stats.recount(*stored['count'])
+    return stats
+
+  def _counted(self, connection, stats):
+    # counts the documents again with SQlite
+    count, size = connection.execute('select count(*), total(length(data)) from %s' % self._name).fetchone()
+    stats.recount(count, int(size))
+    return stats
+
+  def _written(self, before):
+    # the rows written since total_changes was 'before' are already in the statistics
+    self._unsaved += self._connection.total_changes - before
+    self._connection._account(before)
+    self._connection._dirty.add(self)
+    self._version += 1
+
+  def _save(self, full=False):
+    # the document count and size are saved on every commit, so other connections always
+    # have the right len(). The attribute statistics are larger, they are saved every
+    # STATS_EVERY rows, at the end of a batch and when the database is closed
+    if self._stats is None:
+      return
+    catalog = Catalog(self._connection)
+    if full or self._unsaved >= Verse.STATS_EVERY:
+      catalog.set(self._name, 'stats', self._stats.dump(), commit=False)
+      self._unsaved = 0
+      self._connection._unsaved.discard(self)
+    else:
+      self._connection._unsaved.add(self)
+    catalog.set(self._name, 'count', [self._stats.count, self._stats.size], commit=False)
+
+  def _encoder(self, count):
+    # encodes documents and counts them in a separate Stats, which is only merged into
+    # the collection's statistics once the documents have been written
+    encode = self._codec.encode
+    def encoder(doc):
+      data = encode(doc)
+      count(doc, len(data))
+      return data
+    return encoder
+
+  def _decode(self, data):
+    return NecRow(self._codec.decode(data))
 
   def add_column(self, array, name, commit=True):
     """
@@ -1040,7 +1565,10 @@ Adds a NecRow or a list of NecRows to the database.
   Bulk inserts are noticibly faster
 
     """
-    self._dirty = True
+    before = self._connection.total_changes
+    stats, added = self._statistics(), Stats()
+    encode = self._encoder(added.add)
+    row = self._row
 
     try:
       if hasattr(necro, '__iter__') and type(necro) != NecRow and type(necro) != dict and not isinstance(necro, NecRow):
@@ -1058,28 +1586,149 @@ Adds a NecRow or a list of NecRows to the database.
                   necro.update({'__data__':n})
               else:
                 necro = NecRow(dict(n))
-              yield (str(necro.uuid), adapter(necro),)
+              yield row(str(necro.uuid), encode(necro), necro)
             else:
-              yield (str(n.uuid), adapter(n),)
-
-        self._cursor.executemany("insert into %s (uuid, data) values (?, ?)" % self._name, generator(necro))
-
-      elif type(necro) is NecRow or isinstance(necro, NecRow):
-        self._cursor.execute("insert into %s (uuid, data) values (?, ?)" % self._name, (necro.uuid, adapter(necro)))
-      elif type(necro) is dict:
-        necro = NecRow(dict(necro))
-        self._cursor.execute("insert into %s (uuid, data) values (?, ?)" % self._name, (necro.uuid, adapter(necro)))
-      elif hasattr(necro, '__dict__'):
-        necro = NecRow(necro.__dict__)
-        self._cursor.execute("insert into %s (uuid, data) values (?, ?)" % self._name, (necro.uuid, adapter(necro)))
+              yield row(str(n.uuid), encode(n), n)
+
+        self._cursor.executemany(self._insert, generator(necro))
+        # rows written before an error aren't accounted for, so they are counted again later
+        stats.merge(added)
+
       else:
-        raise ValueError, "Document could not be loaded. Please look at documentation for examples of loading data."
+        if type(necro) is dict:
+          necro = NecRow(dict(necro))
+        elif not isinstance(necro, NecRow):
+          if not hasattr(necro, '__dict__'):
+            raise ValueError, "Document could not be loaded. Please look at documentation for examples of loading data."
+          necro = NecRow(necro.__dict__)
+        # a single document is counted once it's written
+        data = self._codec.encode(necro)
+        self._cursor.execute(self._insert, row(necro.uuid, data, necro))
+        stats.add(necro, len(data))
     except:
       raise
       # raise TypeError, "Add argument must be of type NecRow or a list of NecRows"
 
+    self._written(before)
     self._connection.commit()
-    return self._cursor.execute("select changes();").fetchone()[0]
+    return self._cursor.rowcount
+
+  def batch(self, every=None):
+    """
+Groups the writes made to the database into one transaction.
+
+Normally ``add``, ``update`` and ``remove`` commit after every call. Inside of a batch,
+the changes are only committed once the batch ends. If an exception is raised, all
+of the changes are rolled back.
+
+.. code-block:: python
+
+  with users.batch():
+    for user in new_users:
+      users.add(user)
+
+  # commits every 10,000 rows
+  with events.batch(every=10000):
+    for event in stream:
+      events.add(event)
+
+The batch covers the whole database, not only this collection. It is the same as ``Underverse.batch``.
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Each commit waits for the data to be written to disk. Adding documents one at a
+    time inside of a batch is about as fast as a bulk ``add``.
+
+    """
+    return self._connection.batch(every)
+
+  @contextmanager
+  def bulk_load(self, every=None):
+    """
+Loads large amounts of data as fast as possible.
+
+While the ``with`` block runs, the collection's indexes are dropped, the connection uses
+the ``bulk_load`` pragma profile (see ``Underverse.tune``) and all the writes are part of
+one ``batch``. When the block ends, the data is committed, the indexes are rebuilt and the
+previous pragmas are restored. Indexes created during the load are also only built at the end.
+
+.. code-block:: python
+
+  uv = Underverse('nightly.db')
+  with uv.events.bulk_load():
+    for chunk in chunks:
+      uv.events.add(chunk)
+
+.. warning::
+
+  The ``bulk_load`` profile doesn't sync data to disk. If the machine crashes during the load, the database may be corrupted.
+
+    """
+    if self._name in self._connection._loading:
+      raise ValueError, "Collection '%s' is already being bulk loaded" % self._name
+    previous = self._connection.tune('bulk_load')
+    indexes = self.indexes().keys()
+    if self._timestamps:
+      indexes.extend('%s__%s' % (self._name, c) for c in Verse.TIMESTAMPS)
+    for name in indexes:
+      self._cursor.execute('drop index if exists "%s";' % name)
+    self._connection.commit()
+    self._connection._loading.add(self._name)
+    try:
+      with self.batch(every):
+        yield self
+    finally:
+      self._connection._loading.discard(self._name)
+      self._layout()
+      for name, fields in self.indexes().items():
+        self.create_index(*fields, name=name)
+      self._connection.tune(**previous)
+
+  def writer(self, size=1000, interval=0.1, maxsize=10000):
+    """
+Returns a ``underverse.ingest.Writer``, which adds documents to the collection from a
+background thread. It's made for many threads adding documents at high rates.
+
+.. code-block:: python
+
+  uv = Underverse('events.db')
+  writer = uv.events.writer()
+
+  # in each producer thread
+  future = writer.add({'type': 'click'})
+
+  # waits for everything added so far to be committed
+  writer.flush()
+  writer.close()
+
+The documents are written ``size`` at a time, in one transaction, or after ``interval``
+seconds when fewer arrive. ``add`` blocks once ``maxsize`` calls are waiting to be written.
+See the ``underverse.ingest`` module for the details.
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Producers don't wait for SQlite or for each other, and each group of documents is
+    inserted with a single ``executemany`` and commit instead of one of each per ``add``.
+
+.. note::
+
+  The writer has its own connection to the database, so it can't be used with in-memory
+  databases.
+
+    """
+    path = self._connection.execute('pragma database_list').fetchone()[2]
+    if not path:
+      raise ValueError, "Writers can only be used with on-disk databases"
+    name, codec = self._name, self._codec.name
+    def connect():
+      return Verse(sqlite3.connect(path, detect_types=sqlite3.PARSE_COLNAMES, factory=Connection), name, codec)
+    # the collection and its codec are created before the writer connects
+    self._connection.commit()
+    return Writer(connect, size, interval, maxsize)
 
   def all(self):
     """
@@ -1113,13 +1762,185 @@ not have the 'last_name' attribute it is currently skipped.
   containing a given attribute.
 
     """
-    return getattr(self.all(), attr)
+    return (values[0] for values in self.select(attr))
 
   def __iter__(self):
-    for n in self._cursor.execute('select data as "data [necro]" from %s' % self._name):
-      yield n[0]
+    decode = self._decode
+    # uses its own cursor, the handle is shared by everyone using uv.<name>
+    for n in self._connection.reader().execute('select data from %s' % self._name):
+      yield decode(n[0])
+
+  def _select(self, where=None, params=(), order=None, limit=None, offset=None, lazy=None):
+    # uses its own cursor so a query can run while the collection is being iterated
+    # if 'lazy' is given, LazyRows are returned with those attributes read ahead
+    keys = []
+    if lazy is not None and self._codec.json:
+      for key in lazy:
+        if SQLCompiler.translatable(key) and not '.' in key and not key in keys:
+          keys.append(key)
+    columns = ['data'] + ["json_type(data, '$.%s'), json_extract(data, '$.%s')" % (k, k) for k in keys]
+    sql = self._sql(columns, where, order, limit, offset)
+    connection = self._connection.reader()
+    if lazy is None:
+      decode = self._decode
+      for n in connection.execute(sql, params):
+        yield decode(n[0])
+      return
+
+    decode = self._codec.decode
+    for n in connection.execute(sql, params):
+      values = {}
+      for i, key in enumerate(keys):
+        _type = n[2*i+1]
+        if _type in _PREFETCH:
+          values[key] = n[2*i+2]
+        elif _type == 'true' or _type == 'false':
+          values[key] = _type == 'true'
+      yield LazyRow(n[0], decode, values)
+
+  def _sql(self, columns, where=None, order=None, limit=None, offset=None):
+    sql = 'select %s from %s' % (', '.join(columns), self._name)
+    if where is not None:
+      sql += ' where ' + where
+    if order is not None:
+      sql += ' order by ' + order
+    if limit is not None or offset:
+      sql += ' limit %d' % (-1 if limit is None else limit)
+    if offset:
+      sql += ' offset %d' % offset
+    return sql
+
+  def _project(self, names, where=None, params=(), order=None, limit=None, offset=None):
+    # yields (rowid, values) tuples for the given attributes, read by SQlite
+    compiler = self._compiler()
+    columns = ['rowid']
+    for name in names:
+      columns.append(compiler.type(name))
+      columns.append(compiler.field(name))
+    connection = self._connection.reader()
+    for n in connection.execute(self._sql(columns, where, order, limit, offset), params):
+      yield n[0], self._values(connection, n, names)
+
+  def _values(self, connection, n, names):
+    # the attribute values of a row read with _project's columns
+    values = []
+    for i in xrange(len(names)):
+      _type = n[2*i+1]
+      if _type in _PREFETCH or _type is None:
+        values.append(n[2*i+2])
+      elif _type == 'true' or _type == 'false':
+        values.append(_type == 'true')
+      else:
+        # objects and lists have to be decoded by the codec
+        doc = self._decode(connection.execute('select data from %s where rowid = ?' % self._name, (n[0],)).fetchone()[0])
+        return tuple(_attribute(doc, name) for name in names)
+    return tuple(values)
+
+  def _rows(self, rowids):
+    # yields the documents with the given rowids, in the order they were added
+    sql = 'select data from %s where rowid in (select value from json_each(?)) order by rowid' % self._name
+    decode = self._decode
+    for n in self._connection.reader().execute(sql, (json.dumps(rowids),)):
+      yield decode(n[0])
+
+  def _scan(self, query, filters, keys=(), decode=True):
+    # streams the documents through the filters. The leading row-wise filters run
+    # on LazyRows, which are decoded before anything else sees them
+    head, names = Verse._rowwise(filters)
+    rows = SubVerse.__filter__(self._select(lazy=list(keys) + names, **(query or {})), filters[:head])
+    if decode or head < len(filters):
+      rows = SubVerse.__filter__((_decoded(row) for row in rows), filters[head:])
+    return rows
 
-  def groupby(self, *attrs):
+  @staticmethod
+  def _rowwise(filters):
+    # counts the leading filters which only look at one document at a time (these
+    # can run on LazyRows) and returns the attributes they use
+    def names(_filter):
+      if isinstance(_filter, Document) and hasattr(_filter, '__predicate__'):
+        return [_filter._name.split('.')[0]]
+      elif type(_filter) in (AND, OR):
+        found = []
+        for f in _filter.filters:
+          n = names(f)
+          if n is None:
+            return None
+          found.extend(n)
+        return found
+      return None
+
+    keys = []
+    for count, _filter in enumerate(filters):
+      n = names(_filter)
+      if n is None:
+        return count, keys
+      keys.extend(n)
+    return len(filters), keys
+
+  def _plan(self, filters):
+    # splits find filters into the arguments for _select and the filters left for Python
+    compiler = self._compiler()
+    where, params, filters = compiler.split(filters)
+    query = {}
+    if where is not None:
+      query.update(where=where, params=params)
+
+    # conditions left for Python don't change the order, so a sort after them can
+    # still be done by SQlite
+    head = Verse._rowwise(filters)[0]
+    if head < len(filters) and isinstance(filters[head], OrderBy):
+      order = self._order(filters[head].attrs)
+      if order is not None:
+        query['order'] = order
+        filters = filters[:head] + filters[head + 1:]
+
+    _slice, rest = compiler.slice(filters)
+    if _slice is not None:
+      query.update(limit=_slice.limit, offset=_slice.skip)
+      filters = rest
+    return query or None, filters
+
+  def _order(self, attrs):
+    # compiles orderby arguments into an ORDER BY clause, None if it can't be done in SQL
+    compiler = self._compiler()
+    columns = []
+    for attr in attrs:
+      if type(attr) == Document:
+        attr = attr._name
+      if type(attr) != str:
+        return None
+      desc = attr.startswith('-')
+      if desc:
+        attr = attr[1:]
+      if not compiler.supports(attr):
+        return None
+      if not attr in compiler.columns and not self._scalar(attr):
+        return None
+      columns.append(compiler.field(attr) + (' desc' if desc else ''))
+    if len(columns) == 0:
+      return None
+    # rowid keeps ties in insertion order, the same as Python's stable sort
+    columns.append('rowid')
+    return ', '.join(columns)
+
+  def _scalar(self, attr):
+    # json_extract returns objects and arrays as text, which SQlite sorts among the strings.
+    # Python sorts them by type, so attributes which hold them can't be sorted (or compared
+    # with strings) by SQlite. When the statistics don't know, the collection is checked
+    # for one, the answer is kept until the collection changes
+    if not '.' in attr and self._statistics().scalar(attr):
+      return True
+    stamp = None if self._connection._foreign() else (self._version, self._synced)
+    cached = self._scalars.get(attr)
+    if stamp is not None and cached is not None and cached[0] == stamp:
+      return cached[1]
+    sql = "select 1 from %s where %s in ('object', 'array') limit 1" % (self._name, SQLCompiler(columns=self._system).type(attr))
+    scalar = self._connection.reader().execute(sql).fetchone() is None
+    if stamp is not None:
+      self._scalars[attr] = stamp, scalar
+    return scalar
+
+  def groupby(self, *attrs, **kwargs):
     """
 The grouping of similar data is essential to most
 data analysis operations. This function is similar in
@@ -1152,11 +1973,133 @@ state.
 
 You can group by more than one column as well, such as ``members.groupy('state', 'county')``.
 
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The group keys are read with ``select``, so the documents aren't decoded while they're grouped.
+    Each group is a lazy SubVerse, which only reads its documents when it is used.
+
+    For collections with too many documents to keep track of, give a ``memory`` budget in
+    bytes. The collection is then sorted by the attributes (see ``orderby``) and an iterator
+    of the groups is returned, in order, with one group in memory at a time.
+
     """
-    return self.all().groupby(*attrs)
+    memory = kwargs.pop('memory', None)
+    if len(kwargs) > 0:
+      raise TypeError, "Unknown arguments: %s" % ', '.join(kwargs)
+    names = []
+    for attr in attrs:
+      if type(attr) == Document:
+        attr = attr._name
+      if type(attr) != str:
+        raise TypeError, "Group by arguments must be either str or Document types"
+      if not attr in names:
+        names.append(attr)
+
+    if memory is not None:
+      orderby = OrderBy(*names)
+      return SubVerse.__sortedgroups__(self._sorted(orderby, memory), orderby)
+    if not all(self._compiler().supports(n) for n in names):
+      return self.all().groupby(*attrs)
+
+    groups = {}
+    for rowid, key in self._project(names):
+      if not key in groups:
+        groups[key] = []
+      groups[key].append(rowid)
+    for key, rowids in groups.items():
+      groups[key] = SubVerse(lambda rowids=rowids: self._rows(rowids), lazy=True)
+    return SubVerse.__expandmap__(groups, wrap=False)
+
+  def aggregate(self, by=(), where=None, **aggregates):
+    """
+Counts, sums, averages and finds the minimum and maximum of attributes, optionally
+grouped by one or more attributes. This is the same as grouping the collection and
+reducing each group, without having to hold the documents in memory.
+
+.. code-block:: python
+
+  # number of people of each gender
+  for gender, count in uv.people.aggregate(by='gender', count=True):
+    print gender, count
+
+  # several aggregates at once, with the same conditions as ``find``
+  for gender, college, stats in uv.people.aggregate(by=['gender', 'college'], where=D.age > 21,
+      count=True, sum='friends', avg=['age', 'friends']):
+    print gender, college, stats['count'], stats['sum(friends)'], stats['avg(age)']
+
+``count`` counts the documents. ``sum``, ``avg``, ``min`` and ``max`` take an attribute
+or a list of them, documents which don't have the attribute are ignored.
+
+The results are a list with a row for every group, like ``groupby``. The last item of
+each row is the aggregate, or a dict of them (keyed by ``'count'`` and ``'function(attribute)'``)
+if more than one was requested.
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The aggregation is done by SQlite with a ``GROUP BY``, so no documents are decoded.
+    If the conditions or attributes can't be translated into SQL, the aggregates are
+    calculated in Python from lazily decoded documents instead.
+
+    """
+    names, columns = SubVerse.__aggregates__(by, aggregates)
+    if where is None:
+      filters = []
+    elif type(where) in (list, tuple):
+      filters = list(where)
+    else:
+      filters = [where]
+    query, filters = self._plan(filters)
+
+    attrs = [a for f, a in columns if a is not None]
+    if len(filters) == 0 and all(self._compiler().supports(a) for a in names + attrs):
+      results = self._aggregate(names, columns, **(query or {}))
+    else:
+      results = SubVerse.__aggregate__(self._scan(query, filters, names + attrs, decode=False), names, columns)
+    return SubVerse.__expandaggregates__(results, columns)
+
+  def _aggregate(self, names, columns, where=None, params=(), order=None, limit=None, offset=None):
+    # runs the GROUP BY for aggregate, returns an OrderedDict of group keys to lists of aggregates
+    compiler = self._compiler()
+    select = []
+    for name in names:
+      select.extend([compiler.type(name), compiler.field(name)])
+    for function, attr in columns:
+      select.append('count(*)' if function == 'count' else '%s(%s)' % (function, compiler.field(attr)))
+    if len(names) == 0:
+      # without a GROUP BY, SQlite returns a row even when no document matches. There
+      # are no groups then, the same as SubVerse.aggregate
+      select.append('count(*)')
+
+    if limit is not None or offset:
+      # limit and skip apply to the documents, not the groups
+      source, where = '(%s)' % self._sql(['data'], where, order, limit, offset), None
+    else:
+      source = self._name
+    sql = 'select %s from %s' % (', '.join(select), source)
+    if where is not None:
+      sql += ' where ' + where
+    if len(names) > 0:
+      sql += ' group by ' + ', '.join(compiler.field(name) for name in names)
+
+    results = OrderedDict()
+    for n in self._connection.reader().execute(sql, params):
+      if len(names) == 0:
+        if n[-1] == 0:
+          continue
+        n = n[:-1]
+      key = []
+      for i in xrange(len(names)):
+        _type, value = n[2*i], n[2*i+1]
+        key.append((_type == 'true') if _type in ('true', 'false') else value)
+      results[tuple(key)] = list(n[2*len(names):])
+    return results
     # return SubVerse(iter(self)).groupby(*attrs)
 
-  def orderby(self, *attrs):
+  def orderby(self, *attrs, **kwargs):
     """
 Orders the collection by one or more columns
 
@@ -1174,8 +2117,42 @@ However, you can also do this:
 
   uv.docs.find(D.orderby('name', '-age'))
 
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The ordering is done by SQlite. If an index has been created on the columns
+    (see ``create_index``), the documents are read in index order and no sort is needed.
+
+    To sort collections which don't fit in memory, give a ``memory`` budget in bytes. A lazy
+    SubVerse is returned, which streams the sorted documents. SQlite sorts the attributes it can
+    read with its own temporary files, anything else is sorted with an ``ExternalSort``
+    (see ``underverse.external``), which writes runs of encoded documents to temporary files.
+
     """
-    return P.orderby(*attrs)(self)
+    memory = kwargs.pop('memory', None)
+    if len(kwargs) > 0:
+      raise TypeError, "Unknown arguments: %s" % ', '.join(kwargs)
+    if memory is not None:
+      orderby = OrderBy(*_attributes(attrs))
+      return SubVerse(lambda: self._sorted(orderby, memory), lazy=True)
+    order = self._order(attrs)
+    if order is None:
+      return P.orderby(*attrs)(self)
+    return list(self._select(order=order))
+
+  def _sorted(self, orderby, memory):
+    # yields the documents sorted by an OrderBy, with at most 'memory' bytes of them in memory
+    order = self._order(orderby.attrs)
+    if order is not None:
+      for doc in self._select(order=order):
+        yield doc
+      return
+    values = orderby.values()
+    decode = self._decode
+    rows = self._connection.reader().execute(self._sql(['data']))
+    for data in ExternalSort(orderby, memory).sort((values(decode(n[0])), n[0]) for n in rows):
+      yield decode(data)
     # return P.orderby(*attrs)(SubVerse(self))
     # return SubVerse(self).orderby(*attrs)
 
@@ -1188,6 +2165,17 @@ Finds all the unique values for one or more columns
   uv.verse.unique('name', 'age')
 
     """
+    names = [a._name if type(a) == Document else a for a in attrs]
+    if len(names) > 0 and all(type(n) == str for n in names):
+      # only the unique attributes are read, the documents aren't decoded
+      def unique(rows):
+        found = {}
+        for values in rows:
+          key = values[0] if len(names) == 1 else values
+          if not key in found:
+            found[key] = None
+            yield key
+      return unique(self.select(*names))
     return self.all().unique(*attrs)
     # return SubVerse(iter(self)).unique(*attrs)
 
@@ -1196,11 +2184,46 @@ Finds all the unique values for one or more columns
 
 Returns the number of documents for the entire collection
 
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The count is kept in the collection's statistics (see ``stats``), so the collection isn't scanned.
+
+    """
+    return self._statistics().count
+
+  def stats(self, refresh=False):
+    """
+Returns statistics about the documents in the collection: the number of documents, their
+average encoded size and, for each top-level attribute, the number of documents which have it,
+an estimate of its distinct values and its smallest and largest numbers.
+
+.. code-block:: python
+
+  stats = uv.users.stats()
+  print stats['count'], stats['size']
+  print stats['fields']['age']    # {'count': 990, 'distinct': 71, 'min': 18, 'max': 90}
+
+The statistics are updated by ``add``, ``update``, ``remove`` and ``purge``. The attribute
+statistics are estimates, look at the ``underverse.stats`` module for the details. Use
+``refresh`` to compute them again from every document.
+
+.. note::
+
+  Collections created before statistics existed only have attribute statistics for the
+  documents written since (``sampled``), until they are refreshed.
+
     """
-    if self._dirty or self._len == -1:
-      self._dirty = False
-      self._len = self._cursor.execute('select count(*) from %s' % self._name).fetchone()[0]
-    return self._len
+    stats = self._statistics()
+    if refresh:
+      stats.clear()
+      decode = self._codec.decode
+      for data, in self._connection.execute('select data from %s' % self._name):
+        stats.add(decode(data), len(data))
+      self._save(True)
+      self._connection.commit()
+    return stats.summary()
 
   def find(self, *filters):
     """
@@ -1233,67 +2256,267 @@ This is how querying is handled in the Underverse.
 
 Look at the `Document` documentation for all supported query operators.
 
-    """
-    return Verse(self._connection, self._name).all().find(*filters)
+.. admonition:: Performance Hint
+  :class: perf
 
-  def find_one(self, *filters):
-    """
 
-Searches verse for the first document that is true for all predicates given
+    Comparisons (``<``, ``<=``, ``>``, ``>=``, ``==``, ``!=``, ``btw``, ``in_`` and ``nin``),
+    along with ``AND`` / ``OR`` combinations of them, are compiled into a SQL ``WHERE`` clause
+    and evaluated by SQlite. Only the matching documents are decoded. Anything else, such as
+    ``udp`` or ``udf`` filters, runs in Python on the documents SQlite returns.
 
-    """
-    return self.all().find_one(*filters)
+    A ``limit``, ``skip`` or ``limskip`` which directly follows the compiled conditions
+    becomes a SQL ``LIMIT`` / ``OFFSET``, so only the requested documents are read.
+
+    An ``orderby`` on attributes SQlite can read becomes a SQL ``ORDER BY`` (which uses
+    an index if there is one, see ``create_index``), and a ``limit`` after it a ``LIMIT``.
+    Attributes which hold objects or arrays, and the ones SQlite can't read, are sorted
+    in Python instead, keeping only the first documents in a heap when a ``limit`` follows.
+
+    ``created_at`` and ``updated_at`` are also stored in indexed columns, so time windows
+    like ``D.created_at > time.time() - 3600`` only read the matching rows, whatever the codec.
+    Collections created by older versions need to be migrated first (see ``migrate``).
 
-  def glob(self, globs, case_sensitive=True, operand=and_):
     """
-Searches verse using SQlite GLOB statements. This is used to limit the number of documents being queried for.
+    query, filters = self._plan(filters)
+    if Verse._rowwise(filters)[0] > 0:
+      return SubVerse(list(self._scan(query, filters)))
+    if query is None:
+      return SubVerse(list(SubVerse.__filter__(self._select(), filters)))
+    return SubVerse(list(self._select(**query))).find(*filters)
+
+  def stream(self, *filters):
+    """
+Searches the collection the same way as ``find``, but returns a lazy SubVerse.
 
-By importing ``and_`` or ``or_`` from ``underverse``, you can perform more specific glob operations.
+Nothing is read from the database until the results are used. The documents are then
+streamed from SQlite through the filters one at a time, so memory use doesn't grow with
+the size of the collection. ``limit``, ``skip`` and ``paginate`` can be chained on the results.
 
-**Example usage:**
+.. code-block:: python
 
-For example, say you have an unstructured CSV (comma separated values) file with
-network traffic. The file has several different types of logging messages with
-both received and transmitted messages. You need to search for a specific
-logging message, but there's a lot of data and converting all the extra messages
-would be pointless and time consuming. Here's how you would filter out the extra
-messages and then group by IP address.
+  for page in uv.logs.stream(D.level == 'WARNING').skip(100).paginate(50):
+    print len(page)
+
+.. seealso::
+
+  Look at the SubVerse class description for how lazy SubVerses work.
+
+    """
+    query, filters = self._plan(filters)
+    if Verse._rowwise(filters)[0] > 0:
+      return SubVerse(lambda: self._scan(query, filters), lazy=True)
+    return SubVerse(lambda: self._select(**(query or {})), lazy=True).find(*filters)
+
+  def select(self, *attrs, **kwargs):
+    """
+Reads one or more attributes from the documents in the collection. A tuple of
+values is yielded for every document, in the order the attributes were given.
 
 .. code-block:: python
 
-  uv = Underverse()
-  uv.load("logs.sql")
-  logs = uv.logs
+  for name, age in uv.people.select('name', 'age'):
+    print name, age
 
-  #finds all WARNING messages that were received
-  warnings_received = logs.glob('rxnet', 'WARNING')
+  # the documents can be filtered the same way as ``find``
+  for name, in uv.people.select('name', where=D.age > 30):
+    print name
 
-  # groups the warnings by IP
-  for ip, warnings in warnings_received.groupby("ip"):
-    print '\\nIP Address: ' + str(ip)
+  # or read in chunks of tuples
+  for chunk in uv.people.select('name', 'age', 'gender', chunksize=1000):
+    print len(chunk)
 
-    for warning in warnings:
-      print ' - Description: ' + str(warning.desc)
+``where`` can be a single condition or a list of them. If a document doesn't
+have one of the attributes, ``None`` is returned in its place.
 
 .. admonition:: Performance Hint
   :class: perf
 
 
-    Use this whenever you can to gain a slight performance boost. Because this
-    function uses SQlite's GLOB functionality, the documents can be searched before
-    they are converted to python dictionary.
+    The values are read by SQlite using ``json_extract``, so the documents don't have
+    to be decoded. Only values which are objects or lists are decoded by Python.
+    This makes reading a few attributes of large documents much faster than ``find``.
 
-    However, querying and globbing speed can be increased by intellegently ordering query parameters.
-    In Underverse, if one condition fails, then the record is skipped without processing the other conditions.
-    Therefore, use the more strict conditions first.
+    """
+    where = kwargs.pop('where', None)
+    chunksize = kwargs.pop('chunksize', None)
+    if len(kwargs) > 0:
+      raise TypeError, "select got unexpected keyword arguments: %s" % ', '.join(kwargs)
+    if len(attrs) == 0:
+      raise TypeError, "select requires at least one attribute"
 
-  .. code-block:: python
+    names = []
+    for attr in attrs:
+      if type(attr) == Document:
+        attr = attr._name
+      if not type(attr) in (str, unicode):
+        raise TypeError, "Select arguments must be either str or Document types"
+      names.append(attr)
+
+    if where is None:
+      filters = []
+    elif type(where) in (list, tuple):
+      filters = list(where)
+    else:
+      filters = [where]
 
-    # globbing - 2.297s
-    warnings_received = logs.glob('WARNING', 'rxnet')
+    query, filters = self._plan(filters)
+    if len(filters) == 0 and all(self._compiler().supports(n) for n in names):
+      rows = (values for rowid, values in self._project(names, **(query or {})))
+    else:
+      rows = (tuple(_attribute(row, n) for n in names) for row in self._scan(query, filters, names, decode=False))
 
-    # faster globbing - 1.141s
-    warnings_received = logs.glob('rxnet', 'WARNING')
+    if chunksize is None:
+      return rows
+    return SubVerse(lambda: rows, lazy=True).paginate(chunksize)
+
+  def iter_batches(self, size=1000, where=None, fields=None, decode=True):
+    """
+Reads the collection ``size`` documents at a time. Each batch is a list of documents,
+or of value tuples if ``fields`` are given (like ``select``).
+
+.. code-block:: python
+
+  for docs in uv.events.iter_batches(5000, where=D.type == 'click'):
+    process(docs)
+
+  # columns for NumPy
+  for rows in uv.events.iter_batches(10000, fields=['x', 'y']):
+    points = np.array(rows)
+
+``where`` takes the same conditions as ``find``, either one or a list of them. With
+``decode=False`` the batches hold the encoded documents, for example to decode them in
+other processes (``Verse.codec.decode`` turns them into dicts).
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Rows are read from SQlite with ``fetchmany``, a batch at a time, instead of one at
+    a time. Conditions and attributes which can't be translated into SQL are handled in
+    Python, which is slower.
+
+    """
+    if size < 1:
+      raise ValueError, "The batch size must be 1 or more"
+    if where is None:
+      filters = []
+    elif type(where) in (list, tuple):
+      filters = list(where)
+    else:
+      filters = [where]
+    names = None
+    if fields is not None:
+      names = [f._name if type(f) == Document else f for f in fields]
+
+    query, rest = self._plan(filters)
+    compiler = self._compiler()
+    if len(rest) > 0 or (names is not None and not all(compiler.supports(n) for n in names)):
+      # the documents have to go through Python
+      if not decode:
+        raise ValueError, "decode=False can only be used with conditions which can be translated into SQL"
+      if names is not None:
+        rows = self.select(*names, where=filters)
+      else:
+        rows = iter(self.stream(*filters))
+      batch = list(islice(rows, size))
+      while len(batch) > 0:
+        yield batch
+        batch = list(islice(rows, size))
+      return
+
+    query = dict(query or {})
+    params = query.pop('params', ())
+    if names is None:
+      columns = ['data']
+    else:
+      columns = ['rowid']
+      for name in names:
+        columns.append(compiler.type(name))
+        columns.append(compiler.field(name))
+    connection = self._connection.reader()
+    cursor = connection.execute(self._sql(columns, **query), params)
+    cursor.arraysize = size
+    _decode = self._decode
+    values = self._values
+    while True:
+      rows = cursor.fetchmany()
+      if len(rows) == 0:
+        return
+      if names is not None:
+        yield [values(connection, n, names) for n in rows]
+      elif decode:
+        yield [_decode(n[0]) for n in rows]
+      else:
+        yield [n[0] for n in rows]
+
+  def find_one(self, *filters):
+    """
+
+Searches verse for the first document that is true for all predicates given
+
+Returns None if no document is found matching conditions
+
+    """
+    one = self.find(*(filters + (Document.limit(1),)))
+    if len(one) == 1:
+      return one[0]
+    return None
+
+  def glob(self, globs, case_sensitive=True, operand=and_):
+    """
+Searches verse using SQlite GLOB statements. This is used to limit the number of documents being queried for.
+
+By importing ``and_`` or ``or_`` from ``underverse``, you can perform more specific glob operations.
+
+**Example usage:**
+
+For example, say you have an unstructured CSV (comma separated values) file with
+network traffic. The file has several different types of logging messages with
+both received and transmitted messages. You need to search for a specific
+logging message, but there's a lot of data and converting all the extra messages
+would be pointless and time consuming. Here's how you would filter out the extra
+messages and then group by IP address.
+
+.. code-block:: python
+
+  uv = Underverse()
+  uv.load("logs.sql")
+  logs = uv.logs
+
+  #finds all WARNING messages that were received
+  warnings_received = logs.glob('rxnet', 'WARNING')
+
+  # groups the warnings by IP
+  for ip, warnings in warnings_received.groupby("ip"):
+    print '\\nIP Address: ' + str(ip)
+
+    for warning in warnings:
+      print ' - Description: ' + str(warning.desc)
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Use this whenever you can to gain a slight performance boost. Because this
+    function uses SQlite's GLOB functionality, the documents can be searched before
+    they are converted to python dictionary.
+
+    If the collection has a text index (see ``create_text_index``), only the indexed
+    attributes are searched and the trigram index finds the matching documents without
+    scanning the collection. Patterns need at least 3 characters in a row to use the index.
+
+    However, querying and globbing speed can be increased by intellegently ordering query parameters.
+    In Underverse, if one condition fails, then the record is skipped without processing the other conditions.
+    Therefore, use the more strict conditions first.
+
+  .. code-block:: python
+
+    # globbing - 2.297s
+    warnings_received = logs.glob('WARNING', 'rxnet')
+
+    # faster globbing - 1.141s
+    warnings_received = logs.glob('rxnet', 'WARNING')
 
     # querying - 2.313s
     warnings_received = logs.find(D.Message_Label == "WARNING", D.rx_tx_net == 'rxnet')
@@ -1305,6 +2528,7 @@ messages and then group by IP address.
 
     """
     attrs = []
+    params = []
 
     def helper(attr):
       attr = attr.strip()
@@ -1314,22 +2538,48 @@ messages and then group by IP address.
         attr = attr+"*"
       if not case_sensitive:
         attr = attr.lower()
-        if not attr in attrs:
-          return " lower(data) glob '"+attr+"'"
-      else:
-        if not attr in attrs:
-          return " data glob '"+attr+"'"
+      if not attr in params:
+        params.append(attr)
+        attrs.append(" lower(data) glob ?" if not case_sensitive else " data glob ?")
 
     if hasattr(globs, '__iter__'):
       for glob in globs:
-        attrs.append(helper(glob))
+        helper(glob)
     elif type(globs) is str:
-        attrs.append(helper(globs))
+        helper(globs)
     else:
       raise TypeError, "GLOBs must be strings or a list of strings"
 
-    result = self._cursor.execute('select data as "data [necro]" from %s where%s' % (self._name, operand.join(attrs)))
-    return SubVerse([r[0] for r in result])
+    if self._text is not None and self._text.get('tokenize') == 'trigram':
+      attrs, params = self._text_globs(params, case_sensitive)
+      sql = 'select d.data from "%s" t join %s d on d.rowid = t.rowid where%s' % (self._name + Verse.TEXT, self._name, operand.join(attrs))
+    else:
+      sql = 'select data from %s where%s' % (self._name, operand.join(attrs))
+    result = self._connection.reader().execute(sql, params)
+    return SubVerse([self._decode(r[0]) for r in result])
+
+  def _text_globs(self, patterns, case_sensitive):
+    # the WHERE clause of glob for the text index. Each pattern can match any of the indexed
+    # attributes. The trigram index is only used by LIKE (it isn't case sensitive), so
+    # patterns without [...] sets are also turned into a LIKE, which finds the candidates
+    attrs = []
+    params = []
+    for pattern in patterns:
+      like = None
+      if not '[' in pattern:
+        like = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_').replace('*', '%').replace('?', '_')
+      parts = []
+      for i in xrange(len(self._text['fields'])):
+        column = 'c%d' % i
+        match = ("t.%s glob ?" if case_sensitive else "lower(t.%s) glob ?") % column
+        if like is not None:
+          parts.append("(t.%s like ? escape '\\' and %s)" % (column, match))
+          params.extend([like, pattern])
+        else:
+          parts.append(match)
+          params.append(pattern)
+      attrs.append(' (%s)' % ' or '.join(parts))
+    return attrs, params
 
   def update(self, necro):
     """
@@ -1404,7 +2654,10 @@ Bulk operations are normally faster. This is how you could do the same thing usi
     the work. Any time you can limit function calls, do it.
 
     """
-    self._dirty = True
+    before = self._connection.total_changes
+    stats, changed = self._statistics(), Stats()
+    encode = self._encoder(changed.add)
+    change = self._change
     if hasattr(necro, '__iter__') and type(necro) != NecRow:
 
       def generator(necros):
@@ -1414,19 +2667,21 @@ Bulk operations are normally faster. This is how you could do the same thing usi
               necro = NecRow({'data':n})
             else:
               necro = NecRow(n.__dict__)
-            yield (adapter(necro), necro.uuid,)
+            yield change(encode(necro), necro)
           else:
             n.updated_at = time.time()
-            yield (adapter(n), n.uuid,)
-      self._cursor.executemany("update %s set data=? where uuid=?;" % self._name, (generator(necro)))
+            yield change(encode(n), n)
+      self._cursor.executemany(self._update, (generator(necro)))
     elif type(necro) is NecRow:
       necro.updated_at = time.time()
-      self._cursor.execute("update %s set data='%s' where uuid='%s';" % (self._name, adapter(necro), necro.uuid))
+      self._cursor.execute(self._update, change(encode(necro), necro))
     else:
       raise TypeError, "Update argument must be of type NecRow or a list of NecRows"
 
+    stats.replace(changed)
+    self._written(before)
     self._connection.commit()
-    return self._cursor.execute("select changes();").fetchone()[0]
+    return self._cursor.rowcount
 
   def remove(self, necro):
     """
@@ -1441,18 +2696,55 @@ list of documents.
   Add exceptions to function (ie, raise TypeError for unrecognized arguments).
 
     """
-    self._dirty = True
-    if type(necro) == str:
-      self._cursor.execute("delete from %s where uuid = '%s';" % (self._name, necro))
-    elif hasattr(necro, '__iter__') and type(necro) != NecRow:
-      concat = []
-      for n in necro:
-        concat.append("'"+n.uuid+"'")
-      self._cursor.execute("delete from %s where uuid in (%s);" % (self._name, ','.join(concat)))
+    if hasattr(necro, '__iter__') and not isinstance(necro, dict):
+      return self.remove_many(necro)
+    stats = self._statistics()
+    before = self._connection.total_changes
+    removed = 0
+    if type(necro) in (str, unicode):
+      self._cursor.execute("delete from %s where uuid = ?;" % self._name, (necro,))
+      removed = self._cursor.rowcount
     elif hasattr(necro, 'uuid'):
-      self._cursor.execute("delete from %s where uuid = ?;" % (self._name), necro.uuid)
+      self._cursor.execute("delete from %s where uuid = ?;" % self._name, (necro.uuid,))
+      removed = self._cursor.rowcount
+    stats.remove(removed)
+    self._written(before)
     self._connection.commit()
-    return self._cursor.execute("select changes();").fetchone()[0]
+    return self._cursor.rowcount
+
+  def remove_many(self, uuids):
+    """
+Removes the documents with the given UUIDs (or the given documents).
+
+.. code-block:: python
+
+  users.remove_many(['5a1c...', '81bf...'])
+  users.remove_many(users.find(D.active == False))
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The UUIDs are inserted into a temporary table and the documents are deleted with a
+    single statement, no matter how many UUIDs there are.
+
+    """
+    stats = self._statistics()
+    self._keys(k if type(k) in (str, unicode) else k.uuid for k in uuids)
+    before = self._connection.total_changes
+    self._cursor.execute("delete from %s where uuid in (select key from temp.%s);" % (self._name, Verse.KEYS))
+    stats.remove(self._cursor.rowcount)
+    self._written(before)
+    self._connection.commit()
+    return self._cursor.rowcount
+
+  def _keys(self, keys):
+    # fills the temporary key table used by remove_many
+    self._connection.execute("create temp table if not exists %s (key, position integer primary key);" % Verse.KEYS)
+    before = self._connection.total_changes
+    self._connection.execute("delete from temp.%s;" % Verse.KEYS)
+    self._connection.executemany("insert into temp.%s (key) values (?);" % Verse.KEYS, ((k,) for k in keys))
+    self._connection._account(before)
 
   def purge(self, vacuum=False):
     """
@@ -1473,8 +2765,11 @@ To remove the data from the disk permanently, use the ``vacuum`` option.
   *Vacuuming* the database is an expensive task. You might want to use it sparingly.
 
     """
-    self._dirty = True
+    stats = self._statistics()
+    before = self._connection.total_changes
     self._cursor.execute("delete from %s;" % (self._name))
+    stats.clear()
+    self._written(before)
     self._connection.commit()
     if vacuum:
       self._cursor.execute("vacuum %s;" % (self._name))
@@ -1635,16 +2930,28 @@ The ``sort`` option has five possible values:
     # for k, v in SubVerse(self).mapreduce(mapper, reducer, expand, sort):
       # yield k, v
 
-  def paginate(self, count):
+  def paginate(self, count, orderby=None, memory=None):
     """
     Pages the collection.
 
     If a collection has 5000 documents, calling ``verse.paginate(500)`` will
-    return 10 pages of 500 documents each.
+    return 10 pages of 500 documents each. The pages are read as they are needed
+    (see ``iter_batches``).
+
+    The documents can be sorted by ``orderby``, an attribute or a list of them. With a
+    ``memory`` budget the sort streams the documents too (see ``orderby``).
+
+    .. code-block:: python
+
+      for page in uv.logs.paginate(100, orderby=['host', '-time'], memory=16 * 1024 * 1024):
+        print len(page)
+
     """
-    return self.all().paginate(count)
-    # for page in self.all().paginate(count):
-      # yield page
+    if orderby is None:
+      return self.iter_batches(count)
+    if memory is None:
+      return SubVerse(self.orderby(*_attributes(orderby))).paginate(count)
+    return self.orderby(*_attributes(orderby), memory=memory).paginate(count)
 
   def purify(self, *cols):
     """
@@ -1707,6 +3014,9 @@ Converts the given attributes to a NumPy recarray. This can provide for an easy
 
     """
     if HAS_NUMPY:
+      if self._codec.json and all(SQLCompiler.translatable(c) and not '.' in c for c in cols):
+        # only documents which have every attribute are included
+        return QuasiDead.from_array(list(self.select(*cols, where=[getattr(Document, c) for c in cols])), *cols)
       return self.all().purify(*cols)#QuasiDead.from_dicts(self.division, *cols)
     else:
       raise Exception, "NumPy must be installed to use the 'purify' function."
@@ -1733,7 +3043,7 @@ Or..
   You can also chain the ``limit`` and ``skip`` functions together.
 
     """
-    return self.all().limit(count)
+    return self.find(Document.limit(count))
 
   def skip(self, count):
     """
@@ -1754,7 +3064,7 @@ Or..
   You can also chain the ``limit`` and ``skip`` functions together.
 
     """
-    return self.all().skip(count)
+    return self.find(Document.skip(count))
 
   def put(self, key, value):
     """
@@ -1794,7 +3104,7 @@ This adds a KeyValue instance to the collection.
     """
     self.add(KeyValue(key, value))
 
-  def get(self, key):
+  def get(self, key, by=None):
     """
 This gets a document based on the key or UUID.
 
@@ -1819,11 +3129,29 @@ from underverse import Underverse, KeyValue
   # Basically, the following line is doing the same thing as a KeyValue instance
   # n = NecRow({'uuid':'key', 'value':5})
 
+Documents can also be looked up by any other attribute using the ``by`` option.
+The first matching document is returned. Create an index on the attribute to make this fast.
+
+.. code-block:: python
+
+  users.create_index('email')
+  user = users.get('ed@example.com', by='email')
+
     """
+    if by is not None:
+      where = self._compiler().compile(getattr(Document, by) == key)
+      if where is None:
+        value = self.find_one(getattr(Document, by) == key)
+      else:
+        value = next(self._select(where[0], where[1], limit=1), None)
+      if value is None:
+        raise KeyError, "'%s' not found in document collection: '%s'" % (key, self._name)
+      return value
+
     if type(key) != str:
       raise TypeError, "Keys must be string values"
 
-    value = self._cursor.execute('select data as "data [necro]" from %s where uuid = "%s"' % (self._name, key)).fetchone()
+    value = self._connection.reader().execute('select data from %s where uuid = ?' % self._name, (key,)).fetchone()
     if value is None:
       if '.' in key:
         attrs = key.split('.')
@@ -1841,7 +3169,37 @@ from underverse import Underverse, KeyValue
 
       raise KeyError, "'%s' not found in document collection: '%s'" % (key, self._name)
     else:
-      return value[0]
+      return self._decode(value[0])
+
+  def get_many(self, keys):
+    """
+Gets the documents for a list of keys or UUIDs. A list is returned in the same
+order as the keys, with ``None`` for keys which weren't found.
+
+.. code-block:: python
+
+  options.put('a', 1)
+  options.put('b', 2)
+
+  a, b, c = options.get_many(['a', 'b', 'c'])
+  print a.value, b.value, c   # 1 2 None
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The keys are bound as a single JSON array, so all the documents are found with a
+    single indexed query instead of one query per key.
+
+    """
+    keys = list(keys)
+    found = [None] * len(keys)
+    decode = self._decode
+    # nothing is written, so the caller's transaction is left alone
+    sql = "select k.key, v.data from json_each(?) k cross join %s v on v.uuid = k.value;" % self._name
+    for position, data in self._connection.reader().execute(sql, (json.dumps(keys),)):
+      found[position] = decode(data)
+    return found
 
   def join(self, right, alias):
     """
@@ -1849,6 +3207,582 @@ This performs join operations on the current Verse.
     """
     return Join(self, right, alias)
 
+  def create_index(self, *attrs, **kwargs):
+    """
+Creates an index on one or more document attributes.
+
+Documents are stored as JSON, so the index is built on SQlite's ``json_extract``
+of each attribute. Queries made with ``find``, ``orderby`` and ``get(key, by=...)``
+on the indexed attributes no longer have to scan the whole collection.
+
+.. code-block:: python
+
+  uv = Underverse('data.db')
+  users = uv.users
+
+  users.create_index('age')
+
+  # compound and nested attributes work too
+  users.create_index('name', '-age')
+  users.create_index('comment.text')
+
+  # uses the index
+  young = users.find(D.age < 25)
+
+Descending columns are marked with a **-**, just like ``orderby``. The index name
+defaults to the collection name followed by the attributes, but it can also be
+given with the ``name`` option. The index definitions are stored in the database
+catalog and the index name is returned.
+
+If the collection is being loaded with ``bulk_load``, the index is created once the load is done.
+
+    """
+    if len(attrs) == 0:
+      raise TypeError, "create_index requires at least one attribute"
+    if not self._codec.json:
+      raise TypeError, "Indexes can't be created on collections using the '%s' codec" % self._codec.name
+
+    columns = []
+    compiler = self._compiler()
+    for attr in attrs:
+      if type(attr) == Document:
+        attr = attr._name
+      if not type(attr) in (str, unicode):
+        raise TypeError, "Index attributes must be either str or Document types"
+      desc = attr.startswith('-')
+      if not SQLCompiler.translatable(attr.lstrip('-')):
+        raise ValueError, "'%s' can't be indexed. Attributes must be letters, numbers and underscores separated by dots." % attr
+      columns.append(compiler.field(attr.lstrip('-')) + (' desc' if desc else ''))
+
+    fields = [a._name if type(a) == Document else a for a in attrs]
+    name = kwargs.get('name', '%s__%s' % (self._name, '__'.join(f.replace('-', 'desc_').replace('.', '_') for f in fields)))
+
+    if not self._name in getattr(self._connection, '_loading', ()):
+      self._cursor.execute('create index if not exists "%s" on %s (%s);' % (name, self._name, ', '.join(columns)))
+    indexes = self.indexes()
+    indexes[name] = fields
+    Catalog(self._connection).set(self._name, 'indexes', indexes, commit=False)
+    self._indexes = indexes
+    self._connection.commit()
+    return name
+
+  def drop_index(self, *attrs, **kwargs):
+    """
+Removes an index created with ``create_index``.
+
+.. code-block:: python
+
+  users.drop_index('age')
+
+  # or by name
+  users.drop_index(name='users__age')
+
+    """
+    indexes = self.indexes()
+    fields = [a._name if type(a) == Document else a for a in attrs]
+    name = kwargs.get('name')
+    if name is None:
+      for n, f in indexes.items():
+        if f == fields:
+          name = n
+          break
+    if name is None or not name in indexes:
+      raise KeyError, "No index on %s found for collection: '%s'" % (name or fields, self._name)
+
+    self._cursor.execute('drop index if exists "%s";' % name)
+    del indexes[name]
+    Catalog(self._connection).set(self._name, 'indexes', indexes, commit=False)
+    self._indexes = indexes
+    self._connection.commit()
+
+  def indexes(self):
+    """
+Returns a dict of the indexes for this collection and the attributes they cover.
+
+.. code-block:: python
+
+  print users.indexes()   # {'users__age': ['age']}
+
+    """
+    return dict(self._indexes)
+
+  # suffix of the FTS5 table used by the text index
+  TEXT = '__text'
+
+  def create_text_index(self, *attrs, **kwargs):
+    """
+Creates a full-text index on one or more document attributes. It's used by ``search`` and ``glob``.
+
+The index is a SQlite FTS5 table which is kept up to date by triggers, so every write to
+the collection updates it. Only one text index can be created per collection.
+
+.. code-block:: python
+
+  logs = uv.logs
+  logs.create_text_index('message', 'host')
+
+  # ranked, best matches first
+  for log in logs.search('disk full'):
+    print log.message
+
+  # only the indexed attributes are searched
+  errors = logs.glob('*timeout*')
+
+The default ``tokenize`` option is ``trigram``, which indexes every 3 characters so that
+any part of a word can be searched for, including by ``glob``. Any other FTS5 tokenizer
+(for example ``unicode61`` or ``porter unicode61``) can be given; those are smaller and
+match whole words, but ``glob`` can't use them.
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Each write also updates the text index, which makes adding documents slower. Only
+    index the attributes which need to be searched.
+
+    """
+    if len(attrs) == 0:
+      raise TypeError, "create_text_index requires at least one attribute"
+    if not self._codec.json:
+      raise TypeError, "Text indexes can't be created on collections using the '%s' codec" % self._codec.name
+    fields = []
+    for attr in attrs:
+      if type(attr) == Document:
+        attr = attr._name
+      if not type(attr) in (str, unicode):
+        raise TypeError, "Text index attributes must be either str or Document types"
+      if not SQLCompiler.translatable(attr):
+        raise ValueError, "'%s' can't be indexed. Attributes must be letters, numbers and underscores separated by dots." % attr
+      fields.append(attr)
+    tokenize = kwargs.get('tokenize', 'trigram')
+    if not re.match(r'^[A-Za-z0-9_ ]+$', tokenize):
+      raise ValueError, "'%s' isn't a valid tokenizer" % tokenize
+    if self._text is not None:
+      self.drop_text_index()
+
+    table = self._name + Verse.TEXT
+    columns = ', '.join('c%d' % i for i in xrange(len(fields)))
+    with self._connection.batch():
+      self._cursor.execute("create virtual table \"%s\" using fts5(%s, tokenize='%s');" % (table, columns, tokenize))
+      self._text = {'fields': fields, 'tokenize': tokenize}
+      self._text_fill()
+      self._text_triggers()
+      Catalog(self._connection).set(self._name, 'text', self._text, commit=False)
+    return table
+
+  def _text_fill(self):
+    # indexes every document, the text index isn't included in dumps (see Underverse.dump)
+    table = self._name + Verse.TEXT
+    fields = self._text['fields']
+    before = self._connection.total_changes
+    self._cursor.execute('delete from "%s";' % table)
+    self._cursor.execute('insert into "%s" (rowid, %s) select rowid, %s from %s;' % (table,
+      ', '.join('c%d' % i for i in xrange(len(fields))), ', '.join(SQLCompiler().field(f) for f in fields), self._name))
+    self._connection._account(before)
+
+  def _text_triggers(self):
+    # keeps the FTS5 table in sync with the collection
+    table = self._name + Verse.TEXT
+    fields = self._text['fields']
+    columns = ', '.join('c%d' % i for i in xrange(len(fields)))
+    values = ', '.join(SQLCompiler(column='new.data').field(f) for f in fields)
+    changes = ', '.join('c%d = %s' % (i, SQLCompiler(column='new.data').field(f)) for i, f in enumerate(fields))
+    self._cursor.execute('create trigger if not exists "%s_insert" after insert on %s begin insert into "%s" (rowid, %s) values (new.rowid, %s); end;' % (table, self._name, table, columns, values))
+    self._cursor.execute('create trigger if not exists "%s_update" after update of data on %s begin update "%s" set %s where rowid = new.rowid; end;' % (table, self._name, table, changes))
+    self._cursor.execute('create trigger if not exists "%s_delete" after delete on %s begin delete from "%s" where rowid = old.rowid; end;' % (table, self._name, table))
+
+  def drop_text_index(self):
+    """
+Removes the text index created with ``create_text_index``.
+    """
+    if self._text is None:
+      raise KeyError, "No text index found for collection: '%s'" % self._name
+    table = self._name + Verse.TEXT
+    with self._connection.batch():
+      for trigger in ('insert', 'update', 'delete'):
+        self._cursor.execute('drop trigger if exists "%s_%s";' % (table, trigger))
+      self._cursor.execute('drop table if exists "%s";' % table)
+      Catalog(self._connection).delete(self._name, 'text', commit=False)
+    self._text = None
+
+  def search(self, text, fields=None, prefix=False, limit=None):
+    """
+Finds the documents which contain every word of ``text`` in the attributes of the text index
+(see ``create_text_index``). The documents are returned best match first, ranked by FTS5's
+BM25 function.
+
+.. code-block:: python
+
+  logs.search('connection refused')
+
+  # only in some of the indexed attributes
+  logs.search('db01', fields=['host'])
+
+  # words starting with the text, for search-as-you-type
+  logs.search('conn', prefix=True, limit=20)
+
+With the default ``trigram`` tokenizer, words of 3 or more characters are matched anywhere,
+even inside of other words.
+
+    """
+    if self._text is None:
+      raise ValueError, "Collection '%s' doesn't have a text index. Create one with create_text_index." % self._name
+    words = text.split()
+    if len(words) == 0:
+      return SubVerse([])
+    query = ' '.join('"%s"%s' % (w.replace('"', '""'), '*' if prefix else '') for w in words)
+    if fields is not None:
+      fields = [f._name if type(f) == Document else f for f in fields]
+      for f in fields:
+        if not f in self._text['fields']:
+          raise ValueError, "'%s' isn't in the text index of collection: '%s'" % (f, self._name)
+      query = '{%s} : (%s)' % (' '.join('c%d' % self._text['fields'].index(f) for f in fields), query)
+
+    table = self._name + Verse.TEXT
+    sql = 'select d.data from "%s" join %s d on d.rowid = "%s".rowid where "%s" match ? order by rank' % (table, self._name, table, table)
+    if limit is not None:
+      sql += ' limit %d' % limit
+    decode = self._decode
+    return SubVerse([decode(r[0]) for r in self._connection.reader().execute(sql, (query,))])
+
+
+def _successor(prefix):
+  # the smallest string which is larger than every string starting with prefix,
+  # or None if there isn't one
+  while len(prefix) > 0:
+    try:
+      return prefix[:-1] + (unichr if type(prefix) is unicode else chr)(ord(prefix[-1]) + 1)
+    except ValueError:
+      prefix = prefix[:-1]
+  return None
+
+class KeyValueStore(object):
+  """
+A collection made for key-value pairs. It's created with ``Underverse.kv`` and has the
+same ``put`` and ``get`` functions as a Verse, plus functions to read, write and delete
+many keys at once and to scan the keys in order.
+
+.. code-block:: python
+
+  uv = Underverse('data.db')
+  options = uv.kv('options')
+
+  options.put('DEVMODES', {'TEST':0,'DEV':1,'PROD':2})
+  print options.get('DEVMODES').value
+  print options.get('DEVMODES.PROD')
+
+  options.mput({'user:1': 'ed', 'user:2': 'al', 'theme': 'dark'})
+  print options.mget(['user:1', 'theme', 'missing'])   # [u'ed', u'dark', None]
+
+  # the keys are kept in order, so all the keys with a prefix are read together
+  for key, value in options.scan(prefix='user:'):
+    print key, value
+
+  options.mdelete(['user:1', 'user:2'])
+
+Once it's created, ``uv.options`` also returns the store.
+
+The pairs are kept in a ``WITHOUT ROWID`` table, so the rows are stored in the primary
+key's b-tree by key. Strings and numbers are stored as they are, other values are
+encoded with the collection's codec.
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The most recently read values are kept in memory (1024 of them by default, see the
+    ``cache`` option of ``Underverse.kv``), so reading a key again doesn't run a query or
+    decode anything. The values are shared with the cache: don't change them in place,
+    ``put`` a new value instead.
+
+.. note::
+
+  Unlike a Verse, the pairs aren't documents: they don't have a *created_at* or
+  *updated_at* and they can't be searched with ``find``.
+
+  """
+  # values which are stored without being encoded. bools are encoded so they aren't read back as ints
+  RAW = (int, long, float, str, unicode)
+
+  def __init__(self, connection, name, codec=None, cache=1024):
+    super(KeyValueStore, self).__init__()
+    self._connection = connection
+    self._name = name
+    self._size = cache
+    self._cache = OrderedDict()
+    self._synced = None
+
+    catalog = Catalog(connection)
+    metadata = catalog.items(name)
+    if metadata.get('engine') != 'kv':
+      if connection.execute("select 1 from sqlite_master where type='table' and name=?", (name,)).fetchone() is not None:
+        raise ValueError, "Collection '%s' isn't a key-value store" % name
+    stored = metadata.get('codec')
+    if codec is not None and stored is not None and get_codec(codec).name != stored:
+      raise ValueError, "Collection '%s' already stores values with the '%s' codec" % (name, stored)
+    self._codec = get_codec(codec or stored)
+
+    with connection.batch():
+      connection.execute("create table if not exists %s (key text primary key, value, encoded integer not null default 0) without rowid;" % name)
+      if metadata.get('engine') != 'kv':
+        catalog.set(name, 'engine', 'kv', commit=False)
+        catalog.set(name, 'codec', self._codec.name, commit=False)
+
+  @property
+  def codec(self):
+    """
+The ``underverse.codec.Codec`` used for the values which aren't strings or numbers
+    """
+    return self._codec
+
+  def migrate(self):
+    # key-value stores don't have an older layout, see Verse.migrate
+    return False
+
+  def _encode(self, value):
+    # the value and encoded columns of a row
+    if value is None or type(value) in KeyValueStore.RAW:
+      return value, 0
+    return self._codec.encode({'value': value}), 1
+
+  def _decode(self, value, encoded):
+    if encoded:
+      return self._codec.decode(value)['value']
+    return value
+
+  def _valid(self):
+    # empties the cache when the table may have been written without this store:
+    # raw SQL, a rolled back batch or a commit on another connection
+    connection = self._connection
+    stamp = connection._stamp(), connection.execute('pragma data_version').fetchone()[0]
+    if stamp != self._synced:
+      self._cache.clear()
+      self._synced = stamp
+    return self._cache
+
+  def _remember(self, key, value):
+    cache = self._cache
+    cache[key] = value
+    if len(cache) > self._size:
+      cache.popitem(last=False)
+
+  def _check(self, key):
+    if not type(key) in (str, unicode):
+      raise TypeError, "Keys must be string values"
+
+  def _lookup(self, key):
+    # returns (found, value)
+    cache = self._valid()
+    if key in cache:
+      # moves the key to the end, the least recently used key is evicted first
+      value = cache.pop(key)
+      cache[key] = value
+      return True, value
+    row = self._connection.execute('select value, encoded from %s where key = ?' % self._name, (key,)).fetchone()
+    if row is None:
+      return False, None
+    value = self._decode(row[0], row[1])
+    if self._size > 0:
+      self._remember(key, value)
+    return True, value
+
+  def put(self, key, value):
+    """
+Stores a value for a key, replacing the old value if there is one.
+
+.. code-block:: python
+
+  options.put('retries', 5)
+
+    """
+    self._check(key)
+    connection = self._connection
+    before = connection.total_changes
+    connection.execute('insert or replace into %s (key, value, encoded) values (?, ?, ?)' % self._name, (key,) + self._encode(value))
+    connection._account(before)
+    self._cache.pop(key, None)
+    connection.commit()
+
+  def get(self, key):
+    """
+Gets the value of a key as a ``KeyValue``, like ``Verse.get``. Raises a KeyError if the key
+isn't found.
+
+Dotted keys which aren't stored themselves are looked up in the value of the first part.
+
+.. code-block:: python
+
+  options.put('DEVMODES', {'TEST':0,'DEV':1,'PROD':2})
+
+  DEVMODES = options.get('DEVMODES')
+  print DEVMODES.value, DEVMODES.PROD
+
+  DEV = options.get('DEVMODES.DEV')
+
+    """
+    self._check(key)
+    found, value = self._lookup(key)
+    if found:
+      row = dict.__new__(KeyValue)
+      dict.__init__(row, uuid=key, value=value)
+      return row
+
+    if '.' in key:
+      attrs = key.split('.')
+      value = self.get(attrs.pop(0))
+      for attr in attrs:
+        try:
+          value = getattr(value, attr)
+        except Exception, e:
+          raise KeyError, "Document does not have a key named '%s' " % (key)
+      return value
+    raise KeyError, "'%s' not found in key-value store: '%s'" % (key, self._name)
+
+  def mget(self, keys, default=None):
+    """
+Gets the values of a list of keys. A list is returned in the same order as the keys,
+with ``default`` for keys which weren't found.
+
+.. code-block:: python
+
+  a, b, c = options.mget(['a', 'b', 'c'])
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The keys which aren't cached are read with a single query.
+
+    """
+    keys = list(keys)
+    values = [default] * len(keys)
+    cache = self._valid()
+    missing = {}
+    for i, key in enumerate(keys):
+      self._check(key)
+      if key in cache:
+        value = values[i] = cache.pop(key)
+        cache[key] = value
+      else:
+        missing.setdefault(key, []).append(i)
+
+    if len(missing) > 0:
+      sql = 'select key, value, encoded from %s where key in (select value from json_each(?))' % self._name
+      decode = self._decode
+      for key, value, encoded in self._connection.execute(sql, (json.dumps(missing.keys()),)):
+        value = decode(value, encoded)
+        for i in missing[key]:
+          values[i] = value
+        if self._size > 0:
+          self._remember(key, value)
+    return values
+
+  def mput(self, pairs):
+    """
+Stores many values at once, from a dict or a list of ``(key, value)`` pairs.
+
+.. code-block:: python
+
+  options.mput({'a': 1, 'b': 2})
+  options.mput([('c', 3), ('d', 4)])
+
+    """
+    if hasattr(pairs, 'iteritems'):
+      pairs = pairs.iteritems()
+    cache = self._cache
+    encode = self._encode
+
+    def rows():
+      for key, value in pairs:
+        self._check(key)
+        cache.pop(key, None)
+        yield (key,) + encode(value)
+
+    connection = self._connection
+    before = connection.total_changes
+    connection.executemany('insert or replace into %s (key, value, encoded) values (?, ?, ?)' % self._name, rows())
+    connection._account(before)
+    connection.commit()
+
+  def delete(self, key):
+    """
+Removes a key. Returns True if it was found.
+    """
+    return self.mdelete([key]) == 1
+
+  def mdelete(self, keys):
+    """
+Removes a list of keys. Returns the number of keys which were found.
+    """
+    cache = self._cache
+
+    def rows():
+      for key in keys:
+        self._check(key)
+        cache.pop(key, None)
+        yield (key,)
+
+    connection = self._connection
+    before = connection.total_changes
+    cursor = connection.executemany('delete from %s where key = ?' % self._name, rows())
+    connection._account(before)
+    connection.commit()
+    return cursor.rowcount
+
+  def scan(self, prefix=None, start=None, end=None, reverse=False, limit=None):
+    """
+Yields the ``(key, value)`` pairs in the order of their keys. ``prefix`` only returns the
+keys which start with it; ``start`` and ``end`` only return the keys from ``start`` up to,
+but not including, ``end``.
+
+.. code-block:: python
+
+  # every key starting with 'user:'
+  users = dict(options.scan(prefix='user:'))
+
+  # the last 10 log entries, newest first
+  logs = list(options.scan(start='log:2024-01-01', end='log:2024-02-01', reverse=True, limit=10))
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Scans are ranges of the primary key, so only the pairs which are returned are read.
+    They don't go through the cache.
+
+    """
+    where = []
+    params = []
+    if prefix:
+      where.append('key >= ?')
+      params.append(prefix)
+      upper = _successor(prefix)
+      if upper is not None:
+        where.append('key < ?')
+        params.append(upper)
+    if start is not None:
+      where.append('key >= ?')
+      params.append(start)
+    if end is not None:
+      where.append('key < ?')
+      params.append(end)
+
+    sql = 'select key, value, encoded from %s' % self._name
+    if len(where) > 0:
+      sql += ' where ' + ' and '.join(where)
+    sql += ' order by key desc' if reverse else ' order by key'
+    if limit is not None:
+      sql += ' limit %d' % limit
+    decode = self._decode
+    for key, value, encoded in self._connection.execute(sql, params):
+      yield key, decode(value, encoded)
+
+  def __contains__(self, key):
+    return self._lookup(key)[0]
+
+  def __len__(self):
+    return self._connection.execute('select count(*) from %s' % self._name).fetchone()[0]
+
 
 class Underverse(object):
   """
@@ -1875,16 +3809,43 @@ An on-disk data store can be created like so:
 
   The extension doesn't matter, but traditionally SQlite databases are saved as either *.db* or *.sqlite*.
 
+On-disk databases which are read from many threads can be opened with ``readers=True``.
+The database is switched to WAL mode and the queries made by ``find``, ``get``, ``glob``
+and the other read functions use a read-only connection of their own in each thread
+(see ``underverse.connection.Readers``). Writes still go through ``uv.connection``.
+
+.. code-block:: python
+
+  uv = Underverse('helion.db', readers=True)
+
+  # from any thread
+  users = uv.users.find(D.age > 30)
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    Readers don't wait for the writer or for each other, and they always see the last
+    committed data. Reads made inside of a batch, or before the changes are committed,
+    use the writer's connection so they see the changes.
+
   """
 
-  def __init__(self, filename=None):
+  def __init__(self, filename=None, profile=None, readers=False):
     import datetime
     super(Underverse, self).__init__()
 
     if filename is None:
-      self.connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_COLNAMES)
+      if readers:
+        raise ValueError, "Readers can only be used with on-disk databases"
+      self.connection = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_COLNAMES, factory=Connection)
     else:
-      self.connection = sqlite3.connect(filename, detect_types=sqlite3.PARSE_COLNAMES)
+      self.connection = sqlite3.connect(filename, detect_types=sqlite3.PARSE_COLNAMES, factory=Connection)
+    if profile is not None:
+      self.connection.tune(profile)
+    if readers:
+      self.connection.tune(journal_mode='wal')
+      self.connection.readers = Readers(filename)
 
     if HAS_NUMPY:
       import numpy as np
@@ -1904,7 +3865,11 @@ The Underverse can be iterated over to produce a list of 'Verses' or tables in t
     print verse
 
     """
-    for name in self.connection.execute('SELECT name FROM sqlite_master WHERE type="table" ORDER BY name;'):
+    # virtual tables (text indexes) and the tables they create aren't collections
+    sql = '''SELECT name FROM sqlite_master t WHERE type="table" AND name != ? AND name NOT LIKE "sqlite\\_%" ESCAPE "\\"
+      AND sql NOT LIKE "CREATE VIRTUAL TABLE%" AND NOT EXISTS (SELECT 1 FROM sqlite_master v WHERE v.type="table"
+      AND v.sql LIKE "CREATE VIRTUAL TABLE%" AND substr(t.name, 1, length(v.name) + 1) = v.name || "_") ORDER BY name;'''
+    for name in self.connection.reader().execute(sql, (Catalog.TABLE,)):
       yield name[0]
 
   def __getattr__(self, attr):
@@ -1921,7 +3886,7 @@ The above statement creates a two-column table in the SQlite data store.
     if not attr in self.__dict__:
       return self.new(attr)
 
-  def new(self, name):
+  def new(self, name, codec=None):
     """
 You can also create a table like this:
 
@@ -1935,8 +3900,79 @@ You can also create a table like this:
 
 The above statements create a two-column table in the SQlite data store.
 
+A collection can also be given a codec, which controls how its documents are stored.
+The codec is remembered, so it only needs to be given when the collection is created.
+
+.. code-block:: python
+
+  # plain dicts are encoded with the json module instead of jsonpickle
+  events = uv.new('events', codec='json')
+
+.. admonition:: Performance Hint
+  :class: perf
+
+
+    The ``json`` and ``marshal`` codecs skip jsonpickle's object handling and are
+    several times faster to encode and decode. Use them for collections of plain dicts.
+    See the ``underverse.codec`` module for the details.
+
+    The ``Verse`` for each collection is only created once and then reused, so ``uv.users``
+    doesn't run any SQL after the first time it's used.
+
+    """
+    verses = self.connection._verses
+    verse = verses.get(name)
+    if isinstance(verse, KeyValueStore) or (verse is None and Catalog(self.connection).get(name, 'engine') == 'kv'):
+      return self.kv(name, codec)
+    if verse is None or (codec is not None and get_codec(codec).name != verse.codec.name):
+      verse = Verse(self.connection, name, codec)
+      verses[name] = verse
+    return verse
+
+  def kv(self, name, codec=None, cache=None):
     """
-    return Verse(self.connection, name)
+Creates or connects to a ``KeyValueStore``, a collection made for key-value pairs.
+
+.. code-block:: python
+
+  options = uv.kv('options')
+  options.put('theme', 'dark')
+
+  # afterwards uv.options returns the same store
+  print uv.options.get('theme').value
+
+``cache`` is the number of decoded values kept in memory (1024 by default, 0 turns the
+cache off).
+
+    """
+    verses = self.connection._verses
+    store = verses.get(name)
+    if not isinstance(store, KeyValueStore) or (codec is not None and get_codec(codec).name != store.codec.name):
+      store = KeyValueStore(self.connection, name, codec, 1024 if cache is None else cache)
+      verses[name] = store
+    elif cache is not None and store._size != cache:
+      store._size = cache
+      while len(store._cache) > cache:
+        store._cache.popitem(last=False)
+    return store
+
+  def migrate(self):
+    """
+Moves every collection created by an older version of Underverse to the current storage layout,
+which stores ``created_at`` and ``updated_at`` in indexed columns. Returns the names of the
+collections which were migrated.
+
+.. code-block:: python
+
+  uv = Underverse('old.db')
+  print uv.migrate()    # ['comments', 'users']
+
+.. seealso::
+
+  Look at the *migrate* function for Verse for more details.
+
+    """
+    return [name for name in list(self) if self.new(name).migrate()]
 
   def close(self):
     """
@@ -1949,6 +3985,53 @@ Closes the database connection
     """
     self.connection.close()
 
+  def tune(self, profile=None, **pragmas):
+    """
+Sets SQlite's ``PRAGMA`` settings for the connection. Either a profile, individual pragmas or both
+can be given. The supported pragmas are ``journal_mode``, ``synchronous``, ``cache_size``,
+``temp_store``, ``mmap_size`` and ``page_size``. The previous values are returned, so they can be restored.
+
+.. code-block:: python
+
+  # for loading data
+  uv = Underverse('data.db', profile='bulk_load')
+
+  # profiles can be changed later and pragmas can be set separately
+  previous = uv.tune('analytics', cache_size=-1048576)
+
+  # back to the way it was
+  uv.tune(**previous)
+
+The profiles are:
+
+  * ``bulk_load`` - the journal is kept in memory and data isn't synced to disk
+  * ``analytics`` - a large page cache, temporary tables in memory and memory-mapped reads
+  * ``durable`` - a rollback journal on disk and every commit is synced
+
+.. note::
+
+  ``page_size`` only changes once the database is vacuumed (or before anything has been written to it).
+
+    """
+    return self.connection.tune(profile, **pragmas)
+
+  def batch(self, every=None):
+    """
+Commits all of the changes made inside of the ``with`` block at once, or rolls them back if an exception is raised.
+
+.. code-block:: python
+
+  with uv.batch():
+    uv.users.add(user)
+    uv.accounts.update(account)
+
+.. seealso::
+
+  Look at the *batch* function for Verse for more details.
+
+    """
+    return self.connection.batch(every)
+
   def dump(self, filename):
     """
 Dumps the underverse to a .sql file which can be loaded in the future.
@@ -1958,9 +4041,13 @@ Dumps the underverse to a .sql file which can be loaded in the future.
   uv.dump("backup.sql")
 
     """
+    # text indexes are built again when the dump is loaded, only their definition is kept
+    virtual = [r[0] for r in self.connection.execute("select name from sqlite_master where type='table' and sql like 'CREATE VIRTUAL TABLE%'")]
+    skip = tuple(['INSERT INTO "%s" ' % v for v in virtual] + ["CREATE TABLE '%s_" % v for v in virtual] + ['INSERT INTO "%s_' % v for v in virtual])
     with open(filename, 'w') as f:
       for line in self.connection.iterdump():
-        f.write('%s\n' % line)
+        if len(skip) == 0 or not line.startswith(skip):
+          f.write('%s\n' % line)
 
   def load(self, filename):
     """
@@ -1972,7 +4059,18 @@ Loads a persited underverse. Using this method to populate a collection is subst
 
     """
     with open(filename, 'r') as f:
-     self.connection.cursor().executescript(f.read())
+      script = f.read()
+    if Catalog(self.connection).exists():
+      # merge the catalog of the dump with the one already loaded
+      script = script.replace('CREATE TABLE %s ' % Catalog.TABLE, 'CREATE TABLE IF NOT EXISTS %s ' % Catalog.TABLE)
+      script = script.replace('INSERT INTO "%s" ' % Catalog.TABLE, 'INSERT OR REPLACE INTO "%s" ' % Catalog.TABLE)
+    self.connection.cursor().executescript(script)
+    # the catalog may have changed
+    self.connection._verses.clear()
+    for name in Catalog(self.connection).verses('text'):
+      verse = self.new(name)
+      verse._text_fill()
+      self.connection.commit()
 
   @staticmethod
   def register(clazz, handler):
@@ -2016,6 +4114,32 @@ Loads a persited underverse. Using this method to populate a collection is subst
     """
     jsonpickle.handlers.registry.register(clazz, handler)
 
+  @staticmethod
+  def register_codec(codec):
+    """
+    This registers a custom codec so collections can be created with it.
+
+    .. code-block:: python
+
+      from underverse.codec import Codec
+
+      # JSON with the keys in order, so equal documents are stored identically
+      class SortedCodec(Codec):
+        name = 'sorted'
+        json = True
+
+        def encode(self, doc):
+          return json.dumps(doc, sort_keys=True)
+
+        def decode(self, data):
+          return json.loads(data)
+
+      Underverse.register_codec(SortedCodec())
+      events = uv.new('events', codec='sorted')
+
+    """
+    return register_codec(codec)
+
   @staticmethod
   def add_json_ext(encoder, decoder, clazz):
     """
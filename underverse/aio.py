@@ -0,0 +1,319 @@
+"""
+Asynchronous API
+================
+
+``AsyncUnderverse`` wraps an ``Underverse`` for programs which run on an asyncio event
+loop. All the SQlite work and the decoding run on a thread of their own, so queries
+never block the loop. The functions return futures for their results.
+
+The module uses ``asyncio`` if it's there, or else the ``trollius`` backport (and the
+``futures`` package) on python 2.
+
+.. code-block:: python
+
+  import trollius as asyncio
+  from trollius import From
+  from underverse.aio import AsyncUnderverse
+  from underverse.model import Document as D
+
+  uv = AsyncUnderverse('data.db')
+  users = uv.users
+
+  @asyncio.coroutine
+  def handler(request):
+    yield From(users.add({'name': 'ed', 'age': 31}))
+
+    # the documents are fetched and decoded 500 at a time
+    results = users.find(D.age > 30)
+    while True:
+      docs = yield From(results.fetch())
+      if not docs:
+        break
+
+    counts = yield From(users.aggregate(by='age', count=True))
+
+The results of ``find`` also implement ``__aiter__`` and ``__anext__``, so with native
+asyncio they can be read with ``async for user in users.find(D.age > 30)``.
+
+When a task reading from ``find`` is cancelled (for example because the client went
+away), the scan stops after the current document instead of reading the rest of the
+collection. ``cancel`` and ``aclose`` stop it by hand.
+
+"""
+import threading, functools
+from collections import deque
+try:
+  import asyncio
+except ImportError:
+  import trollius as asyncio
+from concurrent.futures import ThreadPoolExecutor
+from underverse import Underverse, SubVerse
+
+__all__ = ['AsyncUnderverse', 'AsyncVerse', 'AsyncResults']
+
+try:
+  _StopAsyncIteration = StopAsyncIteration
+except NameError:
+  # python 2 doesn't have async for, so this is only seen by __anext__'s callers
+  _StopAsyncIteration = StopIteration
+
+class AsyncUnderverse(object):
+  """
+An ``Underverse`` whose collections are used from an asyncio event loop. The arguments
+are the same as ``Underverse``'s, plus the event ``loop`` (the current one by default).
+
+The database is opened by the thread which runs the queries, which is the only thread
+to ever use its connection. ``underverse`` is the ``Underverse``; only use it from the
+functions given to ``run``.
+
+  """
+  def __init__(self, filename=None, profile=None, loop=None, **kwargs):
+    super(AsyncUnderverse, self).__init__()
+    self._loop = loop or asyncio.get_event_loop()
+    self._executor = ThreadPoolExecutor(1)
+    self.underverse = self._executor.submit(Underverse, filename, profile, **kwargs).result()
+
+  def run(self, function, *args, **kwargs):
+    """
+Calls a function on the database's thread. Returns a future for its result.
+
+.. code-block:: python
+
+  names = yield From(uv.run(lambda: list(uv.underverse)))
+
+    """
+    return self._loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+  def new(self, name, codec=None):
+    """
+Returns the ``AsyncVerse`` for a collection, see ``Underverse.new``
+    """
+    return AsyncVerse(self, name, codec)
+
+  def __getattr__(self, attr):
+    if attr.startswith('_'):
+      raise AttributeError, attr
+    return self.new(attr)
+
+  def dump(self, filename):
+    return self.run(self.underverse.dump, filename)
+
+  def load(self, filename):
+    return self.run(self.underverse.load, filename)
+
+  def close(self):
+    """
+Closes the database once the queued work is done. Returns a future.
+    """
+    future = self.run(self.underverse.close)
+    self._executor.shutdown(wait=False)
+    return future
+
+def _method(name):
+  # a function of AsyncVerse which calls the Verse function on the database's thread
+  def method(self, *args, **kwargs):
+    return self.run(lambda verse: getattr(verse, name)(*args, **kwargs))
+  method.__name__ = name
+  method.__doc__ = """
+Calls ``Verse.%s`` on the database's thread. Returns a future for its result.
+  """ % name
+  return method
+
+class AsyncVerse(object):
+  """
+The asynchronous version of a ``Verse``. The functions which read or write documents
+return futures. ``find`` and ``stream`` return an ``AsyncResults``, which is read a
+chunk at a time with ``fetch`` (or with ``async for``).
+
+Futures which are cancelled before their turn comes never run. Other work can be done
+on the ``Verse`` with ``run``.
+
+.. code-block:: python
+
+  count = yield From(users.run(len))
+
+  """
+  def __init__(self, uv, name, codec=None):
+    super(AsyncVerse, self).__init__()
+    self._uv = uv
+    self._name = name
+    self._codec = codec
+
+  def _verse(self):
+    # only called on the database's thread
+    return self._uv.underverse.new(self._name, self._codec)
+
+  def run(self, function):
+    """
+Calls ``function(verse)`` on the database's thread. Returns a future for its result.
+    """
+    return self._uv.run(lambda: function(self._verse()))
+
+  add = _method('add')
+  update = _method('update')
+  remove = _method('remove')
+  remove_many = _method('remove_many')
+  purge = _method('purge')
+  put = _method('put')
+  get = _method('get')
+  get_many = _method('get_many')
+  find_one = _method('find_one')
+  glob = _method('glob')
+  search = _method('search')
+  aggregate = _method('aggregate')
+  mapreduce = _method('mapreduce')
+  stats = _method('stats')
+  create_index = _method('create_index')
+
+  def count(self):
+    """
+Returns a future for the number of documents in the collection.
+    """
+    return self.run(len)
+
+  def orderby(self, *attrs, **kwargs):
+    """
+Sorts the collection like ``Verse.orderby``. Returns a future for a SubVerse of the
+sorted documents, which are all read on the database's thread.
+    """
+    # Verse.orderby can return a lazy SubVerse, which would read the database on the loop's thread
+    return self.run(lambda verse: SubVerse(list(verse.orderby(*attrs, **kwargs))))
+
+  def find(self, *filters, **kwargs):
+    """
+Searches the collection like ``Verse.find``. The documents are read ``size`` at a time
+(500 by default) while they are iterated.
+
+.. code-block:: python
+
+  errors = logs.find(D.level == 'ERROR', size=100)
+  first = yield From(errors.fetch())
+  rest = yield From(errors.all())
+
+    """
+    size = kwargs.get('size', 500)
+    return AsyncResults(self, lambda verse: verse.stream(*filters), size)
+
+  stream = find
+
+class AsyncResults(object):
+  """
+The documents found by ``AsyncVerse.find``. They are read from a lazy SubVerse (see
+``Verse.stream``) ``size`` at a time on the database's thread.
+
+  """
+  def __init__(self, averse, query, size=500):
+    super(AsyncResults, self).__init__()
+    if size < 1:
+      raise ValueError, "The size must be 1 or more"
+    self._averse = averse
+    self._query = query
+    self.size = size
+    self._iterator = None
+    self._buffer = deque()
+    self._finished = False
+    self._cancelled = threading.Event()
+
+  def _next(self, size):
+    # runs on the database's thread. Returns up to size documents, fewer means there aren't any more
+    docs = []
+    if self._cancelled.is_set():
+      self._iterator = None
+      return docs
+    if self._iterator is None:
+      self._iterator = iter(self._query(self._averse._verse()))
+    for doc in self._iterator:
+      docs.append(doc)
+      if len(docs) >= size or self._cancelled.is_set():
+        break
+    if len(docs) < size or self._cancelled.is_set():
+      self._iterator = None
+    return docs
+
+  def fetch(self):
+    """
+Returns a future for the next chunk of documents, which is an empty list once they have
+all been read.
+    """
+    loop = self._averse._uv._loop
+    if len(self._buffer) > 0:
+      future = asyncio.Future(loop=loop)
+      docs = list(self._buffer)
+      self._buffer.clear()
+      future.set_result(docs)
+      return future
+    if self._finished or self._cancelled.is_set():
+      future = asyncio.Future(loop=loop)
+      future.set_result([])
+      return future
+    future = self._averse._uv.run(self._next, self.size)
+    def done(future):
+      if future.cancelled() or future.exception() is not None or len(future.result()) < self.size:
+        self._finished = True
+    future.add_done_callback(done)
+    return future
+
+  def all(self):
+    """
+Returns a future for a SubVerse of the documents which haven't been read yet.
+    """
+    def remaining():
+      docs = list(self._buffer)
+      self._buffer.clear()
+      while True:
+        chunk = self._next(self.size)
+        docs.extend(chunk)
+        if len(chunk) < self.size:
+          return SubVerse(docs)
+    self._finished = True
+    return self._averse._uv.run(remaining)
+
+  def _close(self):
+    # runs on the database's thread, the query's cursor is let go
+    iterator, self._iterator = self._iterator, None
+    if hasattr(iterator, 'close'):
+      iterator.close()
+
+  def cancel(self):
+    """
+Stops reading the documents. A chunk which is being read stops after the current document.
+Returns a future which is done once the query is closed.
+    """
+    self._cancelled.set()
+    self._buffer.clear()
+    return self._averse._uv.run(self._close)
+
+  aclose = cancel
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    loop = self._averse._uv._loop
+    result = asyncio.Future(loop=loop)
+    if len(self._buffer) > 0:
+      result.set_result(self._buffer.popleft())
+      return result
+
+    def ready(chunk):
+      if result.cancelled():
+        return
+      if chunk.cancelled():
+        result.cancel()
+      elif chunk.exception() is not None:
+        result.set_exception(chunk.exception())
+      elif len(chunk.result()) == 0:
+        result.set_exception(_StopAsyncIteration())
+      else:
+        docs = chunk.result()
+        self._buffer.extend(docs[1:])
+        result.set_result(docs[0])
+
+    def cancelled(result):
+      # the task waiting for the documents was cancelled, stop scanning
+      if result.cancelled():
+        self.cancel()
+
+    self.fetch().add_done_callback(ready)
+    result.add_done_callback(cancelled)
+    return result
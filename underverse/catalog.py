@@ -0,0 +1,101 @@
+"""
+Catalog
+=======
+
+Each Underverse database can store information about its collections (indexes and
+other settings) in a small metadata table named ``__underverse_catalog__``. The
+table is only created once there is something to store, so databases which never
+use these features look exactly like they did before.
+
+Every entry is a ``(verse, key, value)`` row. Values are stored as JSON.
+
+"""
+import json
+
+__all__ = ['Catalog']
+
+class Catalog(object):
+  """
+Reads and writes collection metadata for a SQlite connection.
+
+.. code-block:: python
+
+  catalog = Catalog(uv.connection)
+  catalog.set('users', 'indexes', {'users__age': ['age']})
+  print catalog.get('users', 'indexes', {})
+
+  """
+  TABLE = '__underverse_catalog__'
+
+  def __init__(self, connection):
+    super(Catalog, self).__init__()
+    self._connection = connection
+
+  def exists(self):
+    """
+    Returns True if the catalog table has been created
+    """
+    return self._connection.execute("select 1 from sqlite_master where type='table' and name=?", (Catalog.TABLE,)).fetchone() is not None
+
+  def create(self):
+    self._connection.execute("create table if not exists %s (verse text not null, key text not null, value text, primary key (verse, key));" % Catalog.TABLE)
+
+  def get(self, verse, key, default=None):
+    """
+    Returns the value stored for a collection, or ``default`` if there isn't one
+    """
+    if not self.exists():
+      return default
+    row = self._connection.execute("select value from %s where verse=? and key=?;" % Catalog.TABLE, (verse, key)).fetchone()
+    if row is None:
+      return default
+    return json.loads(row[0])
+
+  def set(self, verse, key, value, commit=True):
+    """
+    Stores a JSON-serializable value for a collection
+    """
+    if not self.exists():
+      # sqlite3 commits the open transaction before a CREATE, even with 'if not exists'
+      self.create()
+    before = self._connection.total_changes
+    self._connection.execute("insert or replace into %s (verse, key, value) values (?, ?, ?);" % Catalog.TABLE, (verse, key, json.dumps(value)))
+    self._account(before)
+    if commit:
+      self._connection.commit()
+
+  def delete(self, verse, key=None, commit=True):
+    """
+    Removes a value, or every value for the collection if no key is given
+    """
+    if not self.exists():
+      return
+    before = self._connection.total_changes
+    if key is None:
+      self._connection.execute("delete from %s where verse=?;" % Catalog.TABLE, (verse,))
+    else:
+      self._connection.execute("delete from %s where verse=? and key=?;" % Catalog.TABLE, (verse, key))
+    self._account(before)
+    if commit:
+      self._connection.commit()
+
+  def _account(self, before):
+    # catalog writes don't change the collections' statistics (see underverse.connection)
+    if hasattr(self._connection, '_account'):
+      self._connection._account(before)
+
+  def verses(self, key):
+    """
+    Returns the collections which have a value stored for the key
+    """
+    if not self.exists():
+      return []
+    return [r[0] for r in self._connection.execute("select verse from %s where key=? order by verse;" % Catalog.TABLE, (key,))]
+
+  def items(self, verse):
+    """
+    Returns a dict of all the values stored for a collection
+    """
+    if not self.exists():
+      return {}
+    return dict((k, json.loads(v)) for k, v in self._connection.execute("select key, value from %s where verse=?;" % Catalog.TABLE, (verse,)))
@@ -0,0 +1,150 @@
+"""
+Codecs
+======
+
+A codec turns documents into the value stored in the ``data`` column of a collection
+and back again. Each collection has its own codec, which is chosen when the collection
+is first used and remembered in the database catalog.
+
+.. code-block:: python
+
+  uv = Underverse('data.db')
+
+  # plain dicts only, stored as JSON text
+  events = uv.new('events', codec='json')
+
+  # compact binary, builtin types only
+  samples = uv.new('samples', codec='marshal')
+
+The available codecs are:
+
+  * ``jsonpickle`` - the default. Any Python object can be stored and class instances are restored on the way out.
+  * ``json`` - the standard library's ``json`` module. Much faster than ``jsonpickle``, but only JSON types are kept. Class instances are stored as their ``__dict__``.
+  * ``marshal`` - the fastest codec. Only builtin types can be stored and the data isn't JSON, so queries are always evaluated in Python and indexes can't be created.
+
+Collections which were created before codecs existed have no catalog entry and keep using ``jsonpickle``.
+
+**Custom codecs**
+
+Subclass ``Codec`` and register it with ``Underverse.register_codec`` (or ``register_codec``).
+The codec has to be registered before a database which uses it is opened.
+
+.. code-block:: python
+
+  import zlib, json, sqlite3
+  from underverse.codec import Codec
+
+  class CompressedCodec(Codec):
+    name = 'zjson'
+
+    def encode(self, doc):
+      return sqlite3.Binary(zlib.compress(json.dumps(doc)))
+
+    def decode(self, data):
+      return json.loads(zlib.decompress(data))
+
+  Underverse.register_codec(CompressedCodec())
+  logs = uv.new('logs', codec='zjson')
+
+"""
+import json, marshal, sqlite3, jsonpickle
+
+__all__ = ['Codec', 'JsonPickleCodec', 'JsonCodec', 'MarshalCodec', 'register_codec', 'get_codec']
+
+DEFAULT = 'jsonpickle'
+
+class Codec(object):
+  """
+Base class for codecs.
+
+``encode`` returns the value stored in SQlite for a document and ``decode`` returns
+a dict from that value. ``json`` should only be True if the stored value is JSON text,
+because the JSON documents can be queried and indexed by SQlite.
+
+  """
+  name = None
+  json = False
+
+  def encode(self, doc):
+    raise NotImplementedError
+
+  def decode(self, data):
+    raise NotImplementedError
+
+  def __repr__(self):
+    return '<%s %s>' % (type(self).__name__, self.name)
+
+class JsonPickleCodec(Codec):
+  """
+The original ``jsonpickle`` encoding. Any Python object can be stored.
+  """
+  name = 'jsonpickle'
+  json = True
+
+  def encode(self, doc):
+    return jsonpickle.encode(doc)
+
+  def decode(self, data):
+    return jsonpickle.decode(data)
+
+def _default(obj):
+  # class instances are stored as their attributes
+  if hasattr(obj, '__dict__'):
+    return obj.__dict__
+  raise TypeError, "%r can't be stored with the 'json' codec. Use the 'jsonpickle' codec instead." % (obj,)
+
+class JsonCodec(Codec):
+  """
+Plain JSON, using the standard library's ``json`` module.
+  """
+  name = 'json'
+  json = True
+
+  def encode(self, doc):
+    return json.dumps(doc, separators=(',', ':'), default=_default)
+
+  def decode(self, data):
+    return json.loads(data)
+
+class MarshalCodec(Codec):
+  """
+Python's ``marshal`` format, stored as a BLOB.
+  """
+  name = 'marshal'
+
+  def encode(self, doc):
+    # marshal doesn't accept dict subclasses
+    return sqlite3.Binary(marshal.dumps(dict(doc)))
+
+  def decode(self, data):
+    return marshal.loads(str(data))
+
+_CODECS = {}
+
+def register_codec(codec):
+  """
+  Registers a codec instance under its ``name``
+  """
+  if not isinstance(codec, Codec):
+    raise TypeError, "Codecs must be instances of underverse.codec.Codec"
+  if not codec.name:
+    raise ValueError, "Codecs must have a name"
+  _CODECS[codec.name] = codec
+  return codec
+
+def get_codec(codec=None):
+  """
+  Returns the codec for a name (or a ``Codec`` instance, which is also registered)
+  """
+  if codec is None:
+    codec = DEFAULT
+  if isinstance(codec, Codec):
+    if _CODECS.get(codec.name) is not codec:
+      register_codec(codec)
+    return codec
+  if not codec in _CODECS:
+    raise ValueError, "Unknown codec: '%s'. Custom codecs must be registered with Underverse.register_codec." % codec
+  return _CODECS[codec]
+
+for _codec in (JsonPickleCodec(), JsonCodec(), MarshalCodec()):
+  register_codec(_codec)
@@ -0,0 +1,270 @@
+"""
+Query Compilation
+=================
+
+Translates ``Document`` conditions (and ``AND`` / ``OR`` combinations of them) into
+SQLite ``WHERE`` clauses. The documents are stored as JSON text, therefore SQLite's
+``json_extract`` function can look inside them without the rows ever being converted
+into Python objects. Only the documents that match are decoded.
+
+.. code-block:: python
+
+  from underverse.compiler import SQLCompiler
+  from underverse.model import Document as D
+
+  # scalar tells the compiler that no document holds an object or array in 'age'
+  sql, params = SQLCompiler(scalar=lambda name: True).compile(D.age > 30)
+  # sql    -> "coalesce(json_extract(data, '$.age'), json_extract(data, '$.__data__.age')) > ?"
+  # params -> [30]
+
+Anything that can't be translated (``udp``, ``udf``, regular expressions, ...) is
+handed back to the caller so it can be applied in Python as before.
+
+Attributes which are also stored in their own column (``created_at`` and ``updated_at``)
+are read from the column instead, so their indexes are used. These work for every codec,
+even when the documents aren't JSON.
+
+``json_extract`` returns objects and arrays as JSON text, which SQLite compares as a
+string. Python compares them by type instead, so the conditions check the JSON type
+of the attribute. Range conditions on strings are only compiled for attributes known
+not to hold objects or arrays (see ``scalar``).
+
+"""
+import re
+from underverse.model import Document, Slice
+from underverse.predicates import AND, OR
+
+__all__ = ['SQLCompiler']
+
+_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+_SCALARS = (int, long, float, str, unicode, bool)
+_NUMBERS = (int, long, float, bool)
+
+# in_ / nin lists longer than this are bound as a single JSON array
+_MAX_INLINE = 250
+
+class SQLCompiler(object):
+  """
+Compiles query objects into SQL for a single collection.
+
+``compile`` returns a ``(sql, params)`` pair, or ``None`` if the condition can't
+be expressed in SQL. ``split`` separates a list of ``find`` filters into the part
+which can be pushed into SQLite and the part which has to run in Python.
+
+  """
+  def __init__(self, column='data', columns=None, json=True, scalar=None):
+    super(SQLCompiler, self).__init__()
+    self.column = column
+    # attribute name -> column, for attributes stored outside of the document
+    self.columns = columns or {}
+    # False if the documents can't be read by SQlite's JSON functions
+    self.json = json
+    # attribute name -> True if no document holds an object or array there, None if unknown
+    self.scalar = scalar
+
+  def supports(self, name):
+    """
+    Returns True if the attribute can be read in SQL
+    """
+    return name in self.columns or (self.json and SQLCompiler.translatable(name))
+
+  @staticmethod
+  def translatable(name):
+    """
+    Returns True if the attribute name can be used as a JSON path
+    """
+    return type(name) in (str, unicode) and _FIELD.match(name) is not None
+
+  def path(self, name):
+    return "json_extract(%s, '$.%s')" % (self.column, name)
+
+  def field(self, name):
+    """
+    Returns the SQL expression for a document attribute.
+
+    Documents added from class instances are wrapped in a ``__data__`` key (see
+    ``NecRow.__getattr__``), so both locations are checked.
+    """
+    if name in self.columns:
+      return self.columns[name]
+    return "coalesce(json_extract(%s, '$.%s'), json_extract(%s, '$.__data__.%s'))" % (self.column, name, self.column, name)
+
+  def type(self, name):
+    """
+    Returns the SQL expression for the JSON type of a document attribute
+    """
+    if name in self.columns:
+      return "typeof(%s)" % self.columns[name]
+    return "coalesce(json_type(%s, '$.%s'), json_type(%s, '$.__data__.%s'))" % (self.column, name, self.column, name)
+
+  def composite(self, name):
+    """
+    SQL which is true when the attribute is a JSON object or array
+    """
+    return "coalesce(%s, 'null') in ('object', 'array')" % self.type(name)
+
+  def _scalar(self, name):
+    # True if the attribute never holds objects or arrays, columns never do
+    return name in self.columns or (self.scalar is not None and self.scalar(name))
+
+  def null(self, name):
+    """
+    SQL which is true when the attribute would be ``None`` in Python.
+
+    Missing top-level attributes are returned as ``None`` by ``NecRow``. Missing
+    nested attributes raise an error and are skipped, so only explicit nulls count.
+    """
+    if '.' in name and not name in self.columns:
+      return "coalesce(json_type(%s, '$.%s'), json_type(%s, '$.__data__.%s')) = 'null'" % (self.column, name, self.column, name)
+    return "%s is null" % self.field(name)
+
+  def compile(self, _filter):
+    """
+    Compiles a ``Document``, ``AND`` or ``OR`` into a ``(sql, params)`` tuple.
+
+    Returns ``None`` if any part of the condition can't be translated.
+    """
+    if isinstance(_filter, Document):
+      return self._document(_filter)
+    elif type(_filter) in (AND, OR):
+      return _filter.fold(self.compile, self._combine)
+    return None
+
+  def _combine(self, expression, compiled):
+    # joins the compiled conditions of an AND / OR
+    if len(compiled) == 0 or None in compiled:
+      return None
+    operand = ' and ' if type(expression) == AND else ' or '
+    return '(' + operand.join(c[0] for c in compiled) + ')', [p for c in compiled for p in c[1]]
+
+  def split(self, filters):
+    """
+    Separates ``find`` filters into a SQL ``WHERE`` clause and the filters left for Python.
+
+    Only the leading row-by-row conditions can be moved into SQL. Once a ``udf``
+    (``limit``, ``skip``, ``orderby``, ...) is found, the order of the remaining
+    filters matters and they are all left alone.
+
+    Returns ``(where, params, remaining)``, where ``where`` is ``None`` if nothing could be compiled.
+    """
+    parts = []
+    params = []
+    python = []
+    filters = list(filters)
+    i = 0
+    while i < len(filters) and (isinstance(filters[i], Document) or type(filters[i]) in (AND, OR)):
+      _filter = filters[i]
+      compiled = self.compile(_filter)
+      if compiled is not None:
+        parts.append(compiled[0])
+        params.extend(compiled[1])
+      elif type(_filter) == AND:
+        # AND-ed conditions can be separated, the rest is still checked in Python
+        rest = []
+        for f in _filter.filters:
+          c = self.compile(f)
+          if c is None:
+            rest.append(f)
+          else:
+            parts.append(c[0])
+            params.extend(c[1])
+        python.append(AND(*rest))
+      else:
+        python.append(_filter)
+      i += 1
+
+    if len(parts) == 0:
+      return None, [], filters
+    return ' and '.join(parts), params, python + filters[i:]
+
+  def slice(self, filters):
+    """
+    Merges the ``limit`` / ``skip`` filters at the front of the list into a single ``Slice``.
+
+    Returns ``(slice, remaining)``, where ``slice`` is ``None`` if the first filter isn't a slice.
+    """
+    filters = list(filters)
+    _slice = None
+    while len(filters) > 0 and isinstance(filters[0], Slice):
+      _slice = filters.pop(0) if _slice is None else _slice.then(filters.pop(0))
+    return _slice, filters
+
+  def _document(self, doc):
+    name = doc._name
+    op = doc._op
+    args = doc._args
+    if not self.supports(name):
+      return None
+
+    if op == 'exists':
+      # 'attr in doc' only checks the top-level keys
+      if '.' in name or not self.json:
+        return None
+      return "json_type(%s, '$.%s') is not null" % (self.column, name), []
+
+    field = self.field(name)
+    # objects and arrays are never equal to a scalar and are greater than the numbers in
+    # Python, the conditions check for them. How they compare to strings depends on their
+    # type name, so those are only compiled when there are none
+    if op in ('lt', 'lte', 'gt', 'gte', 'eq', 'ne'):
+      value = args[0]
+      if value is None or type(value) not in _SCALARS:
+        return None
+      sql = {'lt':'<', 'lte':'<=', 'gt':'>', 'gte':'>=', 'eq':'=', 'ne':'!='}[op]
+      if op in ('lt', 'lte', 'ne'):
+        # None is less than (and not equal to) everything in Python
+        compiled = "(%s %s ? or %s)" % (field, sql, self.null(name))
+      else:
+        compiled = "%s %s ?" % (field, sql)
+      if op in ('eq', 'ne') or type(value) in _NUMBERS:
+        if name in self.columns or (op in ('gt', 'gte') and self._scalar(name)):
+          return compiled, [value]
+        elif op in ('gt', 'gte', 'ne'):
+          return "(%s or %s)" % (compiled, self.composite(name)), [value]
+        return "(%s and not %s)" % (compiled, self.composite(name)), [value]
+      elif self._scalar(name):
+        return compiled, [value]
+      return None
+
+    elif op == 'btw':
+      left, right = args
+      if left is None or right is None or type(left) not in _SCALARS or type(right) not in _SCALARS:
+        return None
+      compiled = "(%s > ? and %s < ?)" % (field, field)
+      if name in self.columns:
+        return compiled, [left, right]
+      elif type(left) in _NUMBERS and type(right) in _NUMBERS:
+        return "(%s and not %s)" % (compiled, self.composite(name)), [left, right]
+      elif self._scalar(name):
+        return compiled, [left, right]
+      return None
+
+    elif op in ('in_', 'nin'):
+      values = args[0]
+      if type(values) not in (list, tuple, set, frozenset):
+        return None
+      values = list(values)
+      for v in values:
+        if v is None or type(v) not in _SCALARS:
+          return None
+      if len(values) == 0:
+        return ('0' if op == 'in_' else '1'), []
+
+      if len(values) > _MAX_INLINE:
+        import json
+        try:
+          placeholder, params = "select value from json_each(?)", [json.dumps(values)]
+        except (TypeError, ValueError, UnicodeDecodeError):
+          return None
+      else:
+        placeholder, params = ', '.join(['?'] * len(values)), values
+
+      if op == 'in_':
+        if name in self.columns:
+          return "%s in (%s)" % (field, placeholder), params
+        return "(%s in (%s) and not %s)" % (field, placeholder, self.composite(name)), params
+      if name in self.columns:
+        return "(%s not in (%s) or %s)" % (field, placeholder, self.null(name)), params
+      return "(%s not in (%s) or %s or %s)" % (field, placeholder, self.null(name), self.composite(name)), params
+
+    return None
@@ -0,0 +1,312 @@
+"""
+Connections
+===========
+
+Underverse opens its SQlite connections with the ``Connection`` class below. It is a
+regular ``sqlite3.Connection`` which also knows when it is inside of a batch (see
+``Underverse.batch`` and ``Verse.batch``).
+
+While a batch is open, the commits made by ``add``, ``update``, ``remove`` and the
+other write functions are skipped. All the changes are committed together when the
+batch ends, or rolled back if it ends with an exception.
+
+.. code-block:: python
+
+  uv = Underverse('data.db')
+
+  with uv.batch():
+    for doc in docs:
+      uv.docs.add(doc)
+
+The connection can also be tuned with SQlite's ``PRAGMA`` settings, either one at a time
+or with one of the profiles in ``PROFILES`` (see ``Underverse.tune``).
+
+On-disk databases can also be read through a ``Readers`` pool, which gives each thread
+its own read-only connection (see the ``readers`` option of ``Underverse``).
+
+"""
+import sqlite3, threading
+
+__all__ = ['Connection', 'Batch', 'Readers', 'PROFILES']
+
+# page_size has to be set before journal_mode, it can't be changed once the database is in WAL mode
+PRAGMAS = ('page_size', 'journal_mode', 'synchronous', 'cache_size', 'temp_store', 'mmap_size')
+
+_CHOICES = {
+  'journal_mode': ('delete', 'truncate', 'persist', 'memory', 'wal', 'off'),
+  'synchronous': ('off', 'normal', 'full', 'extra', 0, 1, 2, 3),
+  'temp_store': ('default', 'file', 'memory', 0, 1, 2),
+}
+
+PROFILES = {
+  # fast loading, the database may be corrupted if the machine crashes during the load
+  'bulk_load': {'journal_mode': 'memory', 'synchronous': 'off', 'cache_size': -262144, 'temp_store': 'memory'},
+  # large reads, a 256MB cache and up to 1GB of the file memory-mapped
+  'analytics': {'cache_size': -262144, 'temp_store': 'memory', 'mmap_size': 1073741824},
+  # every commit is synced to disk
+  'durable': {'journal_mode': 'delete', 'synchronous': 'full'},
+}
+
+class Connection(sqlite3.Connection):
+  """
+A ``sqlite3.Connection`` which defers commits while a batch is open.
+
+It also keeps up to 256 prepared statements (the ``sqlite3`` default is 100), so the
+statements used by each collection aren't parsed again on every call.
+  """
+  def __init__(self, *args, **kwargs):
+    # every query is parameterized, so each collection only needs a few prepared statements
+    kwargs.setdefault('cached_statements', 256)
+    super(Connection, self).__init__(*args, **kwargs)
+    self._batches = []
+    # collections being bulk loaded, their indexes are created when the load ends
+    self._loading = set()
+    # the Verse for each collection, reused by Underverse.new
+    self._verses = {}
+    # Verses with statistics which are saved in the catalog on the next commit
+    self._dirty = set()
+    # Verses with attribute statistics which haven't been saved yet (see Verse._save)
+    self._unsaved = set()
+    # total_changes made by Underverse itself, anything else means the statistics have to be counted again
+    self._own = 0
+    self._generation = 0
+    # the Readers pool, see reader
+    self.readers = None
+    self._owner = threading.current_thread()
+    self._committed = 0
+
+  @property
+  def batching(self):
+    """
+    True if a batch is open
+    """
+    return len(self._batches) > 0
+
+  def batch(self, every=None):
+    """
+    Returns a new ``Batch`` for the connection
+    """
+    return Batch(self, every)
+
+  def reader(self):
+    """
+    Returns the connection to read from: the current thread's connection from the ``Readers``
+    pool, or this connection if there isn't a pool or it has changes which aren't committed yet
+    """
+    if self.readers is None:
+      return self
+    if threading.current_thread() is self._owner and (len(self._batches) > 0 or self.total_changes != self._committed):
+      return self
+    return self.readers.connection()
+
+  def _foreign(self):
+    # True if called from a thread which didn't open the connection, those can only read
+    # through the Readers pool
+    return self.readers is not None and threading.current_thread() is not self._owner
+
+  def close(self):
+    if len(self._unsaved) > 0 and len(self._batches) == 0 and self.total_changes == self._committed:
+      # the attribute statistics are saved, as long as it doesn't commit anybody's changes
+      self._flush(True)
+      sqlite3.Connection.commit(self)
+    if self.readers is not None:
+      self.readers.close()
+    return sqlite3.Connection.close(self)
+
+  def tune(self, profile=None, **pragmas):
+    """
+    Sets the pragmas of a profile and / or the given pragmas. Returns the previous values.
+    """
+    values = {}
+    if profile is not None:
+      if not profile in PROFILES:
+        raise ValueError, "Unknown profile: '%s'. Profiles are: %s" % (profile, ', '.join(sorted(PROFILES)))
+      values.update(PROFILES[profile])
+    values.update(pragmas)
+
+    for name, value in values.items():
+      if not name in PRAGMAS:
+        raise ValueError, "Unknown pragma: '%s'. Pragmas are: %s" % (name, ', '.join(PRAGMAS))
+      if name in _CHOICES:
+        if type(value) in (str, unicode):
+          value = values[name] = value.lower()
+        if not value in _CHOICES[name]:
+          raise ValueError, "'%s' isn't a valid %s" % (value, name)
+      else:
+        values[name] = int(value)
+
+    if 'journal_mode' in values:
+      if self.batching:
+        raise ValueError, "The journal_mode can't be changed inside of a batch"
+      self.commit()
+
+    previous = {}
+    for name in PRAGMAS:
+      if name in values:
+        row = self.execute('pragma %s' % name).fetchone()
+        if row is not None:
+          previous[name] = row[0]
+        self.execute('pragma %s = %s' % (name, values[name])).fetchall()
+    return previous
+
+  def _account(self, before):
+    # the rows written since total_changes was 'before' were written by Underverse
+    self._own += self.total_changes - before
+
+  def _stamp(self):
+    # goes up when rows are written by anything else (raw SQL, Underverse.load, ...)
+    if self.total_changes != self._own:
+      self._own = self.total_changes
+      self._generation += 1
+    return self._generation
+
+  def _flush(self, full=False):
+    # saves the statistics of the Verses changed since the last commit. With 'full', the
+    # attribute statistics which haven't been saved yet are saved too
+    self._stamp()
+    while len(self._dirty) > 0:
+      self._dirty.pop()._save(full)
+    while full and len(self._unsaved) > 0:
+      self._unsaved.pop()._save(True)
+
+  def _rolled_back(self):
+    # the statistics of the Verses changed in the batch are loaded and counted again
+    for verse in self._dirty:
+      verse._stats = None
+    self._dirty.clear()
+    self._stamp()
+    self._generation += 1
+
+  def commit(self):
+    if len(self._batches) == 0:
+      self._flush()
+      sqlite3.Connection.commit(self)
+      self._committed = self.total_changes
+    elif len(self._batches) == 1:
+      self._batches[0].commit()
+
+class Batch(object):
+  """
+A context manager which turns every write made inside of it into a single transaction.
+
+If ``every`` is given, the changes are committed each time that many more rows have
+been written. Only the rows written since the last of these commits are rolled back
+if an exception is raised.
+
+Batches can be nested. A nested batch which raises an exception only rolls back its
+own changes (it is a SQlite ``SAVEPOINT``).
+
+  """
+  def __init__(self, connection, every=None):
+    super(Batch, self).__init__()
+    if not isinstance(connection, Connection):
+      raise TypeError, "Batches require a connection opened by Underverse"
+    if every is not None and every < 1:
+      raise ValueError, "Batches must commit every 1 or more rows"
+    self.connection = connection
+    self.every = every
+    self._savepoint = None
+    self._isolation_level = None
+    self._start = 0
+
+  def __enter__(self):
+    connection = self.connection
+    if len(connection._batches) == 0:
+      # the transaction is managed by hand, so SQlite doesn't commit before DDL statements
+      connection.commit()
+      self._isolation_level = connection.isolation_level
+      connection.isolation_level = None
+      connection.execute('begin')
+    else:
+      self._savepoint = 'underverse_batch_%d' % len(connection._batches)
+      connection.execute('savepoint %s' % self._savepoint)
+    self._start = connection.total_changes
+    connection._batches.append(self)
+    return self
+
+  def __exit__(self, _type, value, traceback):
+    connection = self.connection
+    connection._batches.remove(self)
+    if _type is not None:
+      # the rollback may remove tables or catalog entries the cached Verses know about
+      connection._verses.clear()
+      connection._rolled_back()
+    if self._savepoint is not None:
+      if _type is not None:
+        connection.execute('rollback to %s' % self._savepoint)
+      connection.execute('release %s' % self._savepoint)
+      return False
+
+    if _type is None:
+      connection._flush(True)
+    try:
+      self._end('commit' if _type is None else 'rollback')
+    finally:
+      connection.isolation_level = self._isolation_level
+    return False
+
+  def commit(self):
+    """
+    Called in place of the connection's commit, this only commits if ``every`` rows have been written
+    """
+    if self.every is not None and self.connection.total_changes - self._start >= self.every:
+      self.connection._flush()
+      self._end('commit')
+      self.connection.execute('begin')
+      self._start = self.connection.total_changes
+
+  def _end(self, statement):
+    try:
+      self.connection.execute(statement)
+    except sqlite3.OperationalError, e:
+      # executescript (used by Underverse.load) commits on its own
+      if not 'no transaction is active' in str(e):
+        raise
+    self.connection._committed = self.connection.total_changes
+
+class Readers(object):
+  """
+A pool of read-only connections to a database file, one for each thread which reads from it.
+
+The database should be in WAL mode (``Underverse`` sets it), so the readers don't wait for
+the writer or for each other, and each query reads the data committed when it started.
+
+.. code-block:: python
+
+  readers = Readers('data.db')
+  readers.connection().execute('select count(*) from users')
+
+  """
+  def __init__(self, path):
+    super(Readers, self).__init__()
+    self.path = path
+    self._local = threading.local()
+    self._connections = []
+    self._lock = threading.Lock()
+
+  def connection(self):
+    """
+    Returns the current thread's connection, which is opened the first time
+    """
+    connection = getattr(self._local, 'connection', None)
+    if connection is None:
+      # only used by this thread, but close can be called from any of them
+      connection = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_COLNAMES, check_same_thread=False)
+      connection.execute('pragma query_only = 1')
+      self._local.connection = connection
+      with self._lock:
+        self._connections.append(connection)
+    return connection
+
+  def __len__(self):
+    return len(self._connections)
+
+  def close(self):
+    """
+    Closes every connection in the pool
+    """
+    with self._lock:
+      connections, self._connections = self._connections, []
+    for connection in connections:
+      connection.close()
+    self._local = threading.local()
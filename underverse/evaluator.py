@@ -0,0 +1,208 @@
+"""
+Query Evaluation
+================
+
+Filters documents in Python with the conditions given to ``find``. The ``Document``
+conditions (and ``AND`` / ``OR`` combinations of them) which follow each other are
+compiled into a single function, which checks all of them on a row and stops at the
+first one that fails. The documents are then read once, whatever the number of
+conditions.
+
+.. code-block:: python
+
+  from underverse.evaluator import RowCompiler
+  from underverse.model import Document as D
+
+  test = RowCompiler().fuse([D.age > 30, D.name.match('J'), D.state.in_(['CA', 'NY'])])
+  adults = [doc for doc in docs if test(doc)]
+
+Everything which can be worked out before reading the rows is done once, when the
+function is compiled: regular expressions are compiled, ``in_`` / ``nin`` lists become
+frozensets and the attribute lookups are written out for each condition.
+
+Other filters (``udf``, ``limit``, ``orderby``, ...) work on the whole stream of
+documents, so they are applied between the compiled functions, in the order given.
+An ``orderby`` followed by a ``limit`` only keeps the first documents in a heap.
+
+"""
+import re
+from itertools import ifilter
+from underverse.model import Document, Slice
+from underverse.predicates import AND, OR, OrderBy, _truth, _RESERVED
+
+__all__ = ['RowCompiler']
+
+# the Document operators which can be compiled, and the test each one makes on the value 'v'
+_TESTS = {
+  'lt': 't = v < %(c0)s',
+  'lte': 't = v <= %(c0)s',
+  'gt': 't = v > %(c0)s',
+  'gte': 't = v >= %(c0)s',
+  'eq': 't = v == %(c0)s',
+  'ne': 't = v != %(c0)s',
+  'btw': 't = %(c0)s < v < %(c1)s',
+  'len': 't = len(v) == %(c0)s',
+  'type_': 't = type(v) is %(c0)s',
+  'match': 't = %(c0)s.match(v) is not None',
+  'search': 't = %(c0)s.search(v) is not None',
+  'nmatch': 't = %(c0)s.match(v) is None',
+  'nsearch': 't = %(c0)s.search(v) is None',
+  'udp': 't = %(c0)s(v, *%(c1)s, **%(c2)s)',
+  # a value which can't be hashed can still be in a list
+  'in_': 'try:\n  t = v in %(c0)s\nexcept TypeError:\n  t = v in %(c1)s',
+  'nin': 'try:\n  t = not v in %(c0)s\nexcept TypeError:\n  t = not v in %(c1)s',
+}
+
+def _checked(array, attr, predicate):
+  # a condition which can't be compiled, checked on its own
+  for row in array:
+    if attr in row or hasattr(row, attr):
+      if predicate(row):
+        yield row
+
+class RowCompiler(object):
+  """
+Compiles conditions into functions which take a document and return True if it matches.
+
+``fuse`` compiles a list of AND-ed conditions, with the same rules as ``find``: a document
+only matches a condition if it has the attribute. ``pipeline`` applies a whole list of
+``find`` filters to a stream of documents.
+
+  """
+  def __init__(self):
+    super(RowCompiler, self).__init__()
+    self._namespace = {'_truth': _truth}
+    self._functions = 0
+
+  @staticmethod
+  def compilable(_filter):
+    """
+    Returns True if the filter is a condition which can be compiled
+    """
+    if isinstance(_filter, Document):
+      return getattr(_filter, '_op', None) in _TESTS or getattr(_filter, '_op', None) == 'exists'
+    if type(_filter) in (AND, OR):
+      return all(RowCompiler.compilable(f) or (callable(f) and not isinstance(f, Document)) for f in _filter.filters)
+    return False
+
+  def _constant(self, value):
+    name = 'c%d' % len(self._namespace)
+    self._namespace[name] = value
+    return name
+
+  def _constants(self, doc):
+    # the names of the operands of a Document, prepared for the tests
+    op, args = doc._op, doc._args
+    if op in ('match', 'search', 'nmatch', 'nsearch'):
+      return [self._constant(re.compile(args[0]))]
+    if op in ('in_', 'nin'):
+      members = args[0]
+      if type(members) in (list, tuple, set):
+        try:
+          members = frozenset(members)
+        except TypeError:
+          # some of the values can't be hashed
+          pass
+      return [self._constant(members), self._constant(args[0])]
+    if op == 'udp':
+      function, _args, kwargs = args
+      return [self._constant(function), self._constant(_args), self._constant(kwargs)]
+    return [self._constant(a) for a in args]
+
+  def _document(self, doc, checked):
+    # the lines which set 't' to the result of a Document condition. With 'checked', a
+    # document which doesn't have the attribute doesn't match, like SubVerse.find
+    name = self._constant(doc._name)
+    if doc._op == 'exists':
+      return ['t = %s in row' % name]
+
+    values = dict(('c%d' % i, c) for i, c in enumerate(self._constants(doc)))
+    test = (_TESTS[doc._op] % values).split('\n')
+    fast = not (doc._name in _RESERVED or doc._name.startswith('_') or '.' in doc._name)
+    lines = []
+    if checked:
+      if fast:
+        lines.append('if %s in row:' % name)
+        lines.append('  v = row[%s]' % name)
+        lines.extend('  ' + l for l in test)
+        lines.append('else:')
+        lines.append('  try:')
+        lines.append('    v = getattr(row, %s)' % name)
+        lines.append('  except Exception:')
+        lines.append('    v = t = False')
+        lines.append('  else:')
+        lines.extend('    ' + l for l in test)
+      else:
+        lines.append('if %s in row or hasattr(row, %s):' % (name, name))
+        lines.append('  v = getattr(row, %s)' % name)
+        lines.extend('  ' + l for l in test)
+        lines.append('else:')
+        lines.append('  t = False')
+    else:
+      if fast:
+        lines.append('v = row[%s] if %s in row else getattr(row, %s)' % (name, name, name))
+      else:
+        lines.append('v = getattr(row, %s)' % name)
+      lines.extend(test)
+    return lines
+
+  def _child(self, _filter, checked):
+    # the lines which set 't' for one condition
+    if isinstance(_filter, Document):
+      return self._document(_filter, checked)
+    if type(_filter) in (AND, OR):
+      return ['t = %s(row)' % self._node(_filter)]
+    return ['t = _truth(%s(row))' % self._constant(_filter)]
+
+  def _function(self, filters, any_, checked):
+    # compiles a function which returns True if all (or any) of the filters match
+    name = 'f%d' % self._functions
+    self._functions += 1
+    lines = ['def %s(row):' % name]
+    for _filter in filters:
+      lines.extend('  ' + l for l in self._child(_filter, checked))
+      lines.append('  if t:' if any_ else '  if not t:')
+      lines.append('    return %s' % any_)
+    lines.append('  return %s' % (not any_))
+    exec '\n'.join(lines) in self._namespace
+    return name
+
+  def _node(self, _filter):
+    # AND and OR call the conditions' predicates directly, without checking for the attribute
+    return self._function(_filter.filters, type(_filter) == OR, False)
+
+  def fuse(self, filters):
+    """
+    Returns a single function for a list of conditions which all have to match
+    """
+    for _filter in filters:
+      if not RowCompiler.compilable(_filter):
+        raise TypeError, "Filter can't be compiled: %s" % _filter
+    return self._namespace[self._function(filters, False, True)]
+
+  def pipeline(self, array, filters):
+    """
+    Applies ``find`` filters to an iterable, returns an iterator of the documents which pass
+    """
+    result = iter(array)
+    run = []
+    for i, _filter in enumerate(filters):
+      if RowCompiler.compilable(_filter):
+        run.append(_filter)
+        continue
+      if len(run) > 0:
+        result = ifilter(self.fuse(run), result)
+        run = []
+      following = filters[i + 1] if i + 1 < len(filters) else None
+      if hasattr(_filter, '__predicate__'):
+        result = _checked(result, _filter._name, _filter._predicate)
+      elif isinstance(_filter, OrderBy) and isinstance(following, Slice) and following.limit is not None:
+        # only the documents the slice keeps are sorted
+        result = iter(_filter.top(result, following.skip + following.limit))
+      elif callable(_filter):
+        result = _filter(result)
+      else:
+        raise TypeError, "Filter given isn't recognized"
+    if len(run) > 0:
+      result = ifilter(self.fuse(run), result)
+    return result
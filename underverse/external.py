@@ -0,0 +1,193 @@
+"""
+External Sorting
+================
+
+Sorts documents which don't fit in memory. The documents are read in runs of at most
+``memory`` bytes, each run is sorted and written to a temporary file, and the files
+are then merged back together. Only one document per run is held while merging, so
+the sorted documents can be streamed whatever the size of the collection.
+
+At most ``FANIN`` files are open at once. When there are more runs than that, groups of
+``FANIN`` runs are merged into larger runs first, as many times as needed.
+
+This is what ``orderby``, ``groupby`` and ``paginate`` use when they are given a
+``memory`` budget:
+
+.. code-block:: python
+
+  uv = Underverse('events.db')
+
+  # at most 64MB of documents in memory at once
+  for event in uv.events.orderby('user', '-time', memory=64 * 1024 * 1024):
+    print event.user, event.time
+
+  for user, events in uv.events.groupby('user', memory=64 * 1024 * 1024):
+    print user, len(events)
+
+  for page in uv.events.paginate(500, orderby=['-time'], memory=64 * 1024 * 1024):
+    print len(page)
+
+The runs are stored encoded with the collection's codec, the way SQlite stores them,
+so the budget is the size of the encoded documents. The temporary files are created in
+``tempfile``'s directory (or the ``directory`` given) and removed once they are merged,
+once the sort is done or when the results are dropped.
+
+"""
+import heapq, tempfile, cPickle, os
+
+__all__ = ['ExternalSort']
+
+# the default memory budget in bytes
+MEMORY = 64 * 1024 * 1024
+
+# the most runs merged at once, each of them is an open file
+FANIN = 64
+
+# the memory used by each document besides its encoded data (the key, the list entry ...)
+_OVERHEAD = 128
+
+class ExternalSort(object):
+  """
+Sorts ``(values, data)`` pairs with a bounded amount of memory. ``values`` is the tuple
+of the attributes the documents are sorted on (see ``OrderBy.values``) and ``data`` the
+encoded document, which is returned in sorted order. Documents which have the same
+values keep the order they were given in.
+
+  * ``orderby`` - the ``OrderBy`` giving the attributes and their directions
+  * ``memory`` - the number of bytes of encoded documents sorted in memory at once
+  * ``directory`` - where the temporary files are written
+
+``runs`` is the number of sorted runs written by the last sort and ``passes`` the number
+of times they were merged into larger runs before the final merge.
+
+  """
+  def __init__(self, orderby, memory=MEMORY, directory=None):
+    super(ExternalSort, self).__init__()
+    if len(orderby.columns) == 0:
+      raise ValueError, "External sorts need at least one attribute"
+    if memory < 1:
+      raise ValueError, "The memory budget must be 1 byte or more"
+    self.orderby = orderby
+    self.memory = memory
+    self.directory = directory
+    self.runs = 0
+    self.passes = 0
+
+  def sort(self, rows):
+    """
+    Returns an iterator of the encoded documents, in sorted order
+    """
+    # the runs are kept in the order they were read, which keeps the sort stable
+    paths = []
+    files = []
+    try:
+      run = []
+      size = 0
+      for row in rows:
+        run.append(row)
+        size += len(row[1]) + _OVERHEAD
+        if size >= self.memory:
+          paths.append(self._spill(self._sorted(run)))
+          run = []
+          size = 0
+      run = self._sorted(run)
+      self.runs = len(paths)
+      self.passes = 0
+
+      if len(paths) == 0:
+        for values, data in run:
+          yield data
+        return
+      comparable = self.orderby.comparable()
+      while len(paths) > FANIN:
+        # the merged runs replace the ones they were merged from at the end of the list
+        count = len(paths)
+        while count > 0:
+          group = paths[:min(FANIN, count)]
+          path = self._combine(group, comparable)
+          del paths[:len(group)]
+          paths.append(path)
+          count -= len(group)
+        self.passes += 1
+
+      for path in paths:
+        files.append(open(path, 'rb'))
+      runs = [self._read(f, comparable) for f in files]
+      runs.append((comparable(values), values, data) for values, data in run)
+      for values, data in _merge(runs):
+        yield data
+    finally:
+      for f in files:
+        f.close()
+      for path in paths:
+        _remove(path)
+
+  def _sorted(self, run):
+    # sorts a run the way OrderBy sorts documents
+    values = [row[0] for row in run]
+    return [run[i] for i in self.orderby.order(values)]
+
+  def _spill(self, run):
+    # writes a sorted run to a temporary file and returns its path. The file is only
+    # opened again when it's merged, so the runs don't each keep a file open
+    fd, path = tempfile.mkstemp(prefix='underverse', dir=self.directory)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        for values, data in run:
+          if type(data) is buffer:
+            # BLOBs (sqlite3.Binary) can't be pickled
+            data = str(data)
+          # a pickler per document, its memo would keep the whole run in memory
+          cPickle.dump((values, data), f, cPickle.HIGHEST_PROTOCOL)
+    except:
+      _remove(path)
+      raise
+    return path
+
+  def _combine(self, paths, comparable):
+    # merges runs into a single larger run, the merged runs are removed
+    if len(paths) == 1:
+      return paths[0]
+    files = []
+    try:
+      for path in paths:
+        files.append(open(path, 'rb'))
+      return self._spill(_merge([self._read(f, comparable) for f in files]))
+    finally:
+      for f in files:
+        f.close()
+      for path in paths:
+        _remove(path)
+
+  def _read(self, f, comparable):
+    # reads a run back, one document at a time
+    while True:
+      try:
+        values, data = cPickle.load(f)
+      except EOFError:
+        return
+      yield comparable(values), values, data
+
+def _remove(path):
+  try:
+    os.remove(path)
+  except OSError:
+    pass
+
+def _merge(runs):
+  # k-way merge of the sorted runs, yields the (values, data) pairs. Equal keys are
+  # taken from the earlier run first, which keeps the sort stable
+  heap = []
+  for i, run in enumerate(runs):
+    for key, values, data in run:
+      heap.append((key, i, values, data, run))
+      break
+  heapq.heapify(heap)
+  while len(heap) > 0:
+    key, i, values, data, run = heap[0]
+    yield values, data
+    try:
+      key, values, data = run.next()
+      heapq.heapreplace(heap, (key, i, values, data, run))
+    except StopIteration:
+      heapq.heappop(heap)
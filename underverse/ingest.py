@@ -0,0 +1,205 @@
+"""
+Ingestion
+=========
+
+``Verse.writer`` returns a ``Writer``, which adds documents from a background thread.
+Producers put the documents on a bounded queue and return right away. The writer thread
+groups them into one ``executemany`` and one commit per ``size`` documents, or per
+``interval`` seconds when they arrive more slowly.
+
+.. code-block:: python
+
+  uv = Underverse('events.db')
+
+  with uv.events.writer(size=1000, interval=0.1) as writer:
+    # called from any number of threads
+    future = writer.add({'type': 'click', 'x': 1, 'y': 2})
+
+    # blocks until the document is committed, returns the number of documents
+    future.result()
+
+  # leaving the block (or writer.close()) commits everything which is still queued
+
+When the queue is full, ``add`` blocks until the writer has caught up. A ``timeout`` makes
+it raise ``Queue.Full`` instead.
+
+The writer thread has its own connection to the database, so it only works for on-disk
+databases. If a group of documents can't be written, each ``add`` is written again on its
+own and only the futures of the ones which still fail get the exception.
+
+"""
+import threading, time, Queue
+
+__all__ = ['Writer', 'Future']
+
+# put on the queue by close, the writer thread stops when it gets it
+_STOP = object()
+
+class Future(object):
+  """
+The result of ``Writer.add`` or ``Writer.flush``. ``result`` waits until the documents are
+committed and returns how many there were, or raises the exception they failed with.
+  """
+  def __init__(self, docs=None):
+    super(Future, self).__init__()
+    self.docs = docs
+    self.count = len(docs) if docs is not None else 0
+    self._event = threading.Event()
+    self._error = None
+
+  def done(self):
+    return self._event.is_set()
+
+  def result(self, timeout=None):
+    if not self._event.wait(timeout):
+      raise RuntimeError, "The documents haven't been written yet"
+    if self._error is not None:
+      raise self._error
+    return self.count
+
+  def exception(self, timeout=None):
+    if not self._event.wait(timeout):
+      raise RuntimeError, "The documents haven't been written yet"
+    return self._error
+
+  def _finish(self, error=None):
+    self._error = error
+    self.docs = None
+    self._event.set()
+
+class Writer(object):
+  """
+Adds documents to a collection from a background thread. ``connect`` is called by the
+thread and returns the ``Verse`` it writes to, on a connection of its own.
+
+  * ``size`` - the number of documents written in each transaction
+  * ``interval`` - the longest time in seconds a document waits for more documents to arrive
+  * ``maxsize`` - the number of ``add`` calls which can be queued before ``add`` blocks
+
+``written`` is the number of documents committed so far.
+
+  """
+  def __init__(self, connect, size=1000, interval=0.1, maxsize=10000):
+    super(Writer, self).__init__()
+    self.size = size
+    self.interval = interval
+    self.written = 0
+    self._queue = Queue.Queue(maxsize)
+    self._closed = False
+    self._started = threading.Event()
+    self._error = None
+    self._thread = threading.Thread(target=self._run, args=(connect,))
+    self._thread.daemon = True
+    self._thread.start()
+    self._started.wait()
+    if self._error is not None:
+      raise self._error
+
+  def add(self, necro, block=True, timeout=None):
+    """
+Queues a document or a list of documents, they are handled like ``Verse.add`` would.
+Returns a ``Future``.
+    """
+    if self._closed:
+      raise ValueError, "The writer is closed"
+    if hasattr(necro, '__iter__') and not isinstance(necro, dict):
+      docs = list(necro)
+    elif isinstance(necro, dict):
+      docs = [necro]
+    elif hasattr(necro, '__dict__'):
+      # Verse.add stores the attributes of a single object, but wraps objects in a list
+      docs = [dict(necro.__dict__)]
+    else:
+      raise ValueError, "Document could not be loaded. Please look at documentation for examples of loading data."
+    future = Future(docs)
+    self._queue.put(future, block, timeout)
+    return future
+
+  def flush(self, timeout=None):
+    """
+Commits the documents queued so far and waits until they are written.
+    """
+    if self._closed:
+      return
+    future = Future()
+    self._queue.put(future)
+    future.result(timeout)
+
+  def close(self):
+    """
+Commits the queued documents and stops the writer thread.
+    """
+    if self._closed:
+      return
+    self._closed = True
+    self._queue.put(_STOP)
+    self._thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, _type, value, traceback):
+    self.close()
+    return False
+
+  def _run(self, connect):
+    try:
+      verse = connect()
+    except Exception, e:
+      self._error = e
+      return
+    finally:
+      self._started.set()
+
+    queue = self._queue
+    stopping = False
+    try:
+      while not stopping:
+        group = []
+        count = 0
+        item = queue.get()
+        deadline = time.time() + self.interval
+        while True:
+          if item is _STOP:
+            stopping = True
+            break
+          group.append(item)
+          if item.docs is None:
+            # flush
+            break
+          count += item.count
+          if count >= self.size:
+            break
+          wait = deadline - time.time()
+          if wait <= 0:
+            break
+          try:
+            item = queue.get(True, wait)
+          except Queue.Empty:
+            break
+        self._write(verse, group)
+    finally:
+      verse._connection.close()
+
+  def _write(self, verse, group):
+    futures = [f for f in group if f.docs]
+    if len(futures) > 0:
+      connection = verse._connection
+      try:
+        with connection.batch():
+          verse.add([doc for f in futures for doc in f.docs])
+      except Exception:
+        # find the documents which can't be written
+        for future in futures:
+          try:
+            with connection.batch():
+              verse.add(future.docs)
+          except Exception, e:
+            future._finish(e)
+      for future in futures:
+        if not future.done():
+          self.written += future.count
+          future._finish()
+    for future in group:
+      if not future.done():
+        future._finish()
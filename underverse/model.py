@@ -1,4 +1,6 @@
+from itertools import islice
 from predicates import Predicate as P
+from predicates import Expression, Query, AND
 
 __all__ = ['DocumentModel', 'Document', 'QuasiDead', 'Join']
 
@@ -99,37 +101,37 @@ Here's an example:
 	def __init__(self, name):
 		super(Document, self).__init__()
 		self._name = name
-		self._predicate = P.exists(name)
+		self._op, self._args = 'exists', ()
 		self._desc = "has key: "+name
 
 	def __lt__(self, value):
 		self._desc = "%s < %s" % (self._name, value)
-		self._predicate = P.lt(self._name, value)
+		self._op, self._args = 'lt', (value,)
 		return self
 
 	def __le__(self, value):
 		self._desc = "%s <= %s" % (self._name, value)
-		self._predicate = P.lte(self._name, value)
+		self._op, self._args = 'lte', (value,)
 		return self
 
 	def __gt__(self, value):
 		self._desc = "%s > %s" % (self._name, value)
-		self._predicate = P.gt(self._name, value)
+		self._op, self._args = 'gt', (value,)
 		return self
 
 	def __ge__(self, value):
 		self._desc = "%s >= %s" % (self._name, value)
-		self._predicate = P.gte(self._name, value)
+		self._op, self._args = 'gte', (value,)
 		return self
 
 	def __eq__(self, value):
 		self._desc = "%s == %s" % (self._name, value)
-		self._predicate = P.eq(self._name, value)
+		self._op, self._args = 'eq', (value,)
 		return self
 
 	def __ne__(self, value):
 		self._desc = "%s != %s" % (self._name, value)
-		self._predicate = P.ne(self._name, value)
+		self._op, self._args = 'ne', (value,)
 		return self
 
 	def len(self, value):
@@ -145,7 +147,7 @@ Find documents where an attributes is a certain length
 
 		"""
 		self._desc = "len(%s) == %s" % (self._name, value)
-		self._predicate = P.len(self._name, value)
+		self._op, self._args = 'len', (value,)
 		return self
 
 	def btw(self, left, right):
@@ -161,7 +163,7 @@ Finds documents where an attribute is between the given left and right inputs
 
 		"""
 		self._desc = "%s < %s < %s" % (left, self._name, right)
-		self._predicate = P.btw(self._name, left, right)
+		self._op, self._args = 'btw', (left, right)
 		return self
 
 	def udp(self, function, *args, **kwargs):
@@ -200,7 +202,7 @@ You'll also notice that any ``*args`` or ``**kwargs`` are forwarded to the metho
 		if len(kwargs) > 0:
 			self._desc += ", " + ', '.join(['%s=%s' % (k, v) for k, v in kwargs.items()])
 		self._desc += ")"
-		self._predicate = P.udp(self._name, function, *args, **kwargs)
+		self._op, self._args = 'udp', (function, args, kwargs)
 		return self
 
 	def type(self, value):
@@ -217,7 +219,7 @@ Finds documents where an attribute's type matches the input type
 
 		"""
 		self._desc = "type(%s) == %s" % (self._name, value.__name__)
-		self._predicate = P.type_(self._name, value)
+		self._op, self._args = 'type_', (value,)
 		return self
 
 	def in_(self, value):
@@ -233,7 +235,7 @@ Finds documents where an attribute is in the given list
 
 		"""
 		self._desc = "%s in %s" % (self._name, value)
-		self._predicate = P.in_(self._name, value)
+		self._op, self._args = 'in_', (value,)
 		return self
 
 	def nin(self, value):
@@ -241,7 +243,7 @@ Finds documents where an attribute is in the given list
 Finds all documents where the attribute is NOT in the given list. Look at ``in_`` for an example.
 		"""
 		self._desc = "%s not in %s" % (self._name, value)
-		self._predicate = P.nin(self._name, value)
+		self._op, self._args = 'nin', (value,)
 		return self
 
 	def in_set(self, value):
@@ -263,7 +265,7 @@ Finds documents where an attribute is in the given **set**.
 		"""
 		_set = set(value)
 		self._desc = "%s in set(%s)" % (self._name, _set)
-		self._predicate = P.in_(self._name, _set)
+		self._op, self._args = 'in_', (_set,)
 		return self
 
 	def nin_set(self, value):
@@ -272,7 +274,7 @@ Finds all documents where the attribute is NOT in the given **set**. Look at ``i
 		"""
 		_set = set(value)
 		self._desc = "%s not in set(%s)" % (self._name, _set)
-		self._predicate = P.nin(self._name, _set)
+		self._op, self._args = 'nin', (_set,)
 		return self
 
 	def in_list(self, value):
@@ -294,7 +296,7 @@ Finds documents where an attribute is in the given **list**
 		"""
 		_set = list(value)
 		self._desc = "%s in set(%s)" % (self._name, _set)
-		self._predicate = P.in_(self._name, _set)
+		self._op, self._args = 'in_', (_set,)
 		return self
 
 	def nin_list(self, value):
@@ -303,7 +305,7 @@ Finds all documents where the attribute is NOT in the given **list**. Look at ``
 		"""
 		_set = list(value)
 		self._desc = "%s not in set(%s)" % (self._name, _set)
-		self._predicate = P.nin(self._name, _set)
+		self._op, self._args = 'nin', (_set,)
 		return self
 
 	def match(self, value):
@@ -317,7 +319,7 @@ Uses the ``re`` module to match data attributes. The regex must match exactly. T
 		
 		"""
 		self._desc = "re.compile('%s').match(%s)" % (value, self._name)
-		self._predicate = P.match(self._name, value)
+		self._op, self._args = 'match', (value,)
 		return self
 
 	def search(self, value):
@@ -331,7 +333,7 @@ Uses the ``re`` module to search data attributes. The regex doesn't have to matc
 
 		"""
 		self._desc = "re.compile('%s').search(%s)" % (value, self._name)
-		self._predicate = P.search(self._name, value)
+		self._op, self._args = 'search', (value,)
 		return self
 
 	def nmatch(self, value):
@@ -339,7 +341,7 @@ Uses the ``re`` module to search data attributes. The regex doesn't have to matc
 This finds the opposite of the ``match`` predicate.
 		"""
 		self._desc = "not re.compile('%s').match(%s)" % (value, self._name)
-		self._predicate = P.nmatch(self._name, value)
+		self._op, self._args = 'nmatch', (value,)
 		return self
 
 	def nsearch(self, value):
@@ -347,7 +349,7 @@ This finds the opposite of the ``match`` predicate.
 This finds the opposite of the ``search`` predicate.
 		"""
 		self._desc = "not re.compile('%s').search(%s)" % (value, self._name)
-		self._predicate = P.nsearch(self._name, value)
+		self._op, self._args = 'nsearch', (value,)
 		return self
 
 	@staticmethod
@@ -379,13 +381,7 @@ However, you can also do this:
 
 	@classmethod
 	def __lim__(self, array, count=2**32):
-		c = 0
-		docs = []
-		for doc in array:
-			if c < count:
-				docs.append(doc)
-			c += 1
-		return docs
+		return list(islice(array, max(count, 0)))
 
 	@staticmethod
 	def limit(value):
@@ -400,19 +396,11 @@ Limits the amount of documents found.
 		if not type(value) is int:
 			raise ValueError, "Limit predicates must be integers: limit(5)"
 
-		return P.udf(Document.__lim__, count=value)
+		return Slice(0, value)
 
 	@classmethod
 	def __limskip__(self, array, _skip=0, _limit=2**32):
-		c = 0
-		l = 0
-		docs = []
-		for doc in array:
-			if c >= _skip and l < _limit:
-				docs.append(doc)
-				l += 1
-			c += 1
-		return docs
+		return list(Slice(_skip, _limit)(array))
 
 	@staticmethod
 	def limskip(_skip, _limit):
@@ -430,17 +418,11 @@ Skips the first few documents found and also limits the records found based on t
 		if not type(_limit) is int:
 			raise ValueError, "Limit argument must be an integer: K.limskip(2, 5)"
 
-		return P.udf(Document.__limskip__, _skip, _limit)
+		return Slice(_skip, _limit)
 
 	@classmethod
 	def __skip__(self, array, _skip=0):
-		c = 0
-		docs = []
-		for doc in array:
-			if c >= _skip:
-				docs.append(doc)
-			c += 1
-		return docs
+		return list(islice(array, max(_skip, 0), None))
 
 	@staticmethod
 	def skip(value):
@@ -456,7 +438,7 @@ Skips the first few documents found based on the given input.
 		if not type(value) is int:
 			raise ValueError, "Skip predicates must be integers: K.skip(5)"
 
-		return P.udf(Document.__skip__, value)
+		return Slice(value)
 
 	@staticmethod
 	def udf(function, *args, **kwargs):
@@ -506,6 +488,21 @@ Or a real example...
 	def __predicate__(self):
 		return self._predicate
 
+	def __query__(self):
+		return Query(self._op, self._name, self._args)
+
+	def __reduce__(self):
+		return (_document, (self._name, self._op, self._args, self._desc))
+
+	@property
+	def _predicate(self):
+		# built from the query the first time it's needed, and again if the condition changes
+		cached = self.__dict__.get('_cached')
+		if cached is None or cached[0] != (self._op, self._name) or not cached[1] is self._args:
+			cached = ((self._op, self._name), self._args, self.__query__().predicate())
+			self.__dict__['_cached'] = cached
+		return cached[2]
+
 	@property
 	def exists(self):
 		return self.__exists__()
@@ -523,12 +520,58 @@ Or a real example...
 		# print "doc"
 
 		self._name = self.__dict__["_name"] + "." + attr
-		self._predicate = P.exists(self._name)
+		self._op, self._args = 'exists', ()
 		self._desc = "has key: " + self._name
 
 		# setattr(self, "_name", )
 		return self
 
+def _document(name, op, args, desc):
+	# a Document condition, used to unpickle them and by Query.filter
+	doc = Document(name)
+	doc._op, doc._args, doc._desc = op, tuple(args), desc
+	return doc
+
+
+class Slice(object):
+	"""
+Skips and limits the documents passed through it. This is what ``Document.limit``, 
+``Document.skip`` and ``Document.limskip`` return.
+
+Documents are pulled from the input one at a time, so the input stops being read as 
+soon as the limit is reached. When the slice comes straight after the conditions of 
+a ``Verse.find``, it's turned into a SQL ``LIMIT`` / ``OFFSET`` instead.
+
+	"""
+	def __init__(self, skip=0, limit=None):
+		super(Slice, self).__init__()
+		self.skip = max(skip, 0)
+		self.limit = None if limit is None else max(limit, 0)
+
+	def __call__(self, array):
+		if self.limit is None:
+			return islice(array, self.skip, None)
+		return islice(array, self.skip, self.skip + self.limit)
+
+	def then(self, other):
+		"""
+		Returns a single Slice which is the same as applying this slice and then the other one.
+		"""
+		skip = self.skip + other.skip
+		if self.limit is None:
+			limit = other.limit
+		else:
+			limit = max(self.limit - other.skip, 0)
+			if other.limit is not None:
+				limit = min(limit, other.limit)
+		return Slice(skip, limit)
+
+	def __query__(self):
+		return Query('slice', None, (self.skip, self.limit))
+
+	def __str__(self):
+		return "<Slice: skip %s, limit %s>" % (self.skip, self.limit)
+
 
 class QuasiDead(object):
 	"""
@@ -590,6 +633,10 @@ This function selects all documents where the logical AND of the arguments are t
 	# OR conditions MUST be surrounded by parentheses and separated by a |
 	# instead of being comma delimited
 	young_males = qd.find((qd.name == 'Max') | (qd.name == 'Tamara'))
+
+	# AND and OR can also combine the arrays, like they do for Verse.find
+	from underverse.predicates import AND, OR
+	young_males = qd.find(OR(qd.name == 'Max', AND(qd.name == 'Tamara', qd.age < 25)))
 	
 
 		"""
@@ -597,10 +644,15 @@ This function selects all documents where the logical AND of the arguments are t
 		import numpy as np
 		if len(bools) < 1:
 			raise Exception, "Find must have at least one argument"
+		def combine(expression, arrays):
+			if type(expression) == AND:
+				return np.logical_and.reduce(arrays)
+			return np.logical_or.reduce(arrays)
+		bools = [b.fold(lambda b: b, combine) if isinstance(b, Expression) else b for b in bools]
 		resultant = bools[0]
 		if len(bools) > 1:
 			for _bool in bools[1:]:
-				resultant *= _bool
+				resultant = resultant * _bool
 		return self.__class__(self.recarray[np.nonzero(resultant)[0]])
 
 	@staticmethod
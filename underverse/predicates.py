@@ -1,5 +1,5 @@
-import re
-from operator import attrgetter
+import re, heapq
+from operator import attrgetter, itemgetter
 
 ## TODO:
 ## 
@@ -25,7 +25,7 @@ from operator import attrgetter
 #+ skip
 #+ limit
 
-__all__ = ["Predicate", "AND", "OR"]
+__all__ = ["Predicate", "Query", "Expression", "AND", "OR", "OrderBy"]
 
 class UnknownPredicate(Exception):
   # """UnknownPredicate: raised when the predicate (conditional filter) is not understood"""
@@ -131,7 +131,7 @@ class Predicate(object):
 #   verse.find(Document.age.type() >= 25)
 
 #     """
-    yield lambda x: True if type(getattr(x, attr)) is value else False
+    return lambda x: True if type(getattr(x, attr)) is value else False
   
   @classmethod
   def in_(Predicate, attr, value):
@@ -266,22 +266,388 @@ class Predicate(object):
 #   verse.find(Document.orderby('name', 'age'))
 
 #     """
-    def sort(data, attrs):
-      attrs = list(attrs)
-      attrs.reverse()
-      for attr in attrs:
-        if type(attr) != str:
-          raise TypeError, "Orderby arguments must be strings"
-        if attr.startswith('-'):
-          data = sorted(data, key=attrgetter(attr[1:]), reverse=True)
-        else:
-          data = sorted(data, key=attrgetter(attr))
-      return data
-    
-    return lambda x: sort(x, args)
+    return OrderBy(*args)
     # return lambda x: tuple([getattr(x, arg) for arg in args])
 
-class OR(object):
+# the symbols of the comparison operators, for the canonical form of queries
+_SYMBOLS = {'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>=', 'eq': '==', 'ne': '!='}
+
+def _freeze(value):
+  # a hashable form of a query operand, equal operands have equal forms
+  if type(value) in (list, tuple):
+    return (type(value).__name__,) + tuple(_freeze(v) for v in value)
+  if type(value) in (set, frozenset):
+    return ('set', frozenset(_freeze(v) for v in value))
+  if type(value) == dict:
+    return ('dict', frozenset((k, _freeze(v)) for k, v in value.items()))
+  try:
+    hash(value)
+    return value
+  except TypeError:
+    return (type(value).__name__, repr(value))
+
+def _canonical(value):
+  # the canonical string of a query operand
+  if type(value) == list:
+    return '[%s]' % ', '.join(_canonical(v) for v in value)
+  if type(value) == tuple:
+    return '(%s%s)' % (', '.join(_canonical(v) for v in value), ',' if len(value) == 1 else '')
+  if type(value) in (set, frozenset):
+    return '{%s}' % ', '.join(sorted(_canonical(v) for v in value))
+  if type(value) == dict:
+    return '{%s}' % ', '.join(sorted('%s: %s' % (_canonical(k), _canonical(v)) for k, v in value.items()))
+  if type(value) == type:
+    return value.__name__
+  if callable(value) and hasattr(value, '__name__'):
+    return '%s.%s' % (getattr(value, '__module__', None), value.__name__)
+  return repr(value)
+
+class Query(object):
+  """
+  The structured form of a ``find`` condition, returned by ``__query__``. A query has an
+  operator (``op``), the dotted path of the attribute it checks (``field``) and its
+  ``operands``. The queries of ``AND`` and ``OR`` have no field, their operands are the
+  queries they combine.
+
+  Queries are hashable, compare by value and can be pickled (as long as their operands
+  can), so they can be used as cache keys or sent to other processes. ``str`` returns
+  the canonical form, which is the same for equal queries.
+
+  .. code-block:: python
+
+    q = Query.of(D.age > 30, OR(D.name == 'Max', D.name.in_(['Billy'])))
+    print q   # (age > 30 AND (name == 'Max' OR name.in_(['Billy'])))
+
+    # in another process
+    users.find(*pickle.loads(data).filters())
+
+  Leaves which aren't ``Document`` conditions (a ``udf``, an ``orderby`` or a ``Slice``)
+  are kept in the ``udf``, ``orderby`` and ``slice`` operators.
+
+  """
+  __slots__ = ('op', 'field', 'operands', '_key')
+
+  def __init__(self, op, field=None, operands=()):
+    self.op = op
+    self.field = field
+    self.operands = tuple(operands)
+    self._key = (op, field, _freeze(self.operands))
+
+  @staticmethod
+  def of(*filters):
+    """
+    Returns the query of a ``find`` condition, or of several AND-ed conditions
+    """
+    if len(filters) == 1:
+      _filter = filters[0]
+      if hasattr(_filter, '__query__'):
+        return _filter.__query__()
+      if callable(_filter):
+        return Query('udf', None, (_filter,))
+      raise TypeError, "Filter given isn't recognized"
+    return Query('and', None, [Query.of(f) for f in filters])
+
+  def filter(self):
+    """
+    Returns the ``find`` condition of the query
+    """
+    if self.op in ('and', 'or'):
+      return (AND if self.op == 'and' else OR)(*[q.filter() for q in self.operands])
+    if self.op == 'udf':
+      return self.operands[0]
+    if self.op == 'orderby':
+      return OrderBy(*self.operands)
+    from underverse.model import Slice, _document
+    if self.op == 'slice':
+      return Slice(*self.operands)
+    return _document(self.field, self.op, self.operands, str(self))
+
+  def filters(self):
+    """
+    Returns the list of conditions to give ``find``
+    """
+    if self.op == 'and':
+      return [q.filter() for q in self.operands]
+    return [self.filter()]
+
+  def predicate(self):
+    """
+    Returns the function checking the condition on one document
+    """
+    if self.op in ('and', 'or'):
+      return self.filter().test
+    if self.op == 'exists':
+      return Predicate.exists(self.field)
+    if self.op == 'udp':
+      function, args, kwargs = self.operands
+      return Predicate.udp(self.field, function, *args, **kwargs)
+    if self.op in ('udf', 'orderby', 'slice'):
+      raise TypeError, "'%s' queries filter the whole stream of documents" % self.op
+    return getattr(Predicate, self.op)(self.field, *self.operands)
+
+  def __hash__(self):
+    return hash(self._key)
+
+  def __eq__(self, other):
+    return isinstance(other, Query) and self._key == other._key
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __reduce__(self):
+    return (Query, (self.op, self.field, self.operands))
+
+  def __str__(self):
+    op, field, operands = self.op, self.field, self.operands
+    if op in ('and', 'or'):
+      return '(%s)' % (' %s ' % op.upper()).join(str(q) for q in operands)
+    if op in _SYMBOLS:
+      return '%s %s %s' % (field, _SYMBOLS[op], _canonical(operands[0]))
+    if op == 'exists':
+      return 'exists(%s)' % field
+    if op == 'btw':
+      return '%s < %s < %s' % (_canonical(operands[0]), field, _canonical(operands[1]))
+    if op == 'udp':
+      function, args, kwargs = operands
+      arguments = [_canonical(function)] + [_canonical(a) for a in args]
+      arguments += sorted('%s=%s' % (k, _canonical(v)) for k, v in kwargs.items())
+      return '%s.udp(%s)' % (field, ', '.join(arguments))
+    if op in ('udf', 'orderby', 'slice'):
+      return '%s(%s)' % (op, ', '.join(_canonical(o) for o in operands))
+    return '%s.%s(%s)' % (field, op, ', '.join(_canonical(o) for o in operands))
+
+  def __repr__(self):
+    return '<Query: %s>' % self
+
+_NUMBERS = (int, long, float, bool)
+
+# attribute names which NecRow and LazyRow have themselves (along with the ones starting with
+# an underscore). getattr returns those instead of the document's value
+_RESERVED = set(dir(dict))
+
+def _getter(names, as_tuple=False):
+  # works like attrgetter, but reads the keys of documents directly instead of going
+  # through NecRow.__getattr__. With 'as_tuple', a single attribute is also returned in a tuple
+  namespace = {}
+  fast = []
+  slow = []
+  for i, name in enumerate(names):
+    namespace['n%d' % i] = name
+    namespace['g%d' % i] = attrgetter(name)
+    slow.append('g%d(row)' % i)
+    if '.' in name or name.startswith('_') or name in _RESERVED:
+      fast.append(slow[-1])
+    else:
+      fast.append('row[n%d] if n%d in row else g%d(row)' % (i, i, i))
+  form = '%s' if len(names) == 1 and not as_tuple else '(%s,)'
+  source = 'def get(row):\n  if isinstance(row, dict):\n    return %s\n  return %s'
+  exec source % (form % ', '.join(fast), form % ', '.join(slow)) in namespace
+  return namespace['get']
+
+class _Descending(object):
+  # wraps the values of the descending attributes, so that they sort the other way
+  __slots__ = ('value',)
+
+  def __init__(self, value):
+    self.value = value
+
+  def __lt__(self, other):
+    return other.value < self.value
+
+  def __gt__(self, other):
+    return other.value > self.value
+
+  def __le__(self, other):
+    return other.value <= self.value
+
+  def __ge__(self, other):
+    return other.value >= self.value
+
+  def __eq__(self, other):
+    return self.value == other.value
+
+  def __ne__(self, other):
+    return self.value != other.value
+
+class OrderBy(object):
+  """
+  Sorts documents by one or more attributes, this is what ``Document.orderby`` returns.
+  Descending attributes start with a **-**.
+
+  The documents are sorted once, on a key made of all the attributes. Mixing ascending
+  and descending attributes needs one sort per direction, unless the descending values
+  are numbers. When the sort is followed by a ``limit`` in ``find``, only the first
+  documents are kept (with ``top``) instead of sorting them all, and when the attributes
+  can be read by SQlite the sort becomes a SQL ``ORDER BY``.
+
+  """
+  def __init__(self, *attrs):
+    super(OrderBy, self).__init__()
+    self.attrs = attrs
+    self.columns = []
+    for attr in attrs:
+      if type(attr) != str:
+        raise TypeError, "Orderby arguments must be strings"
+      if attr.startswith('-'):
+        self.columns.append((attr[1:], True))
+      else:
+        self.columns.append((attr, False))
+
+  def _sort(self, data, count=None):
+    # sorts the documents, keeping only the first 'count' of them if it's given
+    if len(self.columns) == 0:
+      return sorted(data) if count is None else heapq.nsmallest(count, data)
+    descending = [desc for name, desc in self.columns]
+    get = _getter([name for name, desc in self.columns])
+    if len(set(descending)) == 1:
+      # all the attributes are sorted the same way
+      if count is None:
+        return sorted(data, key=get, reverse=descending[0])
+      return (heapq.nlargest if descending[0] else heapq.nsmallest)(count, data, key=get)
+
+    # mixed ASC / DESC: the keys are read once
+    data = list(data)
+    return [data[i] for i in self.order(map(get, data), count)]
+
+  def order(self, values, count=None):
+    """
+    Returns the positions of the tuples of attribute values (see ``values``) in sorted order
+    """
+    descending = [desc for name, desc in self.columns]
+    if len(set(descending)) == 1:
+      if count is None:
+        return sorted(xrange(len(values)), key=values.__getitem__, reverse=descending[0])
+      select = heapq.nlargest if descending[0] else heapq.nsmallest
+      return select(count, xrange(len(values)), key=values.__getitem__)
+
+    # descending numbers are negated so that a single sort does it, other values are
+    # sorted one direction at a time
+    flagged = [i for i, desc in enumerate(descending) if desc]
+    if all(type(v[i]) in _NUMBERS for v in values for i in flagged):
+      keys = [tuple(-x if desc else x for x, desc in zip(v, descending)) for v in values]
+      if count is None:
+        return sorted(xrange(len(values)), key=keys.__getitem__)
+      return heapq.nsmallest(count, xrange(len(values)), key=keys.__getitem__)
+
+    runs = []
+    for i, desc in enumerate(descending):
+      if len(runs) > 0 and runs[-1][1] == desc:
+        runs[-1][0].append(i)
+      else:
+        runs.append(([i], desc))
+    order = range(len(values))
+    for columns, desc in reversed(runs):
+      column = itemgetter(*columns)
+      order.sort(key=lambda i: column(values[i]), reverse=desc)
+    return order if count is None else order[:count]
+
+  def comparable(self):
+    """
+    Returns a function which turns the tuple of a document's attribute values into a key
+    which sorts in ascending order, for sorts which compare keys one at a time
+    """
+    descending = [desc for name, desc in self.columns]
+    if not any(descending):
+      return lambda values: values
+    elif all(descending):
+      return _Descending
+    return lambda values: tuple(_Descending(v) if desc else v for v, desc in zip(values, descending))
+
+  def values(self):
+    """
+    Returns a function reading the tuple of attribute values from a document
+    """
+    return _getter([name for name, desc in self.columns], as_tuple=True)
+
+  def top(self, data, count):
+    """
+    Returns the first ``count`` documents of the sorted data, without sorting all of it
+    """
+    return self._sort(data, count)
+
+  def __call__(self, data):
+    return self._sort(data)
+
+  def __query__(self):
+    return Query('orderby', None, self.attrs)
+
+  def __str__(self):
+    return "<OrderBy: %s>" % ', '.join(self.attrs)
+
+def _truth(result):
+  # how AND and OR treat the result of a callable
+  if type(result) == bool:
+    return result
+  elif hasattr(result, '__iter__'):
+    return len(list(result)) > 0
+  else:
+    return False
+
+class Expression(object):
+  """
+  The base class of ``AND`` and ``OR``. The conditions they combine (``filters``) form a
+  boolean expression tree, whose leaves are ``Document`` conditions or callables.
+
+  ``test`` evaluates the tree for a single document. Calling the expression with an
+  iterable of documents yields the ones which match.
+
+  The same tree is read by the other backends: ``SQLCompiler`` translates it into a
+  ``WHERE`` clause and ``QuasiDead.find`` combines NumPy boolean arrays with it. ``fold``
+  walks the tree for them. ``__query__`` returns it as a ``Query``.
+
+  """
+  def __init__(self, *filters):
+    super(Expression, self).__init__()
+    self.filters = filters
+    self._tests = None
+
+  def __query__(self):
+    return Query(self.operator, None, [Query.of(f) for f in self.filters])
+
+  def __reduce__(self):
+    # the functions built by test aren't kept
+    return (type(self), self.filters)
+
+  def _compile(self):
+    # the per-row function of each condition
+    tests = []
+    for _filter in self.filters:
+      if hasattr(_filter, '__predicate__'):
+        tests.append(_filter.predicate)
+      elif isinstance(_filter, Expression):
+        tests.append(_filter.test)
+      elif callable(_filter):
+        tests.append(lambda d, _filter=_filter: _truth(_filter(d)))
+      else:
+        raise TypeError, "Filter given isn't recognized"
+    return tests
+
+  def test(self, row):
+    """
+    Returns True if the document matches the expression
+    """
+    raise NotImplementedError
+
+  def fold(self, leaf, combine):
+    """
+    Evaluates the tree bottom-up: ``leaf(condition)`` gives the value of each condition
+    and ``combine(expression, values)`` the value of each ``AND`` / ``OR``.
+    """
+    values = []
+    for _filter in self.filters:
+      if isinstance(_filter, Expression):
+        values.append(_filter.fold(leaf, combine))
+      else:
+        values.append(leaf(_filter))
+    return combine(self, values)
+
+  def __call__(self, data):
+    test = self.test
+    for d in data:
+      if test(d):
+        yield d
+
+class OR(Expression):
   """
   This class provides for the logical *OR-ing* of conditions.
 
@@ -298,38 +664,20 @@ class OR(object):
   The name filter can be simplified by using ``D.name.in_(['Billy', 'Zaphod'])``
 
   """
-  def __init__(self, *filters):
-    super(OR, self).__init__()
-    self.filters = filters
+  operator = 'or'
 
-  def __call__(self, data):
-    def match(result):
-      if type(result) == bool:
-        return result
-      elif hasattr(result, '__iter__'):
-        return len(list(result)) > 0
-      else:
-        return False
-    
-    for d in data:
-      tmp = False
-      for _filter in self.filters:
-        if hasattr(_filter, '__predicate__'):
-          tmp = _filter.predicate(d)
-        elif type(_filter) in [AND, OR]:
-          tmp = match(_filter([d]))
-        elif callable(_filter):
-          tmp = match(_filter(d))
-        else:
-          raise TypeError, "Filter given isn't recognized"
-        if tmp == True:
-          yield d
-          break
+  def test(self, row):
+    if self._tests is None:
+      self._tests = self._compile()
+    for test in self._tests:
+      if test(row):
+        return True
+    return False
 
   def __str__(self):
     return '('+' OR '.join([str(f) for f in self.filters])+')'
 
-class AND(object):
+class AND(Expression):
   """
   This provides for the logical *AND-ing* of conditions. This is the default behavior of Underverse.
 
@@ -347,35 +695,15 @@ class AND(object):
     Any conditions separated by a comma in the ``find`` functions are AND-ed together.
 
   """
-  def __init__(self, *filters):
-    super(AND, self).__init__()
-    self.filters = filters
+  operator = 'and'
 
-  def __call__(self, data):
-    def match(result):
-      if type(result) == bool:
-        return result
-      elif hasattr(result, '__iter__'):
-        return len(list(result)) > 0
-      else:
+  def test(self, row):
+    if self._tests is None:
+      self._tests = self._compile()
+    for test in self._tests:
+      if not test(row):
         return False
-        
-    for d in data:
-      tmp = True
-      for _filter in self.filters:
-        # print _filter
-        if hasattr(_filter, '__predicate__'):
-          tmp = _filter.predicate(d)
-        elif type(_filter) in [AND, OR]:
-          tmp = match(_filter([d]))
-        elif callable(_filter):
-          tmp = match(_filter(d))
-        else:
-          raise TypeError, "Filter given isn't recognized"
-        if not tmp:
-          break
-      if tmp:
-        yield d
+    return True
 
   def __str__(self):
     return '('+' AND '.join([str(f) for f in self.filters])+')'
@@ -0,0 +1,268 @@
+"""
+Statistics
+==========
+
+Each collection keeps statistics about its documents. They are updated by ``add``,
+``update``, ``remove`` and ``purge`` as the documents are written, so reading them
+never scans the collection. They are stored in the database catalog.
+
+.. code-block:: python
+
+  print uv.users.stats()
+  # {'count': 1000, 'size': 212.4, 'sampled': 1000,
+  #  'fields': {'age': {'count': 990, 'distinct': 71, 'min': 18, 'max': 90}, ...}}
+
+``count`` is the number of documents and ``size`` is the average number of bytes a
+document takes once it's encoded. ``fields`` has an entry for each top-level attribute:
+
+  * ``count`` - the number of documents which have the attribute
+  * ``distinct`` - an estimate of the number of different values (strings, numbers, booleans and nulls)
+  * ``min`` / ``max`` - the smallest and largest numbers, or ``None`` if there were no numbers
+
+The document count is exact. The field statistics are collected from ``sampled``
+documents, which is less than ``count`` for collections written before statistics
+existed. They are also estimates: removed documents are assumed to be typical of the
+collection and ``min``, ``max`` and ``distinct`` are never lowered. ``Verse.stats(refresh=True)``
+recomputes everything from the documents.
+
+Rows written on the same connection without a ``Verse`` (raw SQL, ``Underverse.load``)
+are noticed and the documents are counted again. Changes committed by other connections
+are read from the catalog, so they are only seen if they were made with Underverse.
+
+The document count and size are saved with every commit. The attribute statistics are
+only saved every ``Verse.STATS_EVERY`` rows, at the end of a batch and when the database
+is closed, so other connections may see older attribute statistics until then.
+
+"""
+import zlib, bisect
+
+__all__ = ['Stats']
+
+# the number of hashes kept for each field's distinct value estimate (about 12% error)
+SKETCH = 64
+
+_NUMBERS = (int, long, float)
+
+def _hash(value):
+  """
+  A 32-bit hash of a scalar which is the same in every process, or None for other values
+  """
+  t = type(value)
+  if t is unicode:
+    key = 's' + value.encode('utf-8')
+  elif t is str:
+    key = 's' + value
+  elif t is int or t is float or t is long:
+    # 1 == 1.0, so both have the same hash
+    key = 'n%r' % float(value)
+  elif t is bool:
+    key = 'b%d' % value
+  elif value is None:
+    key = 'z'
+  else:
+    return None
+  return zlib.crc32(key) & 0xffffffff
+
+def _bounds(field, other):
+  # adds another field's min / max, distinct value hashes and other values to a field
+  field[4] = None if field[4] is None or other[4] is None else field[4] + other[4]
+  for value in (other[1], other[2]):
+    if value is not None:
+      if field[1] is None or value < field[1]:
+        field[1] = value
+      if field[2] is None or value > field[2]:
+        field[2] = value
+  hashes = field[3]
+  for h in other[3]:
+    if len(hashes) == SKETCH and h >= hashes[-1]:
+      # the other hashes are sorted, the rest are larger too
+      break
+    i = bisect.bisect_left(hashes, h)
+    if i == len(hashes) or hashes[i] != h:
+      hashes.insert(i, h)
+      if len(hashes) > SKETCH:
+        hashes.pop()
+
+def _items(doc):
+  """
+  The top-level attributes of a document, including those of objects wrapped in ``__data__``
+  """
+  data = doc.get('__data__')
+  if data is None or not hasattr(data, '__dict__'):
+    return doc.iteritems()
+  items = [item for item in doc.iteritems() if item[0] != '__data__']
+  items.extend(data.__dict__.iteritems())
+  return items
+
+class Stats(object):
+  """
+Statistics for one collection. ``Verse`` keeps one for each collection and saves it
+in the catalog (see ``Verse._save``).
+
+Each field is stored as a ``[count, min, max, hashes, others]`` list, where ``hashes`` are
+the smallest ``SKETCH`` value hashes seen (a *k minimum values* sketch) and ``others`` the
+number of values which aren't strings, numbers, booleans or nulls (objects and arrays).
+
+  """
+  def __init__(self, count=0, size=0, sampled=0, fields=None):
+    super(Stats, self).__init__()
+    self.count = count
+    self.size = size
+    self.sampled = sampled
+    self.fields = fields if fields is not None else {}
+
+  @staticmethod
+  def load(value):
+    """
+    Returns the ``Stats`` for a value stored with ``dump``
+    """
+    fields = value['fields']
+    for field in fields.itervalues():
+      if len(field) == 4:
+        # saved before the other values were counted, they are unknown
+        field.append(None)
+    return Stats(value['count'], value['size'], value['sampled'], fields)
+
+  def dump(self):
+    """
+    Returns the statistics as a JSON-serializable dict
+    """
+    return {'count': self.count, 'size': self.size, 'sampled': self.sampled, 'fields': self.fields}
+
+  def average(self):
+    if self.count <= 0:
+      return 0
+    return float(self.size) / self.count
+
+  def add(self, doc, size):
+    """
+    Counts a new document, ``size`` is the length of its encoded data
+    """
+    self.count += 1
+    self.size += size
+    self.sampled += 1
+    fields = self.fields
+    # the min / max and the sketch are inlined, this runs for every attribute of every document added
+    for name, value in _items(doc):
+      field = fields.get(name)
+      if field is None:
+        field = fields[name] = [0, None, None, [], 0]
+      field[0] += 1
+      t = type(value)
+      if t is int or t is float or t is long:
+        if field[1] is None or value < field[1]:
+          field[1] = value
+        if field[2] is None or value > field[2]:
+          field[2] = value
+      h = _hash(value)
+      if h is not None:
+        hashes = field[3]
+        if len(hashes) < SKETCH:
+          i = bisect.bisect_left(hashes, h)
+          if i == len(hashes) or hashes[i] != h:
+            hashes.insert(i, h)
+        elif h < hashes[-1]:
+          i = bisect.bisect_left(hashes, h)
+          if hashes[i] != h:
+            hashes.insert(i, h)
+            hashes.pop()
+      elif field[4] is not None:
+        # unknown stays unknown, for fields loaded from older statistics
+        field[4] += 1
+
+  def merge(self, added):
+    """
+    Adds the documents counted by another ``Stats``. ``Verse`` counts the documents it
+    writes separately and only merges them once they have been written.
+    """
+    self.count += added.count
+    self.size += added.size
+    self.sampled += added.sampled
+    fields = self.fields
+    for name, other in added.fields.iteritems():
+      field = fields.get(name)
+      if field is None:
+        fields[name] = [other[0], other[1], other[2], list(other[3]), other[4]]
+      else:
+        field[0] += other[0]
+        _bounds(field, other)
+
+  def replace(self, changed):
+    """
+    Counts changed documents, which were counted by another ``Stats``. The sizes they had
+    before aren't known, so they're assumed to be the average.
+    """
+    self.size += changed.size - self.average() * changed.count
+    fields = self.fields
+    for name, other in changed.fields.iteritems():
+      if name in fields:
+        _bounds(fields[name], other)
+      else:
+        # an attribute the documents didn't have before
+        fields[name] = [other[0], other[1], other[2], list(other[3]), other[4]]
+
+  def remove(self, count):
+    """
+    Removes ``count`` documents, which are assumed to be typical of the collection
+    """
+    if count <= 0:
+      return
+    if count >= self.count:
+      self.clear()
+      return
+    remaining = float(self.count - count) / self.count
+    self.size -= self.average() * count
+    self.count -= count
+    self.sampled *= remaining
+    for field in self.fields.itervalues():
+      field[0] *= remaining
+
+  def recount(self, count, size):
+    """
+    Replaces the document count and size with the ones counted by SQlite
+    """
+    if self.sampled > count:
+      # documents were removed, assume they were typical
+      remaining = float(count) / self.sampled
+      self.sampled *= remaining
+      for field in self.fields.itervalues():
+        field[0] *= remaining
+    self.count = count
+    self.size = size
+
+  def clear(self):
+    self.count = 0
+    self.size = 0
+    self.sampled = 0
+    self.fields = {}
+
+  def scalar(self, name):
+    """
+    Returns True if every value of a top-level attribute is known to be a string, number,
+    boolean or null. Objects and arrays sort differently in SQlite and Python.
+    """
+    if int(round(self.sampled)) < self.count:
+      # some of the documents weren't counted
+      return False
+    field = self.fields.get(name)
+    return field is None or field[4] == 0
+
+  @staticmethod
+  def distinct(field):
+    """
+    Estimates the number of distinct values of a field
+    """
+    hashes = field[3]
+    if len(hashes) < SKETCH:
+      return len(hashes)
+    estimate = int(round((SKETCH - 1) * float(0x100000000) / (hashes[-1] + 1)))
+    return min(estimate, int(round(field[0])))
+
+  def summary(self):
+    """
+    Returns the statistics described at the top of the module
+    """
+    fields = {}
+    for name, field in self.fields.iteritems():
+      fields[name] = {'count': int(round(field[0])), 'distinct': Stats.distinct(field), 'min': field[1], 'max': field[2]}
+    return {'count': self.count, 'size': self.average(), 'sampled': int(round(self.sampled)), 'fields': fields}
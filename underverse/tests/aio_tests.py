@@ -0,0 +1,85 @@
+from underverse.model import Document as D
+import unittest, os, threading
+
+try:
+	from underverse.aio import AsyncUnderverse, asyncio
+	HAS_ASYNC = True
+except ImportError:
+	HAS_ASYNC = False
+
+class AsyncTestCase(unittest.TestCase):
+	def setUp(self):
+		if not HAS_ASYNC:
+			self.skipTest('asyncio (or trollius and futures) is not installed')
+		self.loop = asyncio.new_event_loop()
+		self.uv = AsyncUnderverse(loop=self.loop)
+		self.run = self.loop.run_until_complete
+		self.users = self.uv.users
+		self.run(self.users.add([{'name': 'user%d' % i, 'age': i} for i in range(50)]))
+
+	def tearDown(self):
+		self.run(self.uv.close())
+		self.loop.close()
+
+	def test_functions(self):
+		self.assertEqual(self.run(self.users.count()), 50)
+		self.assertEqual(self.run(self.users.add({'name': 'ed', 'age': 31})), 1)
+		self.assertEqual(self.run(self.users.find_one(D.name == 'ed')).age, 31)
+		self.assertEqual(len(self.run(self.users.aggregate(by='age', where=D.age < 10, count=True))), 10)
+		self.assertEqual(self.run(self.users.run(lambda verse: len(verse.find(D.age == 31)))), 2)
+
+		# everything runs on the database's thread
+		threads = self.run(self.uv.run(lambda: set([threading.current_thread().name])))
+		self.assertNotEqual(threads, set([threading.current_thread().name]))
+
+	def test_orderby(self):
+		expected = range(49, -1, -1)
+		# sorted by SQlite and by the external sort, which is read lazily
+		for kwargs in [{}, {'memory': 10}]:
+			results = self.run(self.users.orderby('-age', **kwargs))
+			self.assertFalse(results._lazy)
+			self.assertEqual([d.age for d in results], expected)
+
+	def test_find(self):
+		results = self.users.find(D.age >= 10, size=15)
+		chunks = []
+		while True:
+			docs = self.run(results.fetch())
+			if not docs:
+				break
+			chunks.append(len(docs))
+		self.assertEqual(chunks, [15, 15, 10])
+
+		results = self.users.find(D.age >= 10, size=15)
+		first = self.run(results.__anext__())
+		self.assertEqual(len(results._buffer), 14)
+		rest = self.run(results.all())
+		self.assertEqual(sorted([first.age] + [d.age for d in rest]), range(10, 50))
+
+	def test_cancel(self):
+		results = self.users.find(size=10)
+		self.run(results.__anext__())
+		results._buffer.clear()
+		future = results.__anext__()
+		future.cancel()
+		self.run(asyncio.sleep(0, loop=self.loop))
+		self.assertEqual(self.run(results.fetch()), [])
+		self.run(self.uv.run(lambda: None))
+		self.assertTrue(results._iterator is None)
+
+		# a dropped request stops the scan in the middle of a chunk
+		seen = []
+		def slow(age):
+			seen.append(age)
+			if len(seen) == 5:
+				# what cancel does on the loop's thread while the chunk is read
+				results._cancelled.set()
+			return True
+		results = self.users.find(D.age.udp(slow), size=1000)
+		self.assertEqual(len(self.run(results.fetch())), 5)
+		self.assertEqual(len(seen), 5)
+		self.assertEqual(self.run(results.fetch()), [])
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(AsyncTestCase)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,104 @@
+from underverse import Underverse, NecRow
+from underverse.model import Document as D
+from underverse.catalog import Catalog
+from underverse.codec import Codec, get_codec
+import unittest, os, json, zlib, sqlite3
+
+class Comment(object):
+	"""docstring for Comment"""
+	def __init__(self, text):
+		super(Comment, self).__init__()
+		self.text = text
+
+class CompressedCodec(Codec):
+	name = 'zjson'
+
+	def encode(self, doc):
+		return sqlite3.Binary(zlib.compress(json.dumps(doc)))
+
+	def decode(self, data):
+		return json.loads(zlib.decompress(data))
+
+class CodecTestCase(unittest.TestCase):
+	def setUp(self):
+		self.uv = Underverse()
+		self.uv.load('speed_test_smaller.sql')
+		self.people = list(self.uv.test)
+
+	def tearDown(self):
+		self.uv.close()
+
+	def roundtrip(self, codec):
+		verse = self.uv.new('people_' + codec, codec=codec)
+		verse.add(self.people)
+		self.assertEqual(verse.codec.name, codec)
+		self.assertEqual(len(verse), len(self.people))
+		self.assertEqual(sorted(p.uuid for p in verse), sorted(p.uuid for p in self.people))
+		for p in verse:
+			self.assertIsInstance(p, NecRow)
+		return verse
+
+	def test_default_codec(self):
+		test = self.uv.test
+		self.assertEqual(test.codec.name, 'jsonpickle')
+		self.assertEqual(Catalog(self.uv.connection).get('test', 'codec'), None)
+
+	def test_json_codec(self):
+		verse = self.roundtrip('json')
+		self.assertEqual(Catalog(self.uv.connection).get(verse._name, 'codec'), 'json')
+
+		expected = sorted(p.uuid for p in self.uv.test.find(D.age > 30, D.name == 'Max'))
+		self.assertEqual(sorted(p.uuid for p in verse.find(D.age > 30, D.name == 'Max')), expected)
+
+		raw = self.uv.connection.execute('select data from %s' % verse._name).fetchone()[0]
+		self.assertNotIn('py/object', raw)
+
+	def test_marshal_codec(self):
+		verse = self.roundtrip('marshal')
+
+		expected = sorted(p.uuid for p in self.uv.test.find(D.age > 30).orderby('name'))
+		self.assertEqual(sorted(p.uuid for p in verse.find(D.age > 30).orderby('name')), expected)
+		self.assertEqual(verse.find_one(D.name == 'Max').name, 'Max')
+		self.assertRaises(TypeError, verse.create_index, 'age')
+		self.assertEqual(sorted(verse.select('uuid', 'name')), sorted((p.uuid, p.name) for p in self.people))
+
+		p = verse.find_one()
+		p.age = 1000
+		verse.update(p)
+		self.assertEqual(verse.get(str(p.uuid)).age, 1000)
+
+	def test_json_objects(self):
+		verse = self.uv.new('comments', codec='json')
+		verse.add([Comment('first'), Comment('second')])
+		self.assertEqual(sorted(c.text for c in verse), ['first', 'second'])
+		self.assertEqual(len(verse.find(D.text == 'second')), 1)
+
+	def test_custom_codec(self):
+		Underverse.register_codec(CompressedCodec())
+		self.roundtrip('zjson')
+		self.assertIsInstance(get_codec('zjson'), CompressedCodec)
+		self.assertRaises(ValueError, self.uv.new, 'unknown', codec='unknown')
+
+	def test_codec_is_remembered(self):
+		self.uv.new('events', codec='json').add({'a': 1})
+		self.assertEqual(self.uv.events.codec.name, 'json')
+		self.assertEqual(self.uv.events.find_one(D.a == 1).a, 1)
+
+		# the codec can't be changed once there are documents
+		self.assertRaises(ValueError, self.uv.new, 'events', codec='marshal')
+		self.assertRaises(ValueError, self.uv.new, 'test', codec='json')
+
+	def test_dump_load(self):
+		self.uv.new('events', codec='json').add({'a': 1})
+		self.uv.dump('codec_test.sql')
+		try:
+			uv = Underverse()
+			uv.load('codec_test.sql')
+			self.assertEqual(uv.events.codec.name, 'json')
+			self.assertEqual(uv.events.find_one().a, 1)
+			uv.close()
+		finally:
+			os.remove('codec_test.sql')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -281,6 +281,127 @@ class FindTestCase(unittest.TestCase):
 				test = False
 			age = person.age
 
+	def test_orderby_limit(self):
+		from operator import attrgetter
+		from underverse import SubVerse
+		test = self.uv.test
+		docs = list(test)
+
+		def expected(attrs, skip, limit):
+			# one stable sort per attribute, last attribute first
+			data = docs
+			for attr in reversed(attrs):
+				data = sorted(data, key=attrgetter(attr.lstrip('-')), reverse=attr.startswith('-'))
+			return [d.uuid for d in data[skip:skip + limit]]
+
+		for attrs in (['-age'], ['name', '-age', 'college'], ['-name', 'age']):
+			for skip, limit in ((0, 10), (5, 20), (0, len(docs) + 1)):
+				# sorted by SQlite, in Python with a heap and with a full sort
+				self.assertEqual([d.uuid for d in test.find(Document.orderby(*attrs), Document.limskip(skip, limit))], expected(attrs, skip, limit))
+				self.assertEqual([d.uuid for d in SubVerse(docs).find(Document.orderby(*attrs), Document.limskip(skip, limit))], expected(attrs, skip, limit))
+				self.assertEqual([d.uuid for d in SubVerse(docs).orderby(*attrs)[skip:skip + limit]], expected(attrs, skip, limit))
+
+		# conditions left for Python don't stop the sort from running in SQlite
+		ages = [d.age for d in test.find(Document.name.search('a'), Document.orderby('-age'))]
+		self.assertEqual(ages, sorted(ages, reverse=True))
+		self.assertTrue('order' in test._plan([Document.orderby('name', '-age')])[0])
+
+	def test_orderby_mixed_types(self):
+		from underverse import SubVerse
+		test = self.uv.test2
+		for i, tags in enumerate([u'z', {u'k': 1}, [], u'b', 3, [1, 2], None, u'ab', [u'a']]):
+			test.add({'tags': tags, 'i': i})
+		test.add({'i': 9})
+		docs = list(test)
+
+		# objects and arrays are sorted by type in Python, so the sort isn't done by SQlite
+		self.assertEqual(test._plan([Document.orderby('-tags', 'i')])[0], None)
+		for attrs in (['-tags', 'i'], ['tags', '-i']):
+			expected = [d.i for d in SubVerse(docs).find(Document.orderby(*attrs))]
+			self.assertEqual([d.i for d in test.find(Document.orderby(*attrs))], expected)
+			self.assertEqual([d.i for d in test.orderby(*attrs)], expected)
+			self.assertEqual([d.i for d in test.orderby(*attrs, memory=100)], expected)
+			self.assertEqual([d.i for page in test.paginate(4, orderby=attrs) for d in page], expected)
+
+		test.remove_many(d for d in docs if type(d.tags) in (list, dict))
+		self.assertTrue('order' in test._plan([Document.orderby('-tags', 'i')])[0])
+		self.assertEqual([d.i for d in test.find(Document.orderby('-tags', 'i'))], [0, 3, 7, 4, 6, 9])
+
+	def test_external_sort(self):
+		from underverse import SubVerse
+		from underverse.external import ExternalSort
+		from underverse.predicates import OrderBy
+		test = self.uv.test
+		docs = list(test)
+		marshalled = self.uv.new('marshalled', codec='marshal')
+		marshalled.add([dict(d) for d in docs])
+
+		for attrs in (['-age'], ['name', '-age', 'college'], ['-name', 'age']):
+			expected = [d.uuid for d in SubVerse(docs).orderby(*attrs)]
+			# a few documents per run, so the runs are merged from temporary files
+			self.assertEqual([d.uuid for d in test.orderby(*attrs, memory=2000)], expected)
+			self.assertEqual([d.uuid for d in marshalled.orderby(*attrs, memory=2000)], expected)
+			self.assertEqual([d.uuid for d in SubVerse(docs).orderby(*attrs, memory=2000)], expected)
+
+		sort = ExternalSort(OrderBy('-age'), 2000)
+		self.assertEqual(len(list(sort.sort((OrderBy('-age').values()(d), test.codec.encode(d)) for d in docs))), len(docs))
+		self.assertTrue(sort.runs > 1)
+
+		groups = list(marshalled.groupby('name', memory=2000))
+		self.assertEqual([(name, len(people)) for name, people in groups], sorted((name, len(people)) for name, people in test.groupby('name')))
+		self.assertEqual(len(list(SubVerse(docs).groupby('name', 'gender', memory=2000))), len(test.groupby('name', 'gender')))
+
+		pages = list(marshalled.paginate(100, orderby='-age', memory=2000))
+		self.assertEqual([len(p) for p in pages], [100, 100, 50])
+		self.assertEqual([d.uuid for p in pages for d in p], [d.uuid for d in test.orderby('-age')])
+
+	def test_external_sort_types(self):
+		from underverse import SubVerse
+		# plain dicts and objects come back as they were given, like the in-memory sort
+		dicts = [{'n': i % 7, 'i': i} for i in range(50)]
+		self.assertEqual(list(SubVerse(dicts).orderby('-n', 'i', memory=50)), list(SubVerse(dicts).orderby('-n', 'i')))
+		self.assertEqual([type(d) for d in SubVerse(dicts).orderby('n', memory=50)], [dict] * 50)
+
+		comments = [Comment('c%d' % (i % 7)) for i in range(50)]
+		found = list(SubVerse(comments).orderby('-text', memory=50))
+		self.assertTrue(all(type(c) is Comment for c in found))
+		self.assertEqual([c.text for c in found], [c.text for c in SubVerse(comments).orderby('-text')])
+		groups = list(SubVerse(comments).groupby('text', memory=50))
+		self.assertEqual([(text, len(group)) for text, group in groups], [('c%d' % i, 8 if i == 0 else 7) for i in range(7)])
+
+	def test_external_sort_fanin(self):
+		import tempfile, shutil, resource
+		from underverse import external
+		from underverse.external import ExternalSort
+		from underverse.predicates import OrderBy
+		test = self.uv.test
+		docs = list(test) * 2
+		rows = [(OrderBy('-age').values()(d), test.codec.encode(d)) for d in docs]
+		expected = [d.uuid for d in sorted(docs, key=lambda d: d.age, reverse=True)]
+
+		# one document per run, several times more runs than files can be open
+		path = tempfile.mkdtemp()
+		limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+		try:
+			opened = len(os.listdir('/dev/fd')) if os.path.isdir('/dev/fd') else 0
+			resource.setrlimit(resource.RLIMIT_NOFILE, (opened + external.FANIN + 16, limits[1]))
+			sort = ExternalSort(OrderBy('-age'), 1, directory=path)
+			self.assertEqual([test.codec.decode(d)['uuid'] for d in sort.sort(iter(rows))], expected)
+			self.assertTrue(sort.runs > external.FANIN)
+			self.assertEqual(sort.passes, 1)
+			self.assertEqual(os.listdir(path), [])
+
+			# the files are removed when the results are dropped early
+			results = sort.sort(iter(rows))
+			results.next()
+			self.assertTrue(0 < len(os.listdir(path)) <= external.FANIN)
+			results.close()
+			self.assertEqual(os.listdir(path), [])
+		finally:
+			resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+			shutil.rmtree(path)
+		self.assertEqual([d.uuid for d in test.orderby('-age', memory=1)], [d.uuid for d in test.orderby('-age')])
+
 	def test_find_all(self):
 		self.test = self.uv.test
 		length = len(list(self.test))
@@ -431,6 +552,316 @@ class FindTestCase(unittest.TestCase):
 			self.assertTrue((x.age > 30 and x.age < 35) or (x.age > 60 and x.age < 65))
 			self.assertIn(x.name, ['Billy', 'Zaphod'])
 
+	def test_expression_tree(self):
+		from underverse import NecRow
+		from underverse.predicates import AND, OR
+		expression = OR(AND(Document.name == 'Zaphod', Document.age.btw(60, 65)), AND(Document.name == 'Billy', OR(Document.age == 31, lambda d: d.age > 90)))
+		self.assertTrue(expression.test(NecRow({'name': 'Billy', 'age': 31})))
+		self.assertTrue(expression.test(NecRow({'name': 'Billy', 'age': 95})))
+		self.assertFalse(expression.test(NecRow({'name': 'Zaphod', 'age': 31})))
+
+		docs = list(self.uv.test)
+		self.assertEqual(list(expression(docs)), [d for d in docs if expression.test(d)])
+
+		# the tree can be read by other backends
+		names = expression.fold(lambda f: f._name if hasattr(f, '_name') else 'udf', lambda e, values: '(%s)' % (' & ' if type(e) == AND else ' | ').join(values))
+		self.assertEqual(names, '((name & age) | (name & (age | udf)))')
+
+	def test_query(self):
+		import pickle
+		from underverse import NecRow
+		from underverse.predicates import Query, AND, OR
+		query = Query.of(Document.age > 30, OR(Document.name == 'Max', Document.name.in_(['Billy', 'Zaphod'])), Document.limit(5))
+		self.assertEqual(str(query), "(age > 30 AND (name == 'Max' OR name.in_(['Billy', 'Zaphod'])) AND slice(0, 5))")
+
+		# equal queries are equal keys
+		again = Query.of(Document.age > 30, OR(Document.name == 'Max', Document.name.in_(['Billy', 'Zaphod'])), Document.limit(5))
+		self.assertEqual(query, again)
+		self.assertEqual(len(set([query, again, Query.of(Document.age > 31)])), 2)
+
+		# queries and conditions can be pickled
+		copy = pickle.loads(pickle.dumps(query))
+		self.assertEqual(copy, query)
+		test = self.uv.test
+		self.assertEqual([d.uuid for d in test.find(*copy.filters())], [d.uuid for d in test.find(*query.filters())])
+		doc = pickle.loads(pickle.dumps(Document.name.match('M')))
+		self.assertEqual(len(test.find(doc)), len(test.find(Document.name.match('M'))))
+		self.assertTrue(pickle.loads(pickle.dumps(AND(Document.age > 30, Document.age < 40))).test(NecRow({'age': 35})))
+
+	def test_sql_compile(self):
+		from underverse.compiler import SQLCompiler
+		from underverse.predicates import AND, OR
+		compiler = SQLCompiler()
+
+		self.assertTrue(compiler.compile(Document.age > 30) is not None)
+		self.assertTrue(compiler.compile(Document.comment.text == 'hey1') is not None)
+		self.assertTrue(compiler.compile(OR(Document.age < 20, AND(Document.name == 'Max', Document.age.in_([30, 31])))) is not None)
+		self.assertTrue(compiler.compile(Document.name.udp(lambda x: True)) is None)
+		self.assertTrue(compiler.compile(Document.name.search('ax')) is None)
+		self.assertTrue(compiler.compile(OR(Document.age < 20, Document.name.match('M'))) is None)
+
+	def test_sql_matches_python(self):
+		from underverse import SubVerse
+		from underverse.predicates import AND, OR
+		test = self.uv.test
+		# json_extract returns objects and arrays as text, Python compares them by type
+		test.add([{'x': {'k': 1}}, {'x': [1, 2]}, {'x': 'str1'}, {'x': 'str3'}, {'x': '{"k":1}'}, {'x': 5}, {'x': None}])
+		test.add({'loc': {'geo': {'lat': 37}}})
+		test.add({'loc': {'geo': 'str2'}})
+		docs = list(test)
+
+		queries = [
+			lambda: [Document.age > 30],
+			lambda: [Document.age <= 30, Document.name != 'Max'],
+			lambda: [Document.age.btw(20, 40)],
+			lambda: [Document.name.in_(['Max', 'Billy'])],
+			lambda: [Document.name.nin(['Max', 'Billy'])],
+			lambda: [Document.name.in_(['Max'] * 300 + ['Zaphod'])],
+			lambda: [Document.gender],
+			lambda: [OR(AND(Document.name == 'Zaphod', Document.age.btw(30, 65)), Document.age == 31)],
+			lambda: [AND(Document.age > 25, Document.name.search('a'))],
+			lambda: [Document.age > 25, Document.name.udp(lambda x: 'a' in x)],
+			lambda: [Document.age > 25, Document.orderby('-age'), Document.limit(5)],
+			lambda: [Document.x >= 'str2'],
+			lambda: [Document.x <= 'str2'],
+			lambda: [Document.x == '{"k":1}'],
+			lambda: [Document.x != 'str1'],
+			lambda: [Document.x > 1],
+			lambda: [Document.x < 10],
+			lambda: [Document.x.btw(0, 10)],
+			lambda: [Document.x.btw('a', 'z')],
+			lambda: [Document.x.in_(['{"k":1}', '[1,2]', 5])],
+			lambda: [Document.x.nin(['{"k":1}', 'str1'])],
+			lambda: [Document.loc.geo > 'str1'],
+			lambda: [Document.loc.geo == '{"lat":37}'],
+			lambda: [Document.loc.geo != 'str2'],
+		]
+		for query in queries:
+			expected = [d.uuid for d in SubVerse(docs).find(*query())]
+			found = [d.uuid for d in test.find(*query())]
+			self.assertEqual(sorted(expected), sorted(found))
+
+		# strings are compared in SQL unless the attribute holds objects or arrays
+		compiler = test._compiler()
+		self.assertTrue(compiler.compile(Document.name >= 'M') is not None)
+		self.assertTrue(compiler.compile(Document.x >= 'str2') is None)
+		self.assertTrue(compiler.compile(Document.x > 1) is not None)
+
+	def test_sql_nested(self):
+		test = self.uv.test2
+		for i in range(5):
+			ed_user = User('ed', 'Ed Jones', '3d5_p455w0r6')
+			ed_user.comment = Comment('hey%s' % i)
+			test.add(ed_user)
+		test.add([Comment('hey1')])
+
+		self.assertEqual(len(test.find(Document.comment.text == 'hey1')), 1)
+		self.assertEqual(len(test.find(Document.text == 'hey1')), 1)
+
+	def test_nested_dicts(self):
+		test = self.uv.test2
+		test.add({'n' : 1, 'loc' : {'city' : 'SF', 'geo' : {'lat' : 37}}})
+		test.add({'n' : 2, 'loc' : {'city' : 'NY', 'geo' : {'lat' : None}}})
+		test.add({'n' : 3, 'loc' : [1, 2]})
+		test.add({'n' : 4})
+
+		queries = [
+			lambda: [Document.loc.city == 'SF'],
+			lambda: [Document.loc.city != 'SF'],
+			lambda: [Document.loc.city.in_(['SF', 'NY'])],
+			lambda: [Document.loc.geo.lat > 30],
+			lambda: [Document.loc.geo.lat < 30],
+		]
+		for query in queries:
+			found = sorted(d.n for d in test.find(*query()))
+			self.assertEqual(found, sorted(d.n for d in test.all().find(*query())))
+			self.assertEqual(found, sorted(d.n for d in test.find(Document.udf(lambda docs: docs), *query())))
+		self.assertEqual([d.n for d in test.all().find(Document.loc.city == 'SF')], [1])
+		self.assertEqual([d.n for d in test.all().find(Document.loc.geo.lat < 30)], [2])
+
+	def test_compiled_filters(self):
+		from underverse import SubVerse, NecRow
+		from underverse.evaluator import RowCompiler
+		from underverse.predicates import AND, OR
+		docs = list(self.uv.test)
+
+		def expected(*filters):
+			# each condition checked on its own, like find used to
+			result = docs
+			for f in filters:
+				if hasattr(f, '__predicate__'):
+					result = [d for d in result if (f._name in d or hasattr(d, f._name)) and f._predicate(d)]
+				else:
+					result = list(f(result))
+			return sorted(d.uuid for d in result)
+
+		queries = [
+			lambda: [Document.age > 20, Document.age <= 50, Document.name != 'Max', Document.name.search('a'), Document.age.nin([31, 32])],
+			lambda: [Document.name.match('B'), Document.name.udp(lambda x, c: c in x, 'i')],
+			lambda: [Document.missing == 5],
+			lambda: [Document.name.in_set(['Max', 'Billy']), Document.gender],
+			lambda: [OR(AND(Document.name == 'Zaphod', Document.age.btw(30, 65)), Document.age == 31, lambda d: d.age == 40)],
+			lambda: [Document.age > 25, Document.orderby('-age'), Document.limit(5), Document.name.nsearch('a')],
+		]
+		for query in queries:
+			self.assertEqual(sorted(d.uuid for d in SubVerse(docs).find(*query())), expected(*query()))
+
+		# one function for all the conditions
+		test = RowCompiler().fuse([Document.age.type(int), Document.tags.in_([['a'], 'b']), Document.comment.text.len(2)])
+		self.assertTrue(test(NecRow({'age': 1, 'tags': ['a'], 'comment': Comment('hi')})))
+		self.assertFalse(test(NecRow({'age': 1.0, 'tags': ['a'], 'comment': Comment('hi')})))
+		self.assertFalse(test(NecRow({'age': 1, 'tags': 'c', 'comment': Comment('hi')})))
+		self.assertFalse(test(NecRow({'age': 1, 'tags': 'b'})))
+
+	def test_stream(self):
+		test = self.uv.test
+		expected = [p.uuid for p in test.find(Document.age > 30, Document.name.search('a'))]
+
+		results = test.stream(Document.age > 30, Document.name.search('a'))
+		self.assertTrue(results._lazy)
+		self.assertEqual([p.uuid for p in results], expected)
+
+		# iterating again re-runs the query
+		self.assertEqual([p.uuid for p in results], expected)
+		self.assertTrue(results._lazy)
+
+		self.assertEqual(len(results), len(expected))
+		self.assertFalse(results._lazy)
+		self.assertEqual(results[0].uuid, expected[0])
+
+		# a 'lazy' attribute is still read from the documents
+		from underverse import SubVerse, NecRow
+		self.assertEqual(list(SubVerse([NecRow(lazy=1), NecRow(lazy=2)]).lazy), [1, 2])
+
+	def test_stream_limit_skip(self):
+		test = self.uv.test
+		expected = [p.uuid for p in test.find(Document.age > 30).skip(5).limit(10)]
+
+		results = test.stream(Document.age > 30).skip(5).limit(10)
+		self.assertTrue(results._lazy)
+		self.assertEqual([p.uuid for p in results], expected)
+		self.assertEqual(len(results), 10)
+
+	def test_stream_paginate(self):
+		test = self.uv.test
+		pages = list(test.stream(Document.age > 30).paginate(7))
+		self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+		self.assertEqual(sum(len(page) for page in pages), len(test.find(Document.age > 30)))
+
+	def test_iter_batches(self):
+		test = self.uv.test
+		expected = sorted(p.uuid for p in test.find(Document.age > 30))
+		batches = list(test.iter_batches(7, where=Document.age > 30))
+		self.assertTrue(all(len(batch) == 7 for batch in batches[:-1]))
+		self.assertEqual(sorted(p.uuid for batch in batches for p in batch), expected)
+
+		# conditions which run in Python
+		batches = list(test.iter_batches(7, where=[Document.age > 30, Document.age.udp(lambda a: True)]))
+		self.assertEqual(sorted(p.uuid for batch in batches for p in batch), expected)
+
+		rows = [row for batch in test.iter_batches(100, where=Document.age > 30, fields=['uuid', 'age']) for row in batch]
+		self.assertEqual(sorted(r[0] for r in rows), expected)
+		self.assertTrue(all(r[1] > 30 for r in rows))
+
+		data = [d for batch in test.iter_batches(100, decode=False) for d in batch]
+		self.assertEqual(len(data), len(test))
+		self.assertEqual(sorted(test.codec.decode(d)['uuid'] for d in data), sorted(p.uuid for p in test))
+		self.assertRaises(ValueError, lambda: list(test.iter_batches(0)))
+
+	def test_sql_limit_skip(self):
+		from underverse import SubVerse
+		test = self.uv.test
+		docs = list(test)
+
+		queries = [
+			lambda: [Document.limit(5)],
+			lambda: [Document.skip(245)],
+			lambda: [Document.age > 30, Document.skip(3), Document.limit(4)],
+			lambda: [Document.age > 30, Document.limit(10), Document.skip(4)],
+			lambda: [Document.age > 30, Document.limskip(2, 3), Document.limit(2)],
+			lambda: [Document.age > 30, Document.name.udp(lambda x: 'a' in x), Document.limit(4)],
+			lambda: [Document.limit(5), Document.age > 30],
+		]
+		for query in queries:
+			expected = [d.uuid for d in SubVerse(docs).find(*query())]
+			found = [d.uuid for d in test.find(*query())]
+			self.assertEqual(expected, found)
+			self.assertEqual(expected, [d.uuid for d in test.stream(*query())])
+
+	def test_find_one_reads_one(self):
+		codec = self.uv.test.codec
+		decoded = []
+		def decode(s):
+			decoded.append(s)
+			return type(codec).decode(codec, s)
+
+		codec.decode = decode
+		try:
+			self.assertTrue(self.uv.test.find_one(Document.age > 0) is not None)
+			self.assertEqual(len(decoded), 1)
+
+			del decoded[:]
+			# the udp only needs the name, so the other documents aren't decoded
+			self.assertTrue(self.uv.test.find_one(Document.name.udp(lambda x: True)) is not None)
+			self.assertEqual(len(decoded), 1)
+
+			del decoded[:]
+			self.assertEqual(len(self.uv.test.find(Document.name.udp(lambda x: x == 'Max'))), len(decoded))
+		finally:
+			del codec.decode
+
+	def test_lazy_rows(self):
+		from underverse import NecRow, LazyRow
+		test = self.uv.test
+		eager = dict((d.uuid, d) for d in test)
+		for row in test._select(lazy=('uuid', 'name')):
+			self.assertTrue(type(row) is LazyRow)
+			self.assertEqual(row.name, eager[row['uuid']].name)
+			self.assertTrue(type(row) is LazyRow)
+			self.assertEqual(row.age, eager[row.uuid].age)
+			self.assertTrue(type(row) is NecRow)
+			self.assertEqual(row, eager[row.uuid])
+
+		test.add({'name': 'Nested', 'age': 3, 'comment': Comment('hello'), 'active': True})
+		row = test._select(where="json_extract(data, '$.name') = 'Nested'", lazy=('active', 'comment')).next()
+		self.assertTrue(row.active is True)
+		self.assertEqual(getattr(row, 'comment.text'), 'hello')
+		row.age = 4
+		test.update(row)
+		self.assertEqual(test.find_one(Document.name == 'Nested').age, 4)
+
+		# a 'load' attribute isn't hidden by the row's own methods
+		test.add({'name': 'Loader', 'load': 5})
+		row = test._select(where="json_extract(data, '$.name') = 'Loader'", lazy=('name',)).next()
+		self.assertEqual(row.load, 5)
+		self.assertEqual([d.name for d in test.find(Document.name.udp(lambda x: x == 'Loader'), Document.load == 5)], ['Loader'])
+
+		self.assertEqual(list(test.name), [d.name for d in test])
+		self.assertEqual(sorted(test.unique('name')), sorted(set(d.name for d in test)))
+
+	def test_select(self):
+		test = self.uv.test
+		docs = list(test)
+		self.assertEqual(list(test.select('name', Document.age)), [(d.name, d.age) for d in docs])
+		self.assertEqual(list(test.select('name', where=Document.age > 30)), [(d.name,) for d in docs if d.age > 30])
+
+		where = [Document.age > 30, Document.name.udp(lambda x: 'a' in x), Document.limit(5)]
+		self.assertEqual(list(test.select('uuid', where=where)), [(d.uuid,) for d in test.find(*where)])
+
+		chunks = list(test.select('uuid', chunksize=100))
+		self.assertEqual([len(c) for c in chunks], [100, 100, 50])
+
+		test.add([{'name': 'Object', 'comment': Comment('hello'), 'tags': ['a', 'b'], 'active': False}])
+		self.assertEqual(list(test.select('comment.text', 'tags', 'active', where=Document.name == 'Object')), [('hello', ['a', 'b'], False)])
+		self.assertEqual(list(test.select('missing', where=Document.name == 'Object')), [(None,)])
+
+	def test_select_groupby(self):
+		from underverse import SubVerse
+		test = self.uv.test
+		expected = dict((tuple(g[:-1]), sorted(d.uuid for d in g[-1])) for g in SubVerse(list(test)).groupby('name', 'gender'))
+		found = dict((tuple(g[:-1]), sorted(d.uuid for d in g[-1])) for g in test.groupby('name', 'gender'))
+		self.assertEqual(found, expected)
+
 	def test_paginate(self):
 		test = self.uv.test_paging
 		for i in range(15):
@@ -0,0 +1,186 @@
+from underverse import Underverse, SubVerse
+from underverse.model import Document as D
+from underverse.predicates import Predicate as P
+from underverse.compiler import SQLCompiler
+import unittest, os
+
+class Comment(object):
+	"""docstring for Comment"""
+	def __init__(self, text):
+		super(Comment, self).__init__()
+		self.text = text
+
+class IndexTestCase(unittest.TestCase):
+	def setUp(self):
+		self.uv = Underverse()
+		self.uv.load('speed_test_smaller.sql')
+
+	def tearDown(self):
+		self.uv.close()
+
+	def plan(self, *filters):
+		where, params, remaining = SQLCompiler().split(filters)
+		return str(self.uv.connection.execute('explain query plan select data from test where ' + where, params).fetchall())
+
+	def test_create_index(self):
+		test = self.uv.test
+		name = test.create_index('age')
+		self.assertEqual(test.indexes(), {name: ['age']})
+		self.assertIn(name, self.plan(D.age == 30))
+
+	def test_compound_index(self):
+		test = self.uv.test
+		name = test.create_index('name', '-age')
+		self.assertIn(name, self.plan(D.name == 'Max', D.age > 30))
+
+		expected = [p.uuid for p in SubVerse(list(test)).find(D.name == 'Max', D.age > 30)]
+		found = [p.uuid for p in test.find(D.name == 'Max', D.age > 30)]
+		self.assertEqual(sorted(expected), sorted(found))
+
+	def test_nested_index(self):
+		test = self.uv.comments
+		for i in range(10):
+			test.add({'comment': Comment('hey%s' % i)})
+		test.create_index('comment.text')
+
+		u = test.find(D.comment.text == 'hey1')
+		self.assertEqual(len(u), 1)
+		self.assertEqual(u[0].comment.text, 'hey1')
+
+	def test_orderby_index(self):
+		test = self.uv.test
+		test.create_index('name', '-age')
+
+		expected = [p.uuid for p in P.orderby('name', '-age')(list(test))]
+		found = [p.uuid for p in test.orderby('name', '-age')]
+		self.assertEqual(expected, found)
+
+	def test_get_by(self):
+		test = self.uv.test
+		test.create_index('name')
+		self.assertEqual(test.get('Max', by='name').name, 'Max')
+		self.assertRaises(KeyError, test.get, 'Nobody', by='name')
+
+	def test_drop_index(self):
+		test = self.uv.test
+		test.create_index('age')
+		test.create_index('name')
+		test.drop_index('age')
+		self.assertEqual(test.indexes().values(), [['name']])
+		self.assertRaises(KeyError, test.drop_index, 'age')
+
+	def test_dump_load_index(self):
+		test = self.uv.test
+		name = test.create_index('age')
+		self.uv.dump('index_test.sql')
+
+		uv = Underverse()
+		uv.load('index_test.sql')
+		self.assertEqual(uv.test.indexes(), {name: ['age']})
+		self.assertEqual(list(uv), ['test'])
+		uv.close()
+		os.remove('index_test.sql')
+
+	def test_timestamp_columns(self):
+		events = self.uv.events
+		for i in range(20):
+			events.add({'i': i, 'created_at': 1000.0 + i, 'updated_at': 1000.0 + i})
+		columns = [r[1] for r in self.uv.connection.execute('pragma table_info(events)')]
+		self.assertEqual(columns, ['id', 'uuid', 'data', 'created_at', 'updated_at'])
+
+		where, params = events._plan([D.created_at >= 1015])[0]['where'], [1015]
+		plan = str(self.uv.connection.execute('explain query plan select data from events where ' + where, params).fetchall())
+		self.assertIn('events__created_at', plan)
+		self.assertEqual(sorted(e.i for e in events.find(D.created_at >= 1015)), range(15, 20))
+		self.assertEqual([e.i for e in events.orderby('-created_at')[:3]], [19, 18, 17])
+
+		e = events.find_one(D.i == 3)
+		events.update(e)
+		self.assertEqual([x.i for x in events.find(D.updated_at > 1020)], [3])
+
+		# a changed created_at is written to its column
+		e.created_at = 500.0
+		events.update(e)
+		self.assertEqual([x.i for x in events.find(D.created_at < 1000)], [3])
+		self.assertEqual([x.i for x in events.all().find(D.created_at < 1000)], [3])
+		e.created_at = 600.0
+		events.update([e])
+		self.assertEqual([x.created_at for x in events.find(D.created_at < 1000)], [600.0])
+
+	def test_migrate(self):
+		self.uv.connection.execute('create table old (uuid unique, data necro)')
+		old = self.uv.old
+		old.add([{'i': i, 'created_at': 1000.0 + i} for i in range(10)])
+		old.create_index('i')
+		self.assertEqual(len(old.find(D.created_at < 1005)), 5)
+
+		self.assertIn('old', self.uv.migrate())
+		self.assertEqual(self.uv.migrate(), [])
+		columns = [r[1] for r in self.uv.connection.execute('pragma table_info(old)')]
+		self.assertEqual(columns, ['id', 'uuid', 'data', 'created_at', 'updated_at'])
+		self.assertEqual(sorted(o.i for o in old.find(D.created_at < 1005)), range(5))
+		self.assertEqual(len(old), 10)
+		self.assertIn('old__i', str(self.uv.connection.execute("select name from sqlite_master where type='index' and tbl_name='old'").fetchall()))
+
+		self.uv.connection.execute('create table marshal (uuid unique, data necro)')
+		marshal = self.uv.new('marshal', codec='marshal')
+		marshal.add([{'i': i, 'created_at': 1000.0 + i} for i in range(10)])
+		self.assertTrue(marshal.migrate())
+		self.assertEqual(sorted(m.i for m in marshal.find(D.created_at >= 1008)), [8, 9])
+		self.assertEqual([m.i for m in marshal.orderby('-created_at')[:2]], [9, 8])
+
+	def text_index(self):
+		try:
+			self.uv.connection.execute("create virtual table temp.fts5_check using fts5(a, tokenize='trigram')")
+			self.uv.connection.execute("drop table temp.fts5_check")
+		except Exception:
+			self.skipTest("SQLite was built without FTS5 or the trigram tokenizer")
+		logs = self.uv.logs
+		logs.add([{'message': 'disk full on %s' % h, 'host': h} for h in ('db01', 'db02', 'web01')])
+		logs.add({'message': 'connection refused', 'host': 'web02'})
+		logs.create_text_index('message', 'host')
+		return logs
+
+	def test_text_index(self):
+		logs = self.text_index()
+		self.assertEqual(sorted(l.host for l in logs.search('full disk')), ['db01', 'db02', 'web01'])
+		self.assertEqual([l.host for l in logs.search('db0', fields=['host'])], ['db01', 'db02'])
+		self.assertEqual([l.host for l in logs.search('web', limit=1, fields=[D.host])], ['web01'])
+		self.assertRaises(ValueError, logs.search, 'disk', fields=['level'])
+		self.assertNotIn('logs__text', list(self.uv))
+
+		# only the indexed attributes are searched
+		self.assertEqual(len(logs.glob('message')), 0)
+		self.assertEqual(sorted(l.host for l in logs.glob('*web*')), ['web01', 'web02'])
+		self.assertEqual(sorted(l.host for l in logs.glob('DISK', case_sensitive=False)), ['db01', 'db02', 'web01'])
+		self.assertEqual(sorted(l.host for l in logs.glob('db0?')), ['db01', 'db02'])
+
+		log = logs.find_one(D.host == 'web02')
+		log.message = 'all good'
+		logs.update(log)
+		self.assertEqual([l.host for l in logs.search('good')], ['web02'])
+		self.assertEqual(len(logs.search('refused')), 0)
+		logs.remove(log)
+		self.assertEqual(len(logs.search('good')), 0)
+
+		logs.drop_text_index()
+		self.assertRaises(ValueError, logs.search, 'disk')
+		self.assertEqual(len(logs.glob('message')), 3)
+
+	def test_dump_load_text_index(self):
+		self.text_index()
+		self.uv.dump('text_index.sql')
+		try:
+			uv = Underverse()
+			uv.load('text_index.sql')
+			self.assertEqual(sorted(l.host for l in uv.logs.search('disk')), ['db01', 'db02', 'web01'])
+			uv.logs.add({'message': 'disk error', 'host': 'db03'})
+			self.assertEqual(len(uv.logs.search('disk')), 4)
+			uv.close()
+		finally:
+			os.remove('text_index.sql')
+
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(IndexTestCase)
+	unittest.TextTestRunner(verbosity=2).run(suite)
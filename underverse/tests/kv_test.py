@@ -80,6 +80,129 @@ class KeyValueTestCase(unittest.TestCase):
 		self.assertTrue(test)
 
 
+	def test_quoted_keys(self):
+		self.test = self.uv.test
+		self.test.put("it's", 'say "hello"')
+		self.assertEqual(self.test.get("it's").value, 'say "hello"')
+
+		doc = self.test.get("it's")
+		doc.value = "it's \"quoted\""
+		self.test.update(doc)
+		self.assertEqual(self.test.get("it's").value, "it's \"quoted\"")
+		self.assertEqual(len(self.test.glob("'quoted")), 0)
+		self.assertEqual(len(self.test.glob("it's")), 1)
+
+		self.assertEqual(self.test.remove("it's"), 1)
+		self.assertRaises(KeyError, self.test.get, "it's")
+
+	def test_get_many(self):
+		self.test = self.uv.test
+		for i in range(10):
+			self.test.put('key%d' % i, i)
+		found = self.test.get_many(['key3', 'missing', 'key1', 'key3'])
+		self.assertEqual([f.value if f is not None else None for f in found], [3, None, 1, 3])
+		self.assertEqual(self.test.get_many([]), [])
+
+		plan = str(self.uv.connection.execute('explain query plan select k.key, v.data from json_each(?) k cross join test v on v.uuid = k.value', ('["key1"]',)).fetchall())
+		self.assertIn('INDEX', plan)
+
+		# reading doesn't commit the caller's writes
+		self.uv.connection.execute("delete from test where uuid = 'key1'")
+		self.assertEqual(self.test.get_many(['key1', 'key2'])[0], None)
+		self.uv.connection.rollback()
+		self.assertEqual(self.test.get_many(['key1'])[0].value, 1)
+
+	def test_remove_many(self):
+		self.test = self.uv.test
+		for i in range(10):
+			self.test.put('key%d' % i, i)
+		self.assertEqual(self.test.remove_many(['key%d' % i for i in range(5)]), 5)
+		self.assertEqual(self.test.remove(self.test.get_many(['key5', 'key6'])), 2)
+		self.assertEqual(sorted(d.uuid for d in self.test), ['key7', 'key8', 'key9'])
+
+	def test_store(self):
+		options = self.uv.kv('options')
+		self.assertTrue(self.uv.options is options)
+		options.put('DEVMODES', {'TEST':0,'DEV':1,'PROD':2})
+		options.put('count', 5)
+		options.put('name', 'ed')
+		options.put('flag', True)
+		options.put('none', None)
+		self.assertEqual(options.get('DEVMODES').value, {'TEST':0,'DEV':1,'PROD':2})
+		self.assertEqual(options.get('DEVMODES').PROD, 2)
+		self.assertEqual(options.get('DEVMODES.DEV'), 1)
+		self.assertEqual(options.get('count').value, 5)
+		self.assertEqual(options.get('name').value, 'ed')
+		self.assertTrue(options.get('flag').value is True)
+		self.assertTrue(options.get('none').value is None)
+		self.assertRaises(KeyError, options.get, 'missing')
+		self.assertRaises(TypeError, options.put, 5, 5)
+		self.assertEqual(len(options), 5)
+		self.assertTrue('count' in options)
+		self.assertFalse('missing' in options)
+
+		# the raw values are stored as they are, without a rowid
+		row = self.uv.connection.execute('select value, encoded from options where key = ?', ('count',)).fetchone()
+		self.assertEqual(tuple(row), (5, 0))
+		sql = self.uv.connection.execute("select sql from sqlite_master where name = 'options'").fetchone()[0]
+		self.assertIn('WITHOUT ROWID', sql.upper())
+
+		# the store is found in the catalog, collections can't be turned into one
+		self.uv.connection._verses.clear()
+		self.assertEqual(self.uv.options.get('count').value, 5)
+		self.uv.docs.add({'a': 1})
+		self.assertRaises(ValueError, self.uv.kv, 'docs')
+
+	def test_store_batch(self):
+		options = self.uv.kv('options')
+		options.mput({'user:1': 'ed', 'user:2': 'al', 'theme': 'dark'})
+		options.mput([('user:3', {'name': 'jo'}), ('user:10', [1, 2])])
+		self.assertEqual(options.mget(['user:1', 'theme', 'missing', 'user:1']), ['ed', 'dark', None, 'ed'])
+		self.assertEqual(options.mget(['missing'], default=0), [0])
+		self.assertEqual(options.mget([]), [])
+
+		self.assertEqual([k for k, v in options.scan(prefix='user:')], ['user:1', 'user:10', 'user:2', 'user:3'])
+		self.assertEqual(options.scan(prefix='user:3').next(), ('user:3', {'name': 'jo'}))
+		self.assertEqual([k for k, v in options.scan(start='user:10', end='user:3')], ['user:10', 'user:2'])
+		self.assertEqual([k for k, v in options.scan(reverse=True, limit=2)], ['user:3', 'user:2'])
+		self.assertEqual(len(list(options.scan())), 5)
+
+		self.assertEqual(options.mdelete(['user:1', 'user:2', 'missing']), 2)
+		self.assertTrue(options.delete('theme'))
+		self.assertFalse(options.delete('theme'))
+		self.assertEqual(options.mget(['user:1', 'theme']), [None, None])
+		self.assertEqual(len(options), 2)
+
+	def test_store_cache(self):
+		options = self.uv.kv('options', cache=2)
+		options.mput({'a': 1, 'b': 2, 'c': 3})
+		self.assertEqual(options.mget(['a', 'b', 'c']), [1, 2, 3])
+		self.assertEqual(options._cache.keys(), ['b', 'c'])
+		options.get('b')
+		self.assertEqual(options._cache.keys(), ['c', 'b'])
+
+		# writes invalidate the cached values
+		options.put('b', 20)
+		self.assertEqual(options.get('b').value, 20)
+		options.mput({'c': 30})
+		self.assertEqual(options.mget(['c']), [30])
+
+		# so do writes which don't go through the store, and rolled back batches
+		self.uv.connection.execute("update options set value = 300 where key = 'c'")
+		self.assertEqual(options.get('c').value, 300)
+		try:
+			with self.uv.connection.batch():
+				options.put('c', 3000)
+				self.assertEqual(options.get('c').value, 3000)
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(options.get('c').value, 300)
+
+		options = self.uv.kv('options', cache=0)
+		options.get('a')
+		self.assertEqual(len(options._cache), 0)
+
 if __name__ == '__main__':
 
 	suite = unittest.TestLoader().loadTestsFromTestCase(KeyValueTestCase)
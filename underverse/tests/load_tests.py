@@ -335,6 +335,287 @@ class LoadTestCase(unittest.TestCase):
 		self.assertTrue(type(d.time) == datetime.time)
 
 
+	def test_batch(self):
+		import sqlite3, tempfile, shutil
+		path = tempfile.mkdtemp()
+		try:
+			uv = Underverse(os.path.join(path, 'batch.db'))
+			users = uv.users
+			reader = sqlite3.connect(os.path.join(path, 'batch.db'))
+			count = lambda: reader.execute('select count(*) from users').fetchone()[0]
+
+			with users.batch():
+				for i in range(10):
+					self.assertEqual(users.add({'i': i}), 1)
+				self.assertEqual(len(users), 10)
+				self.assertEqual(count(), 0)
+			self.assertEqual(count(), 10)
+
+			with uv.batch(every=4):
+				for i in range(10):
+					users.add({'i': i})
+				self.assertEqual(count(), 18)
+			self.assertEqual(count(), 20)
+			reader.close()
+			uv.close()
+		finally:
+			shutil.rmtree(path)
+
+	def test_writer(self):
+		import tempfile, shutil, threading
+		path = tempfile.mkdtemp()
+		try:
+			uv = Underverse(os.path.join(path, 'writer.db'))
+			events = uv.events
+			self.assertRaises(ValueError, self.uv.events.writer)
+
+			with events.writer(size=50, interval=0.05, maxsize=20) as writer:
+				futures = []
+				def produce(n):
+					for i in range(100):
+						futures.append(writer.add({'producer': n, 'i': i}))
+				threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+				for t in threads:
+					t.start()
+				for t in threads:
+					t.join()
+				self.assertEqual(writer.add([{'i': -1}, {'i': -2}]).result(5), 2)
+				writer.flush(5)
+				self.assertEqual(len(events), 402)
+				self.assertTrue(all(f.done() and f.result() == 1 for f in futures))
+
+				# only the documents which can't be written fail
+				first = writer.add({'uuid': 'same', 'i': 1})
+				second = writer.add({'uuid': 'same', 'i': 2})
+				writer.flush(5)
+				self.assertEqual(first.result(), 1)
+				self.assertTrue(second.exception() is not None)
+				self.assertEqual(writer.written, 403)
+			self.assertRaises(ValueError, writer.add, {'i': 0})
+			self.assertEqual(len(events), 403)
+			self.assertEqual(events.stats()['count'], 403)
+			uv.close()
+		finally:
+			shutil.rmtree(path)
+
+	def test_readers(self):
+		import tempfile, shutil, threading
+		path = tempfile.mkdtemp()
+		try:
+			self.assertRaises(ValueError, Underverse, readers=True)
+			uv = Underverse(os.path.join(path, 'readers.db'), readers=True)
+			self.assertEqual(uv.connection.execute('pragma journal_mode').fetchone()[0], 'wal')
+			users = uv.users
+			users.add([{'name': 'user%d' % i, 'age': i} for i in range(100)])
+
+			# nested reads each have their own cursor
+			count = 0
+			for user in users:
+				count += len(users.find(Document.age == user.age))
+			self.assertEqual(count, 100)
+
+			results = {}
+			def read(n):
+				results[n] = (len(users.find(Document.age < 50)), users.get(str(users.find_one(Document.age == n).uuid)).age,
+					len(users), len(list(users)), len(users.all()), users.stats()['count'], list(uv))
+			with uv.batch():
+				users.add({'name': 'uncommitted', 'age': 0})
+				# the batch's changes are read from the writer's connection
+				self.assertEqual(len(users.find(Document.age < 50)), 51)
+				threads = [threading.Thread(target=read, args=(n,)) for n in range(4)]
+				for t in threads:
+					t.start()
+				for t in threads:
+					t.join()
+			self.assertEqual(results, dict((n, (50, n, 100, 100, 100, 100, ['users'])) for n in range(4)))
+			self.assertEqual(len(users.find(Document.age < 50)), 51)
+			self.assertTrue(len(uv.connection.readers) >= 4)
+			uv.close()
+			self.assertEqual(len(uv.connection.readers), 0)
+		finally:
+			shutil.rmtree(path)
+
+	def test_batch_rollback(self):
+		users = self.uv.users
+		users.add({'name': 'first'})
+		try:
+			with self.uv.batch():
+				users.add([{'name': 'second'}, {'name': 'third'}])
+				self.uv.accounts.add({'name': 'new collection'})
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual([u.name for u in users], ['first'])
+		self.assertNotIn('accounts', list(self.uv))
+
+		with users.batch():
+			users.add({'name': 'second'})
+			try:
+				with users.batch():
+					users.add({'name': 'third'})
+					raise ValueError
+			except ValueError:
+				pass
+		self.assertEqual([u.name for u in users], ['first', 'second'])
+
+	def test_tune(self):
+		import tempfile, shutil
+		path = tempfile.mkdtemp()
+		try:
+			uv = Underverse(os.path.join(path, 'tune.db'), profile='analytics')
+			pragma = lambda name: uv.connection.execute('pragma %s' % name).fetchone()[0]
+			self.assertEqual(pragma('cache_size'), -262144)
+			self.assertEqual(pragma('temp_store'), 2)
+
+			previous = uv.tune('bulk_load', cache_size=-1024)
+			self.assertEqual(previous['cache_size'], -262144)
+			self.assertEqual(pragma('journal_mode'), 'memory')
+			self.assertEqual(pragma('synchronous'), 0)
+			self.assertEqual(pragma('cache_size'), -1024)
+
+			uv.tune(**previous)
+			self.assertEqual(pragma('journal_mode'), 'delete')
+			self.assertEqual(pragma('cache_size'), -262144)
+
+			self.assertRaises(ValueError, uv.tune, 'unknown')
+			self.assertRaises(ValueError, uv.tune, journal_mode='delete; drop table x')
+			self.assertRaises(ValueError, uv.tune, foreign_keys=1)
+			uv.close()
+		finally:
+			shutil.rmtree(path)
+
+	def test_bulk_load(self):
+		users = self.uv.users
+		users.create_index('age')
+		indexes = lambda: [r[0] for r in self.uv.connection.execute("select name from sqlite_master where type='index' and tbl_name='users' and sql is not null")]
+
+		with users.bulk_load():
+			self.assertEqual(indexes(), [])
+			users.add([{'age': i, 'name': str(i)} for i in range(100)])
+			users.create_index('name')
+			self.assertEqual(indexes(), [])
+			self.assertEqual(self.uv.connection.execute('pragma synchronous').fetchone()[0], 0)
+
+		self.assertEqual(sorted(indexes()), ['users__age', 'users__created_at', 'users__name', 'users__updated_at'])
+		self.assertEqual(len(users.find(Document.age < 10)), 10)
+
+		try:
+			with users.bulk_load():
+				users.add({'age': 1000})
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(len(users), 100)
+		self.assertEqual(sorted(indexes()), ['users__age', 'users__created_at', 'users__name', 'users__updated_at'])
+
+	def test_cached_verse(self):
+		users = self.uv.users
+		self.assertIs(self.uv.users, users)
+		self.assertIs(self.uv.new('users'), users)
+
+		users.add({'name': 'first'})
+		self.assertEqual(users.version, 1)
+		self.assertEqual(len(users), 1)
+
+		# writes which don't go through the handle are still counted
+		self.uv.connection.execute('delete from users')
+		self.uv.connection.commit()
+		self.assertEqual(len(users), 0)
+		self.assertEqual(users.version, 1)
+
+		users.create_index('name')
+		self.assertEqual(self.uv.users.indexes(), {'users__name': ['name']})
+
+		try:
+			with self.uv.batch():
+				self.uv.accounts.add({'name': 'new collection'})
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(len(self.uv.accounts), 0)
+
+	def test_stats(self):
+		users = self.uv.users
+		users.add([{'age': i % 50, 'name': 'user %d' % i} for i in range(1000)])
+		stats = users.stats()
+		self.assertEqual(stats['count'], 1000)
+		self.assertEqual(len(users), 1000)
+		self.assertTrue(stats['size'] > 0)
+		self.assertEqual(stats['fields']['age']['count'], 1000)
+		self.assertEqual(stats['fields']['age']['distinct'], 50)
+		self.assertEqual((stats['fields']['age']['min'], stats['fields']['age']['max']), (0, 49))
+		self.assertTrue(700 < stats['fields']['name']['distinct'] < 1300)
+		self.assertEqual(stats['fields']['name']['min'], None)
+
+		self.assertEqual(users.remove_many(users.find(Document.age < 10)), 200)
+		self.assertEqual(users.stats()['count'], 800)
+		self.assertEqual(len(users), 800)
+
+		try:
+			with self.uv.batch():
+				users.add({'age': 1000})
+				self.assertEqual(len(users), 801)
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(len(users), 800)
+
+		stats = users.stats(refresh=True)
+		self.assertEqual(stats['sampled'], 800)
+		self.assertEqual(stats['fields']['age']['min'], 10)
+
+		users.purge()
+		self.assertEqual(users.stats(), {'count': 0, 'size': 0, 'sampled': 0, 'fields': {}})
+
+	def test_stats_saved(self):
+		import tempfile, shutil
+		from underverse.catalog import Catalog
+		path = tempfile.mkdtemp()
+		try:
+			uv = Underverse(os.path.join(path, 'stats.db'))
+			for i in range(10):
+				uv.users.add({'age': i})
+			other = Underverse(os.path.join(path, 'stats.db'))
+			# the count is saved on every commit, the attribute statistics later
+			self.assertEqual(len(other.users), 10)
+			self.assertEqual(Catalog(other.connection).get('users', 'count')[0], 10)
+			self.assertEqual(Catalog(other.connection).get('users', 'stats'), None)
+
+			with uv.batch():
+				uv.users.add({'age': 10})
+			self.assertEqual(other.users.stats()['fields']['age']['max'], 10)
+
+			uv.users.add({'age': 11})
+			uv.close()
+			self.assertEqual(other.users.stats()['fields']['age']['max'], 11)
+			other.close()
+		finally:
+			shutil.rmtree(path)
+
+	def test_stats_failed_add(self):
+		import sqlite3
+		users = self.uv.users
+		users.add({'name': 'Max', 'age': 30})
+		doc = users.find_one(Document.name == 'Max')
+		users.add({'name': 'Billy', 'age': 40})
+		self.assertRaises(sqlite3.IntegrityError, users.add, doc)
+		self.assertEqual(len(users), 2)
+		self.assertEqual(users.stats()['fields']['name']['count'], 2)
+
+		# the documents written before the error are counted again
+		self.assertRaises(sqlite3.IntegrityError, users.add, [{'name': 'Zaphod', 'age': 50}, doc])
+		count = self.uv.connection.execute('select count(*) from users').fetchone()[0]
+		self.assertEqual(len(users), count)
+		self.assertEqual(users.stats()['fields']['age']['max'], 40)
+
+	def test_stats_old_format(self):
+		from underverse.stats import Stats
+		# saved before the other values were counted
+		stats = Stats.load({'count': 1, 'size': 10, 'sampled': 1, 'fields': {'x': [1, None, None, []]}})
+		stats.add({'x': {'k': 1}}, 10)
+		self.assertEqual(stats.count, 2)
+		self.assertFalse(stats.scalar('x'))
+
 if __name__ == '__main__':
 
 	# class Comment(object):
@@ -290,6 +290,54 @@ class MapReduceTestCase(unittest.TestCase):
 				self.assertTrue(name >= prev)
 			prev = name
 
+	def aggregates(self, results):
+		out = {}
+		for row in results:
+			out[tuple(row[:-1])] = row[-1]
+		return out
+
+	def assertAggregatesEqual(self, found, expected):
+		found, expected = self.aggregates(found), self.aggregates(expected)
+		self.assertEqual(sorted(found), sorted(expected))
+		for key in expected:
+			if type(expected[key]) == dict:
+				for name in expected[key]:
+					self.assertAlmostEqual(found[key][name], expected[key][name])
+			else:
+				self.assertAlmostEqual(found[key], expected[key])
+
+	def test_aggregate(self):
+		self.test = self.uv.test
+		docs = SubVerse(list(self.test))
+		for gender, count in self.test.aggregate(by='gender', count=True):
+			self.assertEqual(count, len(docs.find(D.gender == gender)))
+
+		kwargs = dict(by=['gender', 'college'], count=True, sum='friends', avg=['age', 'friends'], min='age', max='age')
+		self.assertAggregatesEqual(self.test.aggregate(**kwargs), docs.aggregate(**kwargs))
+
+		total = self.test.aggregate(sum='friends')
+		self.assertEqual(total, [[sum(docs.friends)]])
+
+		# no documents, no groups
+		for kwargs in [dict(sum='friends'), dict(count=True, max='age'), dict(by='gender', count=True)]:
+			self.assertEqual(self.test.aggregate(where=D.age > 1000, **kwargs), [])
+			self.assertEqual(docs.aggregate(where=D.age > 1000, **kwargs), [])
+
+	def test_aggregate_where(self):
+		self.test = self.uv.test
+		docs = SubVerse(list(self.test))
+		for where in [D.age > 30, [D.age > 30, D.name.udp(lambda x: 'a' in x)], [D.age > 30, D.limit(20)]]:
+			kwargs = dict(by='name', where=where, count=True, avg='age')
+			self.assertAggregatesEqual(self.test.aggregate(**kwargs), docs.aggregate(**kwargs))
+
+	def test_aggregate_obj(self):
+		self.test = self.uv.test_obj
+		docs = SubVerse(list(self.test))
+		kwargs = dict(by='gender', count=True, max='friends')
+		self.assertAggregatesEqual(self.test.aggregate(**kwargs), docs.aggregate(**kwargs))
+		self.assertRaises(TypeError, self.test.aggregate, by='gender')
+		self.assertRaises(TypeError, self.test.aggregate, by='gender', median='age')
+
 if __name__ == '__main__':
 
 	# Underverse.create_mappers(Person)
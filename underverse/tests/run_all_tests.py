@@ -3,6 +3,9 @@ from load_tests import LoadTestCase
 from find_tests import FindTestCase
 from mapreduce_tests import MapReduceTestCase
 from kv_test import KeyValueTestCase
+from index_tests import IndexTestCase
+from codec_tests import CodecTestCase
+from aio_tests import AsyncTestCase
 from underverse import Underverse
 from underverse.model import Document
 from test_data_gen import Person
@@ -33,5 +36,8 @@ if __name__ == '__main__':
   suite2 = unittest.TestLoader().loadTestsFromTestCase(FindTestCase)
   suite3 = unittest.TestLoader().loadTestsFromTestCase(MapReduceTestCase)
   suite4 = unittest.TestLoader().loadTestsFromTestCase(KeyValueTestCase)
+  suite5 = unittest.TestLoader().loadTestsFromTestCase(IndexTestCase)
+  suite6 = unittest.TestLoader().loadTestsFromTestCase(CodecTestCase)
+  suite7 = unittest.TestLoader().loadTestsFromTestCase(AsyncTestCase)
   # unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite([suite1, suite2, suite3]))
-  unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite([suite1, suite2, suite3, suite4]))
+  unittest.TextTestRunner(verbosity=2).run(unittest.TestSuite([suite1, suite2, suite3, suite4, suite5, suite6, suite7]))
@@ -18,6 +18,17 @@ def load(collection, num):
 		collection.add(p)
 	return "%s - %0.5f elapsed" % (num, clock() - start)
 
+def load_batch(collection, num):
+	test.purge()
+
+	ppl = [Person().__dict__ for p in range(num)]
+
+	start = clock()
+	with collection.batch():
+		for p in ppl:
+			collection.add(p)
+	return "%s - %0.5f elapsed" % (num, clock() - start)
+
 def load_bulk(collection, num, buffer=150000):
 	test.purge()
 	data = []
@@ -38,6 +49,7 @@ def load_bulk(collection, num, buffer=150000):
 def timing(col, num, fast_only=False, buffer=150000):
 	if not fast_only:
 		print "load:      ", load(col, num)
+		print "load_batch:", load_batch(col, num)
 	print "load_bulk: ", load_bulk(col, num, buffer)
 	print
 